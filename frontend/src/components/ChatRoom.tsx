@@ -12,10 +12,11 @@ import TypingIndicator from './TypingIndicator';
 
 interface ChatRoomProps {
   salaId: number;
+  usuarioId?: number;
   className?: string;
 }
 
-const ChatRoom: React.FC<ChatRoomProps> = ({ salaId, className = '' }) => {
+const ChatRoom: React.FC<ChatRoomProps> = ({ salaId, usuarioId, className = '' }) => {
   // Estado local
   const [sala, setSala] = useState<SalaChat | null>(null);
   const [participantes, setParticipantes] = useState<ParticipacaoChat[]>([]);
@@ -42,6 +43,7 @@ const ChatRoom: React.FC<ChatRoomProps> = ({ salaId, className = '' }) => {
     onDisconnect,
   } = useWebSocket({
     salaId,
+    usuarioId,
     autoConnect: true,
     reconnectAttempts: 5,
   });
@@ -108,11 +110,13 @@ const ChatRoom: React.FC<ChatRoomProps> = ({ salaId, className = '' }) => {
   useEffect(() => {
     const unsubscribe = onMessage((message) => {
       switch (message.type) {
-        case 'user_status':
+        case 'presence_snapshot':
           // Atualizar lista de participantes quando alguém entra/sai
-          ChatService.listarParticipantes(salaId)
-            .then(setParticipantes)
-            .catch(console.error);
+          if (message.usuarios?.some(usuario => usuario.online !== undefined)) {
+            ChatService.listarParticipantes(salaId)
+              .then(setParticipantes)
+              .catch(console.error);
+          }
           break;
 
         case 'system_notification':
@@ -12,6 +12,7 @@ import {
 
 interface UseWebSocketOptions {
   salaId?: number;
+  usuarioId?: number;  // usuário logado, ignorado nos snapshots de digitação
   autoConnect?: boolean;
   reconnectAttempts?: number;
   reconnectDelay?: number;
@@ -51,6 +52,7 @@ interface UseWebSocketReturn {
 export const useWebSocket = (options: UseWebSocketOptions = {}): UseWebSocketReturn => {
   const {
     salaId: initialSalaId,
+    usuarioId,
     autoConnect = false,
     reconnectAttempts = 3,
     reconnectDelay = 3000,
@@ -188,20 +190,29 @@ export const useWebSocket = (options: UseWebSocketOptions = {}): UseWebSocketRet
               }
               break;
 
-            case 'user_typing':
-              if (message.usuario_id && message.usuario_nome) {
-                setUsuariosDigitando(prev => {
-                  const filtered = prev.filter(u => u.usuario_id !== message.usuario_id);
-                  if (message.is_typing) {
-                    return [...filtered, {
-                      usuario_id: message.usuario_id!,
-                      usuario_nome: message.usuario_nome!,
+            case 'presence_snapshot':
+              setUsuariosDigitando(prev => {
+                let atualizados = prev;
+                (message.usuarios || []).forEach(usuario => {
+                  if (usuario.usuario_id === usuarioId) {
+                    return;
+                  }
+                  // Quem saiu da sala também parou de digitar
+                  const digitando = usuario.online === false ? false : usuario.digitando;
+                  if (digitando === undefined) {
+                    return;
+                  }
+                  atualizados = atualizados.filter(u => u.usuario_id !== usuario.usuario_id);
+                  if (digitando) {
+                    atualizados = [...atualizados, {
+                      usuario_id: usuario.usuario_id,
+                      usuario_nome: usuario.usuario_nome,
                       timestamp: Date.now()
                     }];
                   }
-                  return filtered;
                 });
-              }
+                return atualizados;
+              });
               break;
 
             case 'error':
@@ -224,7 +235,7 @@ export const useWebSocket = (options: UseWebSocketOptions = {}): UseWebSocketRet
       console.error('Erro ao criar WebSocket:', error);
       setStatus(ConnectionStatus.ERROR);
     }
-  }, [reconnectAttempts, reconnectDelay, iniciarHeartbeat, clearTimers]);
+  }, [usuarioId, reconnectAttempts, reconnectDelay, iniciarHeartbeat, clearTimers]);
 
   // Desconectar WebSocket
   const disconnect = useCallback(() => {
@@ -95,18 +95,23 @@ export interface Mensagem {
 
 // Tipos para WebSocket
 export interface WebSocketMessage {
-  type: 'chat_message' | 'user_status' | 'user_typing' | 'system_notification' | 'error' | 'pong' | 'whisper_message' | 'messages_marked_read';
+  type: 'chat_message' | 'presence_snapshot' | 'system_notification' | 'error' | 'pong' | 'whisper_message' | 'messages_marked_read';
   mensagem?: Mensagem;
   message?: string;
-  action?: 'entrou' | 'saiu';
-  usuario_id?: number;
-  usuario_nome?: string;
-  is_typing?: boolean;
+  usuarios?: PresencaUsuario[];
   level?: 'info' | 'warning' | 'error' | 'success';
   timestamp?: string;
   destinatario_id?: number;
 }
 
+// Mudança de presença de um usuário num presence_snapshot (só os campos alterados)
+export interface PresencaUsuario {
+  usuario_id: number;
+  usuario_nome: string;
+  online?: boolean;
+  digitando?: boolean;
+}
+
 export interface WebSocketSendMessage {
   action: 'send_message' | 'execute_command' | 'typing' | 'mark_read' | 'ping';
   message?: string;
@@ -5,19 +5,37 @@ Suporta OpenAI, Anthropic Claude e outros provedores
 
 import asyncio
 import aiohttp
+import hashlib
 import json
 import logging
+import threading
+import weakref
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 from dataclasses import dataclass
 from datetime import datetime
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import caches, InvalidCacheBackendError
+
+from .conversation import Conversa, PAPEL_ASSISTENTE, PAPEL_USUARIO
+from .rate_limiter import (
+    LimitadorTaxa, registrar_custo_campanha, verificar_orcamento_campanha
+)
+from .resilience import CircuitBreaker, ControleTimeout
+from .tokenizer import contar_tokens, orcamento_prompt
 
 
 logger = logging.getLogger(__name__)
 
 
+def obter_cache_ia():
+    """Cache compartilhado das respostas de IA (alias 'ia_gm', ou o padrão se ausente)"""
+    try:
+        return caches['ia_gm']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
 @dataclass
 class RespostaIA:
     """Resposta padronizada de qualquer provedor de IA"""
@@ -32,28 +50,130 @@ class RespostaIA:
 class BaseIAProvider(ABC):
     """Interface base para todos os provedores de IA"""
     
-    def __init__(self, api_key: str, modelo: str):
+    # Limites padrão do pool de conexões HTTP (sobrescritos por provedor)
+    LIMITE_CONEXOES = 100
+    LIMITE_CONEXOES_POR_HOST = 20
+    KEEPALIVE_TIMEOUT = 60  # segundos
+    TIMEOUT_CONEXAO = 10  # segundos para abrir a conexão TCP/TLS
+    
+    def __init__(
+        self,
+        api_key: str,
+        modelo: str,
+        limite_conexoes: Optional[int] = None,
+        limite_por_host: Optional[int] = None,
+        keepalive_timeout: Optional[float] = None
+    ):
         self.api_key = api_key
         self.modelo = modelo
-        self.session = None
+        self.limite_conexoes = limite_conexoes or self.LIMITE_CONEXOES
+        self.limite_por_host = limite_por_host or self.LIMITE_CONEXOES_POR_HOST
+        self.keepalive_timeout = keepalive_timeout or self.KEEPALIVE_TIMEOUT
+        # Um ClientSession por event loop: sessões aiohttp não podem ser
+        # compartilhadas entre loops, mas dentro do mesmo loop são reutilizadas
+        self._sessoes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+            weakref.WeakKeyDictionary()
+        )
+    
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Sessão HTTP (pool de conexões keep-alive) do event loop atual"""
+        loop = asyncio.get_running_loop()
+        sessao = self._sessoes.get(loop)
+        
+        if sessao is None or sessao.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limite_conexoes,
+                limit_per_host=self.limite_por_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            # Teto explícito por requisição; o IAClient aplica o timeout adaptativo por cima
+            timeout = aiohttp.ClientTimeout(
+                total=getattr(settings, 'IA_GM_TIMEOUT_MAXIMO', 120.0),
+                sock_connect=self.TIMEOUT_CONEXAO
+            )
+            sessao = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._sessoes[loop] = sessao
+            logger.debug(
+                f"Novo pool de conexões para {self.__class__.__name__} "
+                f"(limite={self.limite_conexoes}, por_host={self.limite_por_host})"
+            )
+        
+        return sessao
     
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        # Mantido por compatibilidade: a sessão é do pool e não é fechada na saída
+        self.session
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        pass
+    
+    async def fechar(self):
+        """Fecha o pool de conexões do event loop atual e descarta os de loops encerrados"""
+        loop_atual = asyncio.get_running_loop()
+        
+        for loop, sessao in list(self._sessoes.items()):
+            if loop is loop_atual:
+                if not sessao.closed:
+                    await sessao.close()
+                del self._sessoes[loop]
+            elif loop.is_closed():
+                # O loop já morreu; não há como aguardar o close, apenas descarta
+                del self._sessoes[loop]
+    
+    def fechar_sync(self):
+        """Fecha os pools de loops que não estão rodando (ex.: saída de worker Celery)"""
+        for loop, sessao in list(self._sessoes.items()):
+            if not loop.is_closed() and not loop.is_running() and not sessao.closed:
+                loop.run_until_complete(sessao.close())
+            if loop.is_closed() or sessao.closed:
+                del self._sessoes[loop]
     
     @abstractmethod
     async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
         """Gera conteúdo usando o provedor específico"""
         pass
     
+    async def gerar_conteudo_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        Gera conteúdo entregando pedaços de texto à medida que chegam
+        
+        Implementação padrão para provedores sem streaming: entrega a resposta
+        completa como um único pedaço.
+        """
+        resposta = await self.gerar_conteudo(prompt, **kwargs)
+        yield resposta.conteudo
+    
+    @staticmethod
+    async def _ler_eventos_sse(response: aiohttp.ClientResponse) -> AsyncIterator[Dict[str, Any]]:
+        """Lê um corpo Server-Sent Events e entrega o JSON de cada linha 'data:'"""
+        async for linha_bruta in response.content:
+            linha = linha_bruta.decode('utf-8').strip()
+            if not linha.startswith('data:'):
+                continue
+            
+            dados = linha[len('data:'):].strip()
+            if dados == '[DONE]':
+                return
+            
+            yield json.loads(dados)
+    
     @abstractmethod
     def calcular_custo_estimado(self, tokens_entrada: int, tokens_saida: int) -> float:
         """Calcula custo estimado em USD"""
         pass
+    
+    @staticmethod
+    def _mensagens(prompt: str, **kwargs) -> List[Dict[str, Any]]:
+        """Histórico da conversa (kwarg `mensagens`) seguido do prompt como nova mensagem do usuário"""
+        return [*(kwargs.get('mensagens') or []), {"role": "user", "content": prompt}]
+    
+    @staticmethod
+    def _cache_prompt_ativo() -> bool:
+        """Se o prefixo de sistema deve ser marcado para o cache de prompt do provedor"""
+        return getattr(settings, 'IA_GM_CACHE_PROMPT_PROVEDOR', True)
 
 
 class OpenAIProvider(BaseIAProvider):
@@ -68,27 +188,46 @@ class OpenAIProvider(BaseIAProvider):
         "gpt-3.5-turbo": {"entrada": 0.001, "saida": 0.002},
     }
     
-    def __init__(self, api_key: str, modelo: str = "gpt-4"):
-        super().__init__(api_key, modelo)
+    def __init__(self, api_key: str, modelo: str = "gpt-4", **kwargs):
+        super().__init__(api_key, modelo, **kwargs)
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
     
-    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
-        """Gera conteúdo usando OpenAI"""
-        inicio = asyncio.get_event_loop().time()
+    # Tokens de entrada lidos do cache de prompt custam metade
+    FATOR_CACHE_LEITURA = 0.5
+    
+    SISTEMA_PADRAO = "Você é um assistente especializado em RPG e narrativa."
+    
+    def _montar_payload(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """
+        Monta o corpo da requisição de chat completion
         
+        O cache de prompt da OpenAI é automático por prefixo: o `sistema` vai
+        sempre primeiro e, com cache ativo, prompt_cache_key agrupa as
+        requisições que compartilham o mesmo prefixo.
+        """
+        sistema = kwargs.get('sistema')
         payload = {
             "model": self.modelo,
             "messages": [
-                {"role": "system", "content": "Você é um assistente especializado em RPG e narrativa."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": sistema or self.SISTEMA_PADRAO},
+                *self._mensagens(prompt, **kwargs)
             ],
             "max_tokens": kwargs.get('max_tokens', 2000),
             "temperature": kwargs.get('temperature', 0.8),
             "top_p": kwargs.get('top_p', 0.9),
         }
+        if sistema and self._cache_prompt_ativo():
+            payload["prompt_cache_key"] = hashlib.sha256(sistema.encode('utf-8')).hexdigest()[:32]
+        return payload
+    
+    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
+        """Gera conteúdo usando OpenAI"""
+        inicio = asyncio.get_event_loop().time()
+        
+        payload = self._montar_payload(prompt, **kwargs)
         
         try:
             async with self.session.post(
@@ -105,19 +244,23 @@ class OpenAIProvider(BaseIAProvider):
                 fim = asyncio.get_event_loop().time()
                 
                 conteudo = dados['choices'][0]['message']['content']
-                tokens_usados = dados['usage']['total_tokens']
+                uso = dados['usage']
+                tokens_usados = uso['total_tokens']
+                # prompt_tokens já inclui os lidos do cache
+                tokens_cache = (uso.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
                 
                 return RespostaIA(
                     conteudo=conteudo,
                     tipo="texto",
                     metadata={
                         "finish_reason": dados['choices'][0]['finish_reason'],
-                        "prompt_tokens": dados['usage']['prompt_tokens'],
-                        "completion_tokens": dados['usage']['completion_tokens'],
+                        "prompt_tokens": uso['prompt_tokens'],
+                        "completion_tokens": uso['completion_tokens'],
+                        "cached_tokens": tokens_cache,
                         "custo_estimado": self.calcular_custo_estimado(
-                            dados['usage']['prompt_tokens'],
-                            dados['usage']['completion_tokens']
-                        )
+                            uso['prompt_tokens'] - tokens_cache,
+                            uso['completion_tokens']
+                        ) + self.calcular_custo_estimado(tokens_cache, 0) * self.FATOR_CACHE_LEITURA
                     },
                     tokens_usados=tokens_usados,
                     modelo=self.modelo,
@@ -128,6 +271,27 @@ class OpenAIProvider(BaseIAProvider):
             logger.error(f"Erro ao gerar conteúdo OpenAI: {e}")
             raise
     
+    async def gerar_conteudo_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Gera conteúdo usando OpenAI com streaming (SSE)"""
+        payload = self._montar_payload(prompt, **kwargs)
+        payload["stream"] = True
+        
+        async with self.session.post(
+            f"{self.BASE_URL}/chat/completions",
+            headers=self.headers,
+            json=payload
+        ) as response:
+            
+            if response.status != 200:
+                erro_texto = await response.text()
+                raise Exception(f"Erro OpenAI ({response.status}): {erro_texto}")
+            
+            async for evento in self._ler_eventos_sse(response):
+                escolhas = evento.get('choices') or [{}]
+                pedaco = escolhas[0].get('delta', {}).get('content')
+                if pedaco:
+                    yield pedaco
+    
     def calcular_custo_estimado(self, tokens_entrada: int, tokens_saida: int) -> float:
         """Calcula custo estimado para OpenAI"""
         precos = self.PRECOS.get(self.modelo, self.PRECOS["gpt-4"])
@@ -150,26 +314,53 @@ class AnthropicProvider(BaseIAProvider):
         "claude-3-haiku-20240307": {"entrada": 0.00025, "saida": 0.00125},
     }
     
-    def __init__(self, api_key: str, modelo: str = "claude-3-sonnet-20240229"):
-        super().__init__(api_key, modelo)
+    def __init__(self, api_key: str, modelo: str = "claude-3-sonnet-20240229", **kwargs):
+        super().__init__(api_key, modelo, **kwargs)
         self.headers = {
             "x-api-key": api_key,
             "Content-Type": "application/json",
             "anthropic-version": "2023-06-01"
         }
     
-    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
-        """Gera conteúdo usando Anthropic Claude"""
-        inicio = asyncio.get_event_loop().time()
+    # Multiplicadores do preço de entrada para leitura e escrita no cache de prompt
+    FATOR_CACHE_LEITURA = 0.1
+    FATOR_CACHE_ESCRITA = 1.25
+    
+    def _montar_payload(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """
+        Monta o corpo da requisição para a Messages API
         
+        O `sistema` vai no campo system, marcado com cache_control para que
+        turnos seguintes da mesma sessão reaproveitem o prefixo já processado;
+        numa conversa, a última mensagem do histórico também é marcada.
+        """
+        mensagens = self._mensagens(prompt, **kwargs)
         payload = {
             "model": self.modelo,
             "max_tokens": kwargs.get('max_tokens', 2000),
             "temperature": kwargs.get('temperature', 0.8),
-            "messages": [
-                {"role": "user", "content": prompt}
-            ]
+            "messages": mensagens
         }
+        cache_ativo = self._cache_prompt_ativo()
+        sistema = kwargs.get('sistema')
+        if sistema:
+            bloco = {"type": "text", "text": sistema}
+            if cache_ativo:
+                bloco["cache_control"] = {"type": "ephemeral"}
+            payload["system"] = [bloco]
+        if cache_ativo and len(mensagens) > 1:
+            ultima = mensagens[-2]
+            mensagens[-2] = {
+                "role": ultima["role"],
+                "content": [{"type": "text", "text": ultima["content"], "cache_control": {"type": "ephemeral"}}]
+            }
+        return payload
+    
+    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
+        """Gera conteúdo usando Anthropic Claude"""
+        inicio = asyncio.get_event_loop().time()
+        
+        payload = self._montar_payload(prompt, **kwargs)
         
         try:
             async with self.session.post(
@@ -186,9 +377,13 @@ class AnthropicProvider(BaseIAProvider):
                 fim = asyncio.get_event_loop().time()
                 
                 conteudo = dados['content'][0]['text']
-                tokens_entrada = dados['usage']['input_tokens']
-                tokens_saida = dados['usage']['output_tokens']
-                tokens_total = tokens_entrada + tokens_saida
+                uso = dados['usage']
+                # input_tokens não inclui os tokens lidos ou gravados no cache
+                tokens_entrada = uso['input_tokens']
+                tokens_saida = uso['output_tokens']
+                tokens_cache_lidos = uso.get('cache_read_input_tokens') or 0
+                tokens_cache_gravados = uso.get('cache_creation_input_tokens') or 0
+                tokens_total = tokens_entrada + tokens_cache_lidos + tokens_cache_gravados + tokens_saida
                 
                 return RespostaIA(
                     conteudo=conteudo,
@@ -197,7 +392,13 @@ class AnthropicProvider(BaseIAProvider):
                         "stop_reason": dados.get('stop_reason'),
                         "input_tokens": tokens_entrada,
                         "output_tokens": tokens_saida,
-                        "custo_estimado": self.calcular_custo_estimado(tokens_entrada, tokens_saida)
+                        "cached_tokens": tokens_cache_lidos,
+                        "cache_creation_tokens": tokens_cache_gravados,
+                        "custo_estimado": (
+                            self.calcular_custo_estimado(tokens_entrada, tokens_saida)
+                            + self.calcular_custo_estimado(tokens_cache_lidos, 0) * self.FATOR_CACHE_LEITURA
+                            + self.calcular_custo_estimado(tokens_cache_gravados, 0) * self.FATOR_CACHE_ESCRITA
+                        )
                     },
                     tokens_usados=tokens_total,
                     modelo=self.modelo,
@@ -208,6 +409,29 @@ class AnthropicProvider(BaseIAProvider):
             logger.error(f"Erro ao gerar conteúdo Anthropic: {e}")
             raise
     
+    async def gerar_conteudo_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Gera conteúdo usando Anthropic Claude com streaming (SSE)"""
+        payload = self._montar_payload(prompt, **kwargs)
+        payload["stream"] = True
+        
+        async with self.session.post(
+            f"{self.BASE_URL}/messages",
+            headers=self.headers,
+            json=payload
+        ) as response:
+            
+            if response.status != 200:
+                erro_texto = await response.text()
+                raise Exception(f"Erro Anthropic ({response.status}): {erro_texto}")
+            
+            async for evento in self._ler_eventos_sse(response):
+                if evento.get('type') == 'content_block_delta':
+                    pedaco = evento.get('delta', {}).get('text')
+                    if pedaco:
+                        yield pedaco
+                elif evento.get('type') == 'error':
+                    raise Exception(f"Erro Anthropic (stream): {evento.get('error')}")
+    
     def calcular_custo_estimado(self, tokens_entrada: int, tokens_saida: int) -> float:
         """Calcula custo estimado para Anthropic"""
         precos = self.PRECOS.get(self.modelo, self.PRECOS["claude-3-sonnet-20240229"])
@@ -221,28 +445,46 @@ class AnthropicProvider(BaseIAProvider):
 class LocalProvider(BaseIAProvider):
     """Provedor para modelos locais (Ollama, LM Studio, etc.)"""
     
-    def __init__(self, base_url: str, modelo: str, api_key: str = ""):
-        super().__init__(api_key, modelo)
+    # Servidor local atende poucas gerações em paralelo
+    LIMITE_CONEXOES = 10
+    LIMITE_CONEXOES_POR_HOST = 4
+    
+    ROTULOS_PAPEL = {"user": "Jogadores", "assistant": "Mestre"}
+    
+    def __init__(self, base_url: str, modelo: str, api_key: str = "", **kwargs):
+        super().__init__(api_key, modelo, **kwargs)
         self.base_url = base_url.rstrip('/')
         self.headers = {"Content-Type": "application/json"}
         if api_key:
             self.headers["Authorization"] = f"Bearer {api_key}"
     
-    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
-        """Gera conteúdo usando modelo local"""
-        inicio = asyncio.get_event_loop().time()
-        
-        # Formato compatível com Ollama
+    def _montar_payload(self, prompt: str, stream: bool = False, **kwargs) -> Dict[str, Any]:
+        """Monta o corpo da requisição (formato compatível com Ollama)"""
+        if kwargs.get('mensagens'):
+            # /api/generate recebe um único texto: o histórico vai antes do prompt
+            historico = "\n\n".join(
+                f"{self.ROTULOS_PAPEL.get(m['role'], m['role'])}: {m['content']}" for m in kwargs['mensagens']
+            )
+            prompt = f"{historico}\n\n{self.ROTULOS_PAPEL['user']}: {prompt}"
         payload = {
             "model": self.modelo,
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": kwargs.get('temperature', 0.8),
                 "top_p": kwargs.get('top_p', 0.9),
                 "max_tokens": kwargs.get('max_tokens', 2000)
             }
         }
+        if kwargs.get('sistema'):
+            payload["system"] = kwargs['sistema']
+        return payload
+    
+    async def gerar_conteudo(self, prompt: str, **kwargs) -> RespostaIA:
+        """Gera conteúdo usando modelo local"""
+        inicio = asyncio.get_event_loop().time()
+        
+        payload = self._montar_payload(prompt, **kwargs)
         
         try:
             async with self.session.post(
@@ -275,6 +517,30 @@ class LocalProvider(BaseIAProvider):
             logger.error(f"Erro ao gerar conteúdo modelo local: {e}")
             raise
     
+    async def gerar_conteudo_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Gera conteúdo usando modelo local com streaming (NDJSON do Ollama)"""
+        payload = self._montar_payload(prompt, stream=True, **kwargs)
+        
+        async with self.session.post(
+            f"{self.base_url}/api/generate",
+            headers=self.headers,
+            json=payload
+        ) as response:
+            
+            if response.status != 200:
+                erro_texto = await response.text()
+                raise Exception(f"Erro Modelo Local ({response.status}): {erro_texto}")
+            
+            async for linha in response.content:
+                if not linha.strip():
+                    continue
+                
+                dados = json.loads(linha)
+                if dados.get('response'):
+                    yield dados['response']
+                if dados.get('done'):
+                    break
+    
     def calcular_custo_estimado(self, tokens_entrada: int, tokens_saida: int) -> float:
         """Modelos locais são gratuitos"""
         return 0.0
@@ -286,10 +552,35 @@ class IAClient:
     Implementa balanceamento de carga, fallback e cache
     """
     
-    def __init__(self):
+    # Valores assumidos pelos provedores quando o parâmetro não é informado;
+    # entram na chave de cache para que "omitido" e "padrão explícito" coincidam
+    PARAMETROS_PADRAO = {'max_tokens': 2000, 'temperature': 0.8, 'top_p': 0.9}
+    
+    CHAVE_CACHE_ACERTOS = 'ia_gm:cache:acertos'
+    CHAVE_CACHE_FALHAS = 'ia_gm:cache:falhas'
+    
+    def __init__(self, provedores: Optional[List[tuple]] = None):
+        """
+        Args:
+            provedores: Lista de (nome, provedor) já instanciados; se omitida,
+                        os provedores são configurados a partir do settings
+        """
         self.provedores = []
         self.provedor_principal = None
-        self.configurar_provedores()
+        self.circuitos: Dict[str, CircuitBreaker] = {}
+        self.timeouts = ControleTimeout()
+        self.limitador = LimitadorTaxa()
+        # Requisições idênticas em andamento, por event loop (single-flight)
+        self._em_voo: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.requisicoes_coalescidas = 0
+        
+        if provedores:
+            self.provedores = list(provedores)
+            self.provedor_principal = self.provedores[0][1]
+        else:
+            self.configurar_provedores()
     
     def configurar_provedores(self):
         """Configura provedores baseado nas configurações Django"""
@@ -297,7 +588,9 @@ class IAClient:
         # OpenAI
         if hasattr(settings, 'OPENAI_API_KEY') and settings.OPENAI_API_KEY:
             openai_modelo = getattr(settings, 'OPENAI_MODELO', 'gpt-4')
-            provedor = OpenAIProvider(settings.OPENAI_API_KEY, openai_modelo)
+            provedor = OpenAIProvider(
+                settings.OPENAI_API_KEY, openai_modelo, **self._limites_conexao('openai')
+            )
             self.provedores.append(('openai', provedor))
             if not self.provedor_principal:
                 self.provedor_principal = provedor
@@ -305,7 +598,9 @@ class IAClient:
         # Anthropic
         if hasattr(settings, 'ANTHROPIC_API_KEY') and settings.ANTHROPIC_API_KEY:
             anthropic_modelo = getattr(settings, 'ANTHROPIC_MODELO', 'claude-3-sonnet-20240229')
-            provedor = AnthropicProvider(settings.ANTHROPIC_API_KEY, anthropic_modelo)
+            provedor = AnthropicProvider(
+                settings.ANTHROPIC_API_KEY, anthropic_modelo, **self._limites_conexao('anthropic')
+            )
             self.provedores.append(('anthropic', provedor))
             if not self.provedor_principal:
                 self.provedor_principal = provedor
@@ -314,7 +609,9 @@ class IAClient:
         if hasattr(settings, 'LOCAL_AI_URL') and settings.LOCAL_AI_URL:
             local_modelo = getattr(settings, 'LOCAL_AI_MODELO', 'llama2')
             local_api_key = getattr(settings, 'LOCAL_AI_API_KEY', '')
-            provedor = LocalProvider(settings.LOCAL_AI_URL, local_modelo, local_api_key)
+            provedor = LocalProvider(
+                settings.LOCAL_AI_URL, local_modelo, local_api_key, **self._limites_conexao('local')
+            )
             self.provedores.append(('local', provedor))
             if not self.provedor_principal:
                 self.provedor_principal = provedor
@@ -324,11 +621,40 @@ class IAClient:
         
         logger.info(f"Configurados {len(self.provedores)} provedores de IA")
     
+    @staticmethod
+    def _limites_conexao(nome: str) -> Dict[str, Any]:
+        """Limites do pool HTTP configurados para um provedor (IA_GM_LIMITES_CONEXAO)"""
+        limites = getattr(settings, 'IA_GM_LIMITES_CONEXAO', {}).get(nome, {})
+        return {
+            chave: limites[chave]
+            for chave in ('limite_conexoes', 'limite_por_host', 'keepalive_timeout')
+            if chave in limites
+        }
+    
+    async def fechar_conexoes(self):
+        """Fecha os pools de conexão de todos os provedores no event loop atual"""
+        for nome, provedor in self.provedores:
+            try:
+                await provedor.fechar()
+            except Exception as e:
+                logger.warning(f"Erro ao fechar conexões do provedor {nome}: {e}")
+    
+    def fechar_conexoes_sync(self):
+        """Fecha pools de conexão fora de um event loop (ex.: saída de processo)"""
+        for nome, provedor in self.provedores:
+            try:
+                provedor.fechar_sync()
+            except Exception as e:
+                logger.warning(f"Erro ao fechar conexões do provedor {nome}: {e}")
+    
     async def gerar_conteudo(
         self, 
         prompt: str, 
         usar_cache: bool = True,
         provedor_preferido: Optional[str] = None,
+        hedge: Optional[bool] = None,
+        coalescer: bool = True,
+        campanha_id: Optional[int] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -338,69 +664,549 @@ class IAClient:
             prompt: Prompt para geração
             usar_cache: Se deve usar cache para esta solicitação
             provedor_preferido: Nome do provedor específico ('openai', 'anthropic', 'local')
-            **kwargs: Parâmetros adicionais (temperature, max_tokens, etc.)
+            hedge: Dispara o próximo provedor em paralelo se o atual demorar
+                   mais que IA_GM_HEDGE_LIMIAR (None = usa IA_GM_HEDGE_ATIVO)
+            coalescer: Se um prompt idêntico já está em andamento, aguarda o
+                       resultado dele em vez de chamar o provedor de novo
+            campanha_id: Campanha que origina a chamada (limite de taxa,
+                         orçamento e livro-razão de custo por campanha)
+            **kwargs: Parâmetros adicionais (temperature, max_tokens, etc.);
+                      `sistema` envia um prefixo estável separado do prompt,
+                      marcado para o cache de prompt do provedor; `mensagens`
+                      é o histórico ({'role', 'content'}) anterior ao prompt
         """
         
+        candidatos = self._selecionar_provedores(provedor_preferido)
+        # Uma chave por provedor/modelo candidato; a do primeiro identifica a requisição
+        chaves_cache = {
+            nome: self.gerar_chave_cache(nome, provedor.modelo, prompt, **kwargs)
+            for nome, provedor in candidatos
+        }
+        
         # Verifica cache primeiro
         if usar_cache:
-            cache_key = f"ia_gm:prompt:{hash(prompt)}"
-            resultado_cache = cache.get(cache_key)
+            resultado_cache = await self._ler_cache(list(chaves_cache.values()))
             if resultado_cache:
                 logger.info("Resultado obtido do cache")
                 return resultado_cache
         
-        # Seleciona provedor
-        provedor_selecionado = None
+        if campanha_id is not None:
+            await verificar_orcamento_campanha(campanha_id)
         
-        if provedor_preferido:
-            for nome, provedor in self.provedores:
-                if nome == provedor_preferido:
-                    provedor_selecionado = provedor
-                    break
+        if hedge is None:
+            hedge = getattr(settings, 'IA_GM_HEDGE_ATIVO', False)
+        
+        async def gerar() -> Dict[str, Any]:
+            return await self._gerar_e_gravar(
+                candidatos, prompt, hedge, chaves_cache if usar_cache else None,
+                campanha_id=campanha_id, **kwargs
+            )
+        
+        if not coalescer:
+            return await gerar()
+        
+        return await self._gerar_coalescido(
+            chaves_cache[candidatos[0][0]], list(chaves_cache.values()), usar_cache, gerar
+        )
+    
+    async def conversar(
+        self,
+        sessao_id: int,
+        mensagem: str,
+        contexto: str = "",
+        sistema: Optional[str] = None,
+        turno: Optional[int] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Gera a próxima resposta da conversa mantida para a sessão
+        
+        O histórico vai como mensagens estruturadas; só a mensagem nova e a
+        resposta são acrescentadas a ele, e os turnos mais antigos saem pelo
+        início quando o histórico não cabe no orçamento do prompt.
+        
+        Args:
+            sessao_id: SessaoIA dona da conversa
+            mensagem: Mensagem do turno (guardada no histórico)
+            contexto: Texto enviado antes da mensagem só neste turno (resumos,
+                      memórias, instruções); não entra no histórico
+            sistema: Prefixo de sistema estável da sessão
+            turno: Número do turno; gerar de novo o mesmo turno substitui o registro anterior
+            **kwargs: Repassados para gerar_conteudo (campanha_id, max_tokens, etc.)
+        """
+        conversa = await Conversa.acarregar(sessao_id)
+        if turno is not None:
+            conversa.descartar_turno(turno)
+        prompt = f"{contexto}\n\n{mensagem}" if contexto else mensagem
+        
+        limite = min(
+            self.orcamento_prompt(kwargs.get('max_tokens'), kwargs.get('provedor_preferido'))
+            - self._estimar_tokens(prompt)
+            - (self._estimar_tokens(sistema) if sistema else 0),
+            getattr(settings, 'IA_GM_CONVERSA_MAX_TOKENS', 4000)
+        )
+        conversa.aparar(max(limite, 0))
+        
+        kwargs.setdefault('usar_cache', False)
+        resultado = await self.gerar_conteudo(
+            prompt, sistema=sistema, mensagens=conversa.historico() or None, **kwargs
+        )
+        
+        conversa.adicionar(PAPEL_USUARIO, mensagem, turno)
+        conversa.adicionar(PAPEL_ASSISTENTE, resultado['conteudo'], turno)
+        await conversa.asalvar()
+        return resultado
+    
+    async def _gerar_e_gravar(
+        self,
+        candidatos: List[tuple],
+        prompt: str,
+        hedge: bool,
+        chaves_cache: Optional[Dict[str, str]],
+        campanha_id: Optional[int] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Gera conteúdo nos provedores candidatos, grava no cache e lança o custo da campanha"""
+        if hedge and len(candidatos) > 1:
+            nome, resposta = await self._gerar_com_hedge(
+                candidatos, prompt, campanha_id=campanha_id, **kwargs
+            )
+        else:
+            nome, resposta = await self._gerar_sequencial(
+                candidatos, prompt, campanha_id=campanha_id, **kwargs
+            )
+        
+        resultado = {
+            'conteudo': resposta.conteudo,
+            'tipo': resposta.tipo,
+            'metadata': resposta.metadata,
+            'tokens_usados': resposta.tokens_usados,
+            'modelo': resposta.modelo,
+            'tempo_resposta': resposta.tempo_resposta,
+            'provedor': nome,
+            'custo_estimado': resposta.metadata.get('custo_estimado', 0.0)
+        }
+        
+        # Salva no cache
+        if chaves_cache:
+            await self._gravar_cache(chaves_cache[nome], resultado)
+        
+        if campanha_id is not None:
+            await registrar_custo_campanha(
+                campanha_id, nome, resultado['tokens_usados'], resultado['custo_estimado']
+            )
+        
+        return resultado
+    
+    async def _gerar_coalescido(
+        self,
+        chave: str,
+        chaves_resultado: List[str],
+        usar_cache: bool,
+        gerar
+    ) -> Dict[str, Any]:
+        """
+        Single-flight: só a primeira requisição (líder) de um prompt idêntico
+        chama o provedor; as demais aguardam o resultado dela
+        
+        No mesmo processo os seguidores aguardam um Future do líder. Entre
+        workers (IA_GM_SINGLE_FLIGHT_DISTRIBUIDO), um lock no cache compartilhado
+        elege o líder e os seguidores leem o resultado que ele grava no cache.
+        """
+        loop = asyncio.get_running_loop()
+        em_voo = self._em_voo.setdefault(loop, {})
+        
+        futuro = em_voo.get(chave)
+        if futuro is not None:
+            self.requisicoes_coalescidas += 1
+            logger.info("Prompt idêntico em andamento; aguardando o resultado do líder")
+            return dict(await asyncio.shield(futuro))
+        
+        futuro = loop.create_future()
+        # Evita o aviso "exception was never retrieved" quando não há seguidores
+        futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+        em_voo[chave] = futuro
+        
+        try:
+            resultado = None
+            if usar_cache and getattr(settings, 'IA_GM_SINGLE_FLIGHT_DISTRIBUIDO', False):
+                resultado = await self._aguardar_lider_distribuido(chave, chaves_resultado, gerar)
+            if resultado is None:
+                resultado = await gerar()
+        except BaseException as e:
+            futuro.set_exception(
+                e if isinstance(e, Exception) else Exception("Requisição líder cancelada")
+            )
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            em_voo.pop(chave, None)
+    
+    async def _aguardar_lider_distribuido(
+        self,
+        chave: str,
+        chaves_resultado: List[str],
+        gerar
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Elege um líder entre workers com um lock no cache compartilhado
         
-        if not provedor_selecionado:
-            provedor_selecionado = self.provedor_principal
+        Quem obtém o lock gera e devolve o resultado; os demais consultam o
+        cache até o resultado aparecer. Se o lock sumir (ou expirar) sem
+        resultado, retorna None e o chamador gera por conta própria.
+        """
+        cache_ia = obter_cache_ia()
+        chave_lock = f"{chave}:lock"
+        ttl_lock = getattr(settings, 'IA_GM_TIMEOUT_MAXIMO', 120.0)
+        
+        try:
+            obteve_lock = await cache_ia.aadd(chave_lock, 1, timeout=ttl_lock)
+        except Exception as e:
+            logger.debug(f"Lock de single-flight indisponível: {e}")
+            return None
+        
+        if obteve_lock:
+            try:
+                return await gerar()
+            finally:
+                try:
+                    await cache_ia.adelete(chave_lock)
+                except Exception as e:
+                    logger.debug(f"Falha ao liberar lock de single-flight: {e}")
+        
+        self.requisicoes_coalescidas += 1
+        logger.info("Prompt idêntico em andamento em outro worker; aguardando o resultado")
+        intervalo = getattr(settings, 'IA_GM_SINGLE_FLIGHT_INTERVALO', 0.1)
+        limite = asyncio.get_running_loop().time() + ttl_lock
+        
+        while asyncio.get_running_loop().time() < limite:
+            await asyncio.sleep(intervalo)
+            try:
+                encontrados = await cache_ia.aget_many(chaves_resultado + [chave_lock])
+            except Exception:
+                return None
+            
+            for chave_resultado in chaves_resultado:
+                if chave_resultado in encontrados:
+                    return encontrados[chave_resultado]
+            if chave_lock not in encontrados:
+                # Líder terminou sem resultado (falhou): segue sozinho
+                return None
+        
+        return None
+    
+    def _circuito(self, nome: str) -> CircuitBreaker:
+        """Circuit breaker do provedor (estado compartilhado via cache de IA)"""
+        if nome not in self.circuitos:
+            self.circuitos[nome] = CircuitBreaker(nome)
+        return self.circuitos[nome]
+    
+    async def _chamar_provedor(
+        self,
+        nome: str,
+        provedor: BaseIAProvider,
+        prompt: str,
+        campanha_id: Optional[int] = None,
+        **kwargs
+    ) -> RespostaIA:
+        """
+        Chama o provedor respeitando o limite de taxa, com timeout adaptativo,
+        alimentando o histograma de latência e o circuit breaker
+        """
+        reserva = await self.limitador.adquirir(
+            nome, self._estimar_tokens_chamada(prompt, **kwargs), campanha_id
+        )
+        timeout = self.timeouts.timeout(nome)
+        inicio = asyncio.get_running_loop().time()
         
-        # Tenta gerar conteúdo
+        try:
+            resposta = await asyncio.wait_for(provedor.gerar_conteudo(prompt, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            await reserva.ajustar_tokens(0)
+            await self._circuito(nome).registrar_falha()
+            raise Exception(f"Timeout de {timeout:.1f}s excedido pelo provedor {nome}")
+        except Exception:
+            await reserva.ajustar_tokens(0)
+            await self._circuito(nome).registrar_falha()
+            raise
+        
+        if resposta.tokens_usados:
+            await reserva.ajustar_tokens(resposta.tokens_usados)
+        self.timeouts.registrar(nome, asyncio.get_running_loop().time() - inicio)
+        await self._circuito(nome).registrar_sucesso()
+        return resposta
+    
+    async def _gerar_sequencial(self, candidatos: List[tuple], prompt: str, **kwargs) -> tuple:
+        """Tenta os provedores um de cada vez, passando ao próximo em caso de falha"""
         ultima_excecao = None
         
-        for nome, provedor in self.provedores:
-            if provedor != provedor_selecionado and provedor_preferido:
-                continue  # Só tenta o preferido se especificado
+        for nome, provedor in candidatos:
+            if not await self._circuito(nome).pode_tentar():
+                logger.info(f"Circuito aberto, pulando provedor {nome}")
+                continue
             
             try:
-                async with provedor:
-                    logger.info(f"Gerando conteúdo com {nome}")
-                    resposta = await provedor.gerar_conteudo(prompt, **kwargs)
-                    
-                    resultado = {
-                        'conteudo': resposta.conteudo,
-                        'tipo': resposta.tipo,
-                        'metadata': resposta.metadata,
-                        'tokens_usados': resposta.tokens_usados,
-                        'modelo': resposta.modelo,
-                        'tempo_resposta': resposta.tempo_resposta,
-                        'provedor': nome,
-                        'custo_estimado': resposta.metadata.get('custo_estimado', 0.0)
-                    }
-                    
-                    # Salva no cache
-                    if usar_cache:
-                        cache.set(cache_key, resultado, 3600)  # 1 hora
-                    
-                    return resultado
+                logger.info(f"Gerando conteúdo com {nome}")
+                return nome, await self._chamar_provedor(nome, provedor, prompt, **kwargs)
             
             except Exception as e:
                 logger.warning(f"Falha no provedor {nome}: {e}")
                 ultima_excecao = e
+        
+        # Se chegou aqui, todos falharam
+        raise Exception(f"Todos os provedores de IA falharam. Última exceção: {ultima_excecao}")
+    
+    def _limiar_hedge(self, nome: str) -> float:
+        """Tempo (s) de espera pelo provedor antes de disparar o próximo em paralelo (p95 observado)"""
+        p95 = self.timeouts.percentil(nome, 95)
+        return p95 if p95 is not None else getattr(settings, 'IA_GM_HEDGE_LIMIAR', 4.0)
+    
+    async def _gerar_com_hedge(self, candidatos: List[tuple], prompt: str, **kwargs) -> tuple:
+        """
+        Requisições "hedged": dispara o primeiro provedor e, se ele não responder
+        dentro do limiar (p95 esperado), dispara o próximo em paralelo. A primeira
+        resposta bem-sucedida vence e as demais requisições são canceladas.
+        """
+        fila = list(candidatos)
+        pendentes: Dict[asyncio.Task, str] = {}
+        ultima_excecao = None
+        
+        async def disparar_proximo() -> Optional[float]:
+            while fila:
+                nome, provedor = fila.pop(0)
+                if not await self._circuito(nome).pode_tentar():
+                    logger.info(f"Circuito aberto, pulando provedor {nome}")
+                    continue
+                logger.info(f"Gerando conteúdo com {nome} (hedge, {len(pendentes)} em andamento)")
+                tarefa = asyncio.create_task(self._chamar_provedor(nome, provedor, prompt, **kwargs))
+                pendentes[tarefa] = nome
+                return self._limiar_hedge(nome)
+            return None
+        
+        limiar = await disparar_proximo()
+        
+        try:
+            while pendentes:
+                concluidas, _ = await asyncio.wait(
+                    pendentes,
+                    timeout=limiar if fila else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
                 
-                # Se não foi especificado provedor preferido, tenta o próximo
-                if not provedor_preferido:
+                if not concluidas:
+                    # Limiar estourado: corre o próximo provedor em paralelo
+                    limiar = await disparar_proximo() or limiar
                     continue
-                else:
-                    break
+                
+                for tarefa in concluidas:
+                    nome = pendentes.pop(tarefa)
+                    try:
+                        resposta = tarefa.result()
+                    except Exception as e:
+                        logger.warning(f"Falha no provedor {nome}: {e}")
+                        ultima_excecao = e
+                        continue
+                    
+                    return nome, resposta
+                
+                # Todos os que estavam em voo falharam: fallback imediato
+                if not pendentes and fila:
+                    limiar = await disparar_proximo()
+        
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
+            if pendentes:
+                await asyncio.gather(*pendentes, return_exceptions=True)
+                logger.info(f"Hedge: {len(pendentes)} requisição(ões) perdedora(s) cancelada(s)")
+        
+        raise Exception(f"Todos os provedores de IA falharam. Última exceção: {ultima_excecao}")
+    
+    @classmethod
+    def gerar_chave_cache(cls, nome_provedor: str, modelo: str, prompt: str, **kwargs) -> str:
+        """
+        Chave de cache determinística (SHA-256) para uma geração
+        
+        Ao contrário de hash(), é estável entre processos e reinícios, e inclui
+        provedor, modelo e parâmetros normalizados além do prompt.
+        """
+        parametros = {
+            **cls.PARAMETROS_PADRAO,
+            **{chave: valor for chave, valor in kwargs.items() if valor is not None}
+        }
+        for chave, valor in parametros.items():
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                parametros[chave] = float(valor)
+        
+        material = json.dumps(
+            {
+                'provedor': nome_provedor,
+                'modelo': modelo,
+                'parametros': parametros,
+                'prompt': prompt.strip(),
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return f"ia_gm:prompt:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+    
+    async def _ler_cache(self, chaves: List[str]) -> Optional[Dict[str, Any]]:
+        """Busca o primeiro resultado em cache entre as chaves (em ordem) e contabiliza acerto/falha"""
+        cache_ia = obter_cache_ia()
+        try:
+            encontrados = await cache_ia.aget_many(chaves)
+        except Exception as e:
+            logger.warning(f"Cache de IA indisponível para leitura: {e}")
+            return None
+        
+        resultado = next((encontrados[chave] for chave in chaves if chave in encontrados), None)
+        await self._contabilizar_cache(acerto=resultado is not None)
+        return resultado
+    
+    async def _gravar_cache(self, chave: str, resultado: Dict[str, Any]):
+        """Grava resultado no cache compartilhado com TTL de IA_GM_CACHE_TIMEOUT"""
+        timeout = getattr(settings, 'IA_GM_CACHE_TIMEOUT', 3600)
+        try:
+            await obter_cache_ia().aset(chave, resultado, timeout)
+        except Exception as e:
+            logger.warning(f"Cache de IA indisponível para escrita: {e}")
+    
+    async def _contabilizar_cache(self, acerto: bool):
+        """Incrementa os contadores compartilhados de acerto/falha do cache"""
+        chave = self.CHAVE_CACHE_ACERTOS if acerto else self.CHAVE_CACHE_FALHAS
+        cache_ia = obter_cache_ia()
+        try:
+            await cache_ia.aadd(chave, 0, timeout=None)
+            await cache_ia.aincr(chave)
+        except Exception as e:
+            logger.debug(f"Falha ao contabilizar cache de IA: {e}")
+    
+    def obter_estatisticas_cache(self) -> Dict[str, Any]:
+        """Contadores de acerto/falha do cache de prompts"""
+        try:
+            valores = obter_cache_ia().get_many([self.CHAVE_CACHE_ACERTOS, self.CHAVE_CACHE_FALHAS])
+        except Exception:
+            valores = {}
+        
+        acertos = valores.get(self.CHAVE_CACHE_ACERTOS, 0)
+        falhas = valores.get(self.CHAVE_CACHE_FALHAS, 0)
+        total = acertos + falhas
+        
+        return {
+            'acertos': acertos,
+            'falhas': falhas,
+            'taxa_acerto': acertos / total if total else 0.0
+        }
+    
+    def _selecionar_provedores(self, provedor_preferido: Optional[str] = None) -> List[tuple]:
+        """
+        Lista (nome, provedor) na ordem em que devem ser tentados
+        
+        Com provedor preferido, só ele é tentado (ou o principal, se o nome
+        não existir); sem preferência, todos em ordem de fallback.
+        """
+        if not provedor_preferido:
+            return list(self.provedores)
+        
+        for nome, provedor in self.provedores:
+            if nome == provedor_preferido:
+                return [(nome, provedor)]
+        
+        return [
+            (nome, provedor) for nome, provedor in self.provedores
+            if provedor is self.provedor_principal
+        ]
+    
+    async def gerar_conteudo_stream(
+        self,
+        prompt: str,
+        provedor_preferido: Optional[str] = None,
+        campanha_id: Optional[int] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Gera conteúdo entregando pedaços de texto assim que o provedor os produz
+        
+        O fallback para o próximo provedor só acontece se a falha ocorrer antes
+        do primeiro pedaço; depois disso o erro é propagado, pois parte da
+        resposta já foi entregue.
+        
+        Args:
+            prompt: Prompt para geração
+            provedor_preferido: Nome do provedor específico ('openai', 'anthropic', 'local')
+            campanha_id: Campanha que origina a chamada (limite de taxa e custo)
+            **kwargs: Parâmetros adicionais (temperature, max_tokens, etc.)
+        """
+        ultima_excecao = None
+        
+        if campanha_id is not None:
+            await verificar_orcamento_campanha(campanha_id)
+        
+        for nome, provedor in self._selecionar_provedores(provedor_preferido):
+            circuito = self._circuito(nome)
+            if not await circuito.pode_tentar():
+                logger.info(f"Circuito aberto, pulando provedor {nome}")
+                continue
+            
+            try:
+                reserva = await self.limitador.adquirir(
+                    nome, self._estimar_tokens_chamada(prompt, **kwargs), campanha_id
+                )
+            except Exception as e:
+                logger.warning(f"Provedor {nome} indisponível (streaming): {e}")
+                ultima_excecao = e
+                continue
+            
+            entregou_pedaco = False
+            texto_gerado = []
+            pedacos = provedor.gerar_conteudo_stream(prompt, **kwargs)
+            try:
+                logger.info(f"Gerando conteúdo em streaming com {nome}")
+                # O timeout adaptativo vale até o primeiro pedaço; depois o
+                # teto da sessão HTTP (IA_GM_TIMEOUT_MAXIMO) limita o restante
+                timeout = self.timeouts.timeout(nome)
+                try:
+                    primeiro = await asyncio.wait_for(pedacos.__anext__(), timeout)
+                except asyncio.TimeoutError:
+                    raise Exception(f"Timeout de {timeout:.1f}s excedido pelo provedor {nome}")
+                except StopAsyncIteration:
+                    await circuito.registrar_sucesso()
+                    return
+                
+                entregou_pedaco = True
+                texto_gerado.append(primeiro)
+                yield primeiro
+                async for pedaco in pedacos:
+                    texto_gerado.append(pedaco)
+                    yield pedaco
+                await circuito.registrar_sucesso()
+                
+                # Streaming não devolve contagem de uso: estima pelo texto entregue
+                tokens_entrada = self._estimar_tokens(prompt)
+                tokens_saida = self._estimar_tokens(''.join(texto_gerado))
+                await reserva.ajustar_tokens(tokens_entrada + tokens_saida)
+                if campanha_id is not None:
+                    await registrar_custo_campanha(
+                        campanha_id, nome, tokens_entrada + tokens_saida,
+                        provedor.calcular_custo_estimado(tokens_entrada, tokens_saida)
+                    )
+                return
+            
+            except Exception as e:
+                if not entregou_pedaco:
+                    await reserva.ajustar_tokens(0)
+                await circuito.registrar_falha()
+                if entregou_pedaco:
+                    raise
+                logger.warning(f"Falha no provedor {nome} (streaming): {e}")
+                ultima_excecao = e
+            
+            finally:
+                await pedacos.aclose()
         
-        # Se chegou aqui, todos falharam
         raise Exception(f"Todos os provedores de IA falharam. Última exceção: {ultima_excecao}")
     
     async def listar_modelos_disponiveis(self) -> Dict[str, List[str]]:
@@ -421,16 +1227,42 @@ class IAClient:
         
         return modelos
     
+    @staticmethod
+    def _estimar_tokens(texto: str) -> int:
+        """Tokens de um texto (tokenizer real quando disponível)"""
+        return contar_tokens(texto)
+    
+    def _estimar_tokens_chamada(self, prompt: str, **kwargs) -> int:
+        """Tokens a reservar no limitador: entrada estimada + máximo de saída"""
+        max_tokens = kwargs.get('max_tokens') or self.PARAMETROS_PADRAO['max_tokens']
+        tokens_sistema = self._estimar_tokens(kwargs['sistema']) if kwargs.get('sistema') else 0
+        tokens_historico = sum(self._estimar_tokens(m['content']) for m in kwargs.get('mensagens') or [])
+        return self._estimar_tokens(prompt) + tokens_sistema + tokens_historico + int(max_tokens)
+    
+    def orcamento_prompt(
+        self,
+        max_tokens: Optional[int] = None,
+        provedor_preferido: Optional[str] = None
+    ) -> int:
+        """
+        Tokens disponíveis para o prompt considerando todos os provedores que
+        podem atendê-lo (o fallback pode cair num modelo de contexto menor)
+        """
+        max_tokens = max_tokens or self.PARAMETROS_PADRAO['max_tokens']
+        return min(
+            orcamento_prompt(provedor.modelo, max_tokens)
+            for _, provedor in self._selecionar_provedores(provedor_preferido)
+        )
+    
     async def estimar_custo(self, prompt: str, max_tokens: int = 2000) -> Dict[str, float]:
         """Estima custo para cada provedor disponível"""
         custos = {}
         
-        # Estimativa rough de tokens de entrada
-        tokens_entrada = len(prompt.split()) * 1.3  # Aproximação
         tokens_saida = max_tokens
         
         for nome, provedor in self.provedores:
-            custo = provedor.calcular_custo_estimado(int(tokens_entrada), tokens_saida)
+            tokens_entrada = contar_tokens(prompt, provedor.modelo)
+            custo = provedor.calcular_custo_estimado(tokens_entrada, tokens_saida)
             custos[nome] = custo
         
         return custos
@@ -441,7 +1273,11 @@ class IAClient:
         return {
             'provedores_configurados': len(self.provedores),
             'provedor_principal': self.provedor_principal.__class__.__name__ if self.provedor_principal else None,
-            'provedores_disponiveis': [nome for nome, _ in self.provedores]
+            'provedores_disponiveis': [nome for nome, _ in self.provedores],
+            'cache': self.obter_estatisticas_cache(),
+            'requisicoes_coalescidas': self.requisicoes_coalescidas,
+            'circuitos': {nome: self._circuito(nome).estado() for nome, _ in self.provedores},
+            'timeouts': {nome: round(self.timeouts.timeout(nome), 2) for nome, _ in self.provedores}
         }
 
 
@@ -456,6 +1292,62 @@ def get_ia_client() -> IAClient:
     return _ia_client_instance
 
 
+async def fechar_conexoes_ia():
+    """Fecha os pools HTTP do cliente singleton (shutdown do ASGI lifespan)"""
+    if _ia_client_instance is not None:
+        await _ia_client_instance.fechar_conexoes()
+
+
+def fechar_conexoes_ia_sync():
+    """Fecha os pools HTTP do cliente singleton fora de um event loop (saída do worker Celery)"""
+    global _loop_sincrono
+    if _ia_client_instance is None:
+        return
+
+    loop = _loop_sincrono
+    if loop is not None and loop.is_running():
+        try:
+            asyncio.run_coroutine_threadsafe(_ia_client_instance.fechar_conexoes(), loop).result(10)
+        except Exception as e:
+            logger.warning(f"Erro ao fechar conexões no loop de IA: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        _loop_sincrono = None
+
+    _ia_client_instance.fechar_conexoes_sync()
+
+
+# Event loop persistente para chamadas de IA a partir de código síncrono
+# (tarefas Celery, views WSGI): roda numa thread daemon e mantém os pools
+# HTTP dos provedores vivos entre chamadas
+_loop_sincrono: Optional[asyncio.AbstractEventLoop] = None
+_loop_sincrono_lock = threading.Lock()
+
+
+def _obter_loop_sincrono() -> asyncio.AbstractEventLoop:
+    global _loop_sincrono
+    with _loop_sincrono_lock:
+        if _loop_sincrono is None or _loop_sincrono.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='ia-gm-loop', daemon=True).start()
+            _loop_sincrono = loop
+        return _loop_sincrono
+
+
+def executar_sync(corrotina, timeout: Optional[float] = None):
+    """
+    Executa uma corrotina de IA a partir de código síncrono e retorna o resultado
+
+    Usa o event loop persistente do processo em vez de criar (e descartar)
+    um loop por chamada.
+    """
+    futuro = asyncio.run_coroutine_threadsafe(corrotina, _obter_loop_sincrono())
+    try:
+        return futuro.result(timeout)
+    except TimeoutError:
+        futuro.cancel()
+        raise
+
+
 # Factory functions para facilitar uso
 async def gerar_conteudo_ia(prompt: str, **kwargs) -> Dict[str, Any]:
     """Função de conveniência para gerar conteúdo"""
@@ -463,6 +1355,13 @@ async def gerar_conteudo_ia(prompt: str, **kwargs) -> Dict[str, Any]:
     return await client.gerar_conteudo(prompt, **kwargs)
 
 
+async def gerar_conteudo_stream_ia(prompt: str, **kwargs) -> AsyncIterator[str]:
+    """Função de conveniência para gerar conteúdo em streaming"""
+    client = get_ia_client()
+    async for pedaco in client.gerar_conteudo_stream(prompt, **kwargs):
+        yield pedaco
+
+
 async def gerar_com_fallback(prompts: List[str], **kwargs) -> Dict[str, Any]:
     """
     Tenta múltiplos prompts até um funcionar
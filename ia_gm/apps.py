@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class IaGmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ia_gm'
+
+    def ready(self):
+        # Conecta os sinais que invalidam o índice de memórias
+        from . import memory_index  # noqa: F401
@@ -0,0 +1,128 @@
+"""
+Consumers WebSocket das sessões de jogo do Arquiteto de Mundos
+"""
+
+import json
+import logging
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+
+from .models import SessaoIA
+from .game_session_manager import GameSessionManager, grupo_sessao
+
+logger = logging.getLogger(__name__)
+
+
+class SessaoJogoConsumer(AsyncWebsocketConsumer):
+    """
+    Consumer para o status de uma sessão de jogo em tempo real
+
+    Envia um snapshot do status ao conectar e depois só as mudanças
+    publicadas pelo GameSessionManager ('status_sessao', 'turno_processado'),
+    substituindo o polling periódico do cliente.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sessao_id = None
+        self.sessao_group_name = None
+        self.user = None
+        self.sessao = None
+
+    async def connect(self):
+        """Conectar participante à sessão"""
+        self.sessao_id = self.scope['url_route']['kwargs']['sessao_id']
+        self.user = self.scope.get('user')
+
+        # Verificar autenticação
+        if self.user is None or isinstance(self.user, AnonymousUser):
+            await self.close(code=4001)
+            return
+
+        # Verificar acesso à sessão
+        try:
+            self.sessao = await self.verificar_acesso_sessao()
+        except ObjectDoesNotExist:
+            logger.warning(f"Usuário {self.user.id} tentou acessar sessão inexistente {self.sessao_id}")
+            await self.close(code=4004)
+            return
+        except PermissionError:
+            logger.warning(f"Usuário {self.user.id} sem permissão para sessão {self.sessao_id}")
+            await self.close(code=4003)
+            return
+
+        self.sessao_group_name = grupo_sessao(self.sessao.id)
+
+        await self.accept()
+
+        # Entrar no grupo antes do snapshot para não perder mudanças no meio
+        await self.channel_layer.group_add(
+            self.sessao_group_name,
+            self.channel_name
+        )
+
+        await self.enviar_status()
+
+    async def disconnect(self, close_code):
+        """Sair do grupo da sessão"""
+        if self.sessao_group_name:
+            await self.channel_layer.group_discard(
+                self.sessao_group_name,
+                self.channel_name
+            )
+
+    async def receive(self, text_data):
+        """Receber mensagem do WebSocket"""
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+
+            if action == 'ping':
+                await self.send(text_data=json.dumps({'type': 'pong'}))
+            elif action == 'status':
+                await self.enviar_status()
+            else:
+                await self.send_error(f"Ação '{action}' não reconhecida")
+
+        except json.JSONDecodeError:
+            await self.send_error("Formato JSON inválido")
+        except Exception as e:
+            logger.exception(f"Erro ao processar mensagem da sessão {self.sessao_id}: {e}")
+            await self.send_error("Erro interno do servidor")
+
+    async def enviar_status(self):
+        """Enviar o status completo da sessão (inclui o último turno resolvido)"""
+        status = await GameSessionManager(self.sessao).aobter_status_sessao()
+        await self.send(text_data=json.dumps({
+            'type': 'status_sessao',
+            'dados': status
+        }, default=str))
+
+    # Handlers de eventos do grupo
+
+    async def sessao_evento(self, event):
+        """Repassar evento publicado pelo GameSessionManager"""
+        await self.send(text_data=json.dumps({
+            'type': event['evento'],
+            'dados': event['dados']
+        }, default=str))
+
+    async def send_error(self, message: str):
+        """Enviar mensagem de erro"""
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message,
+            'timestamp': timezone.now().isoformat()
+        }))
+
+    async def verificar_acesso_sessao(self) -> SessaoIA:
+        """Organizador ou jogador da campanha da sessão"""
+        sessao = await SessaoIA.objects.select_related('campanha').aget(id=self.sessao_id)
+        campanha = sessao.campanha
+        if campanha.organizador_id == self.user.id:
+            return sessao
+        if await campanha.jogadores.filter(id=self.user.id).aexists():
+            return sessao
+        raise PermissionError("Usuário não participa da campanha")
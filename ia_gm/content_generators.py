@@ -5,7 +5,9 @@ Integra com APIs de IA para gerar elementos narrativos dinâmicos
 
 import json
 import asyncio
-from typing import Dict, Any, List, Optional, Tuple
+import hashlib
+import logging
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -18,6 +20,11 @@ from .models import (
 )
 from .prompts import PromptGenerator, ArquitetoDeMundosPrompts
 from .ai_client import IAClient  # Cliente genérico para APIs de IA
+from .interaction_log import BufferInteracoes
+from .rate_limiter import OrcamentoExcedido
+
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -32,6 +39,20 @@ class ConteudoGerado:
     modelo_usado: str = ""
 
 
+def montar_contexto_sessao(sessao: SessaoIA, contexto: Dict[str, Any], ia_client: IAClient) -> Dict[str, Any]:
+    """Expande o contexto da solicitação com dados da campanha, da sessão e o orçamento do prompt"""
+    return {
+        'campanha_nome': sessao.campanha.nome,
+        'campanha_descricao': sessao.campanha.descricao,
+        'sistema': 'D&D 5e',  # Padrão por enquanto
+        'estilo': sessao.estilo_narrativo,
+        'criatividade': sessao.criatividade_nivel,
+        'dificuldade': sessao.dificuldade_nivel,
+        'orcamento_tokens': ia_client.orcamento_prompt(),
+        **contexto
+    }
+
+
 class BaseContentManager:
     """Classe base para todos os geradores de conteúdo"""
     
@@ -40,9 +61,9 @@ class BaseContentManager:
         self.cache_timeout = 3600  # 1 hora
     
     def _get_cache_key(self, tipo: str, **kwargs) -> str:
-        """Gera chave para cache baseada no tipo e parâmetros"""
-        key_data = f"{tipo}:{hash(str(sorted(kwargs.items())))}"
-        return f"arquiteto_mundos:{key_data}"
+        """Gera chave para cache baseada no tipo e parâmetros (estável entre processos)"""
+        material = json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str)
+        return f"arquiteto_mundos:{tipo}:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
     
     def _avaliar_qualidade(self, conteudo: str, tipo: str) -> float:
         """Avalia automaticamente a qualidade do conteúdo gerado"""
@@ -79,14 +100,20 @@ class BaseContentManager:
         
         return min(1.0, pontuacao)
     
-    async def _gerar_com_retry(self, prompt: str, max_tentativas: int = 3) -> ConteudoGerado:
-        """Gera conteúdo com sistema de retry e fallback"""
+    async def _gerar_com_retry(
+        self,
+        prompt: str,
+        max_tentativas: int = 3,
+        campanha_id: Optional[int] = None,
+        **kwargs
+    ) -> ConteudoGerado:
+        """Gera conteúdo com sistema de retry e fallback (kwargs vão para IAClient.gerar_conteudo)"""
         ultima_excecao = None
         
         for tentativa in range(max_tentativas):
             try:
                 inicio = asyncio.get_event_loop().time()
-                resposta = await self.ia_client.gerar_conteudo(prompt)
+                resposta = await self.ia_client.gerar_conteudo(prompt, campanha_id=campanha_id, **kwargs)
                 fim = asyncio.get_event_loop().time()
                 
                 conteudo_gerado = ConteudoGerado(
@@ -110,6 +137,9 @@ class BaseContentManager:
                 
                 return conteudo_gerado
                 
+            except OrcamentoExcedido:
+                # Orçamento estourado não se resolve com nova tentativa
+                raise
             except Exception as e:
                 ultima_excecao = e
                 if tentativa < max_tentativas - 1:
@@ -137,15 +167,7 @@ class NPCManager(BaseContentManager):
             salvar_automaticamente: Se deve salvar no banco automaticamente
         """
         # Prepara contexto expandido
-        contexto_completo = {
-            'campanha_nome': sessao.campanha.nome,
-            'campanha_descricao': sessao.campanha.descricao,
-            'sistema': 'D&D 5e',  # Padrão por enquanto
-            'estilo': sessao.estilo_narrativo,
-            'criatividade': sessao.criatividade_nivel,
-            'dificuldade': sessao.dificuldade_nivel,
-            **contexto
-        }
+        contexto_completo = montar_contexto_sessao(sessao, contexto, self.ia_client)
         
         # Verifica cache primeiro
         cache_key = self._get_cache_key('npc', **contexto_completo)
@@ -157,7 +179,7 @@ class NPCManager(BaseContentManager):
         prompt = PromptGenerator.gerar_npc(contexto_completo)
         
         # Gera conteúdo
-        conteudo = await self._gerar_com_retry(prompt)
+        conteudo = await self._gerar_com_retry(prompt, campanha_id=sessao.campanha_id)
         
         # Cria objeto NPC
         npc = self._criar_npc_do_conteudo(conteudo, sessao)
@@ -247,7 +269,7 @@ class NPCManager(BaseContentManager):
         }
         
         prompt = PromptGenerator.gerar_dialogo(contexto_completo)
-        conteudo = await self._gerar_com_retry(prompt)
+        conteudo = await self._gerar_com_retry(prompt, campanha_id=npc.campanha_id)
         
         # Atualiza primeiro encontro se necessário
         if npc.primeiro_encontro:
@@ -262,6 +284,11 @@ class NPCManager(BaseContentManager):
 class ArquitetoDeMundosOrchestrator:
     """Orquestrador simplificado do Arquiteto de Mundos"""
     
+    # Tipos aceitos na geração em lote
+    TIPOS_LOTE = (
+        TipoConteudo.NPC, TipoConteudo.LOCAL, TipoConteudo.MISSAO, TipoConteudo.ITEM, TipoConteudo.NARRATIVA
+    )
+    
     def __init__(self, ia_client):
         self.ia_client = ia_client
         self.npc_manager = NPCManager(ia_client)
@@ -306,7 +333,10 @@ class ArquitetoDeMundosOrchestrator:
                     'sucesso': False,
                     'erro': f'Tipo de conteúdo não suportado: {tipo_solicitacao}'
                 }
-                
+        
+        except OrcamentoExcedido:
+            # A view responde 429; não é um erro de solicitação
+            raise
         except Exception as e:
             return {
                 'sucesso': False,
@@ -320,31 +350,10 @@ class ArquitetoDeMundosOrchestrator:
         contexto: Dict[str, Any]
     ) -> ConteudoGerado:
         """Gera conteúdo genérico para tipos não especializados"""
-        from .prompts import PromptGenerator
-        
-        # Prepara contexto
-        contexto_completo = {
-            'campanha_nome': sessao.campanha.nome,
-            'campanha_descricao': sessao.campanha.descricao,
-            'sistema': 'D&D 5e',
-            'estilo': sessao.estilo_narrativo,
-            'criatividade': sessao.criatividade_nivel,
-            'dificuldade': sessao.dificuldade_nivel,
-            **contexto
-        }
-        
-        # Seleciona prompt baseado no tipo
-        if tipo == TipoConteudo.NARRATIVA:
-            prompt = PromptGenerator.gerar_narrativa(contexto_completo)
-        elif tipo == TipoConteudo.LOCAL:
-            prompt = PromptGenerator.gerar_local(contexto_completo)
-        elif tipo == TipoConteudo.MISSAO:
-            prompt = PromptGenerator.gerar_missao(contexto_completo)
-        else:
-            prompt = f"Crie um {tipo} interessante para a campanha baseado no contexto: {contexto_completo}"
+        prompt = self._prompt_generico(tipo, montar_contexto_sessao(sessao, contexto, self.ia_client))
         
         # Gera conteúdo
-        resposta = await self.ia_client.gerar_conteudo(prompt)
+        resposta = await self.ia_client.gerar_conteudo(prompt, campanha_id=sessao.campanha_id)
         
         # Registra interação
         InteracaoIA.objects.create(
@@ -366,6 +375,186 @@ class ArquitetoDeMundosOrchestrator:
             modelo_usado=resposta.get('modelo', 'desconhecido')
         )
     
+    @staticmethod
+    def _prompt_generico(tipo: str, contexto_completo: Dict[str, Any]) -> str:
+        """Seleciona o prompt baseado no tipo"""
+        if tipo == TipoConteudo.NARRATIVA:
+            return PromptGenerator.gerar_narrativa(contexto_completo)
+        elif tipo == TipoConteudo.LOCAL:
+            return PromptGenerator.gerar_local(contexto_completo)
+        elif tipo == TipoConteudo.MISSAO:
+            return PromptGenerator.gerar_missao(contexto_completo)
+        elif tipo == TipoConteudo.ITEM:
+            return PromptGenerator.gerar_item(contexto_completo)
+        return f"Crie um {tipo} interessante para a campanha baseado no contexto: {contexto_completo}"
+    
+    async def processar_lote(
+        self,
+        sessao: SessaoIA,
+        especificacoes: List[Dict[str, Any]],
+        usuario_id: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Gera vários conteúdos em paralelo, entregando cada um assim que fica pronto
+        
+        No máximo IA_GM_LOTE_CONCORRENCIA gerações ficam em andamento ao mesmo
+        tempo. Os NPCs são gravados num único bulk_create e as interações num
+        só INSERT quando o lote termina - ou quando o cliente desconecta: os
+        itens já gerados (e cobrados) são gravados mesmo assim.
+        
+        Args:
+            sessao: Sessão GM (com a campanha já carregada)
+            especificacoes: Lista de {'tipo': um de TIPOS_LOTE, 'parametros': {...}}
+            usuario_id: Quem pediu o lote (padrão: organizador da campanha)
+        
+        Yields:
+            {'evento': 'item', 'indice', 'sucesso', ...} por item, na ordem de
+            conclusão, e por fim {'evento': 'fim', 'npcs': {indice: id}, ...}
+        """
+        semaforo = asyncio.Semaphore(max(getattr(settings, 'IA_GM_LOTE_CONCORRENCIA', 4), 1))
+        usuario_id = usuario_id or sessao.campanha.organizador_id
+        interacoes = BufferInteracoes(limite=len(especificacoes) or 1)
+        npcs: List[Tuple[int, NPCGerado]] = []
+        registrados = set()
+        falhas = 0
+        
+        async def gerar(indice: int, especificacao: Dict[str, Any]):
+            async with semaforo:
+                try:
+                    return indice, await self._gerar_item_lote(sessao, especificacao), None
+                except Exception as e:
+                    logger.warning(f"Item {indice} do lote da sessão {sessao.id} falhou: {e}")
+                    return indice, None, e
+        
+        async def registrar(indice: int, gerado) -> Dict[str, Any]:
+            tipo, prompt, conteudo, npc = gerado
+            registrados.add(indice)
+            item = {
+                'evento': 'item',
+                'indice': indice,
+                'sucesso': True,
+                'tipo': tipo,
+                'conteudo': conteudo.conteudo,
+                'qualidade': conteudo.qualidade,
+                'tokens_usados': conteudo.tokens_usados,
+            }
+            if npc is not None:
+                npcs.append((indice, npc))
+                item['nome'] = npc.nome
+            await interacoes.aadicionar(
+                sessao=sessao,
+                usuario_id=usuario_id,
+                tipo_interacao=tipo,
+                prompt_usuario=prompt[:2000],
+                resposta_ia=conteudo.conteudo[:2000],
+                tokens_usados=conteudo.tokens_usados,
+                tempo_geracao=conteudo.tempo_geracao,
+                contexto={'lote': True, 'indice': indice, 'modelo': conteudo.modelo_usado}
+            )
+            return item
+        
+        tarefas = [asyncio.ensure_future(gerar(indice, especificacao))
+                   for indice, especificacao in enumerate(especificacoes)]
+        try:
+            for proxima in asyncio.as_completed(tarefas):
+                indice, gerado, erro = await proxima
+                if erro is not None:
+                    falhas += 1
+                    yield {'evento': 'item', 'indice': indice, 'sucesso': False, 'erro': str(erro)}
+                    continue
+                yield await registrar(indice, gerado)
+        finally:
+            # Cliente desconectou no meio: não deixa gerações órfãs consumindo a cota
+            for tarefa in tarefas:
+                tarefa.cancel()
+            # Itens prontos que o cliente não chegou a receber também foram cobrados
+            for tarefa in tarefas:
+                if tarefa.done() and not tarefa.cancelled():
+                    indice, gerado, erro = tarefa.result()
+                    if erro is None and indice not in registrados:
+                        await registrar(indice, gerado)
+            # Protegida: um novo cancelamento da resposta não interrompe a gravação
+            await asyncio.shield(self._gravar_lote(npcs, interacoes))
+        
+        yield {
+            'evento': 'fim',
+            'total': len(especificacoes),
+            'falhas': falhas,
+            'npcs': {indice: npc.id for indice, npc in npcs},
+        }
+    
+    @staticmethod
+    async def _gravar_lote(npcs: List[Tuple[int, NPCGerado]], interacoes: BufferInteracoes):
+        if npcs:
+            await NPCGerado.objects.abulk_create([npc for _, npc in npcs])
+        await interacoes.adescarregar()
+    
+    async def _gerar_item_lote(
+        self,
+        sessao: SessaoIA,
+        especificacao: Dict[str, Any]
+    ) -> Tuple[str, str, ConteudoGerado, Optional[NPCGerado]]:
+        """Gera um item do lote sem gravar nada; retorna (tipo, prompt, conteúdo, NPC não salvo)"""
+        tipo = especificacao.get('tipo')
+        parametros = especificacao.get('parametros') or {}
+        
+        if tipo == TipoConteudo.NPC:
+            prompt = PromptGenerator.gerar_npc(montar_contexto_sessao(sessao, parametros, self.ia_client))
+        elif tipo in self.TIPOS_LOTE:
+            prompt = self._prompt_generico(tipo, montar_contexto_sessao(sessao, parametros, self.ia_client))
+        else:
+            raise ValueError(f'Tipo de conteúdo não suportado: {tipo}')
+        
+        # Especificações iguais num lote devem render conteúdos distintos
+        conteudo = await self.npc_manager._gerar_com_retry(
+            prompt, campanha_id=sessao.campanha_id, usar_cache=False, coalescer=False
+        )
+        conteudo.tipo = tipo
+        npc = self.npc_manager._criar_npc_do_conteudo(conteudo, sessao) if tipo == TipoConteudo.NPC else None
+        return tipo, prompt, conteudo, npc
+    
+    async def transmitir_narrativa(
+        self,
+        sessao: SessaoIA,
+        sala_id: int,
+        contexto: Dict[str, Any]
+    ) -> ConteudoGerado:
+        """
+        Gera narrativa em streaming, encaminhando cada pedaço para a sala de chat
+        
+        Os jogadores veem o texto surgir enquanto a IA escreve (eventos
+        'narrative_chunk'); o conteúdo completo é devolvido ao final.
+        """
+        from mensagens.utils import transmitir_narrativa_para_chat
+        
+        contexto_completo = montar_contexto_sessao(sessao, contexto, self.ia_client)
+        prompt = PromptGenerator.gerar_narrativa(contexto_completo)
+        
+        inicio = asyncio.get_event_loop().time()
+        conteudo = await transmitir_narrativa_para_chat(
+            sala_id,
+            self.ia_client.gerar_conteudo_stream(prompt, campanha_id=sessao.campanha_id),
+            metadata={'sessao_id': sessao.id, 'tipo': TipoConteudo.NARRATIVA}
+        )
+        tempo_geracao = asyncio.get_event_loop().time() - inicio
+        
+        await InteracaoIA.objects.acreate(
+            sessao=sessao,
+            usuario=sessao.campanha.organizador,
+            tipo_interacao=TipoConteudo.NARRATIVA,
+            prompt_usuario=prompt[:2000],
+            resposta_ia=conteudo[:2000],
+            tempo_geracao=tempo_geracao,
+            contexto={'tipo': TipoConteudo.NARRATIVA, 'stream': True, 'sala_id': sala_id}
+        )
+        
+        return ConteudoGerado(
+            tipo=TipoConteudo.NARRATIVA,
+            conteudo=conteudo,
+            metadata={'stream': True, 'sala_id': sala_id},
+            tempo_geracao=tempo_geracao
+        )
+    
     async def obter_sugestoes_contextuais(
         self, 
         sessao: SessaoIA, 
@@ -384,7 +573,7 @@ class ArquitetoDeMundosOrchestrator:
             Seja criativo mas mantenha coerência com o tom da campanha.
             """
             
-            resposta = await self.ia_client.gerar_conteudo(prompt)
+            resposta = await self.ia_client.gerar_conteudo(prompt, campanha_id=sessao.campanha_id)
             
             # Parse simples das sugestões
             linhas = resposta.get('conteudo', '').split('\n')
@@ -0,0 +1,113 @@
+"""
+Histórico de conversa com a IA por sessão
+Mensagens estruturadas (papel + conteúdo) enviadas aos provedores em vez de um prompt achatado
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+
+from .resilience import obter_cache_ia
+from .tokenizer import contar_tokens
+
+
+logger = logging.getLogger(__name__)
+
+PAPEL_USUARIO = 'user'
+PAPEL_ASSISTENTE = 'assistant'
+
+
+def chave_conversa(sessao_id: int) -> str:
+    return f"conversa_ia_{sessao_id}"
+
+
+class Conversa:
+    """
+    Mensagens trocadas com a IA numa sessão
+
+    Cada turno só acrescenta a mensagem nova e a resposta; o histórico já
+    montado não é reformatado, então o prefixo enviado ao provedor se repete
+    entre turnos. Quando passa do limite de tokens, os turnos mais antigos
+    saem pelo início, sempre aos pares (usuário + resposta).
+
+    Fica no cache compartilhado 'ia_gm': o processo web e os workers Celery
+    continuam a mesma conversa.
+    """
+
+    def __init__(self, sessao_id: int, mensagens: Optional[List[Dict[str, Any]]] = None):
+        self.sessao_id = sessao_id
+        # Cada item guarda a contagem de tokens para não recontar o histórico
+        self.mensagens: List[Dict[str, Any]] = mensagens or []
+
+    def __len__(self):
+        return len(self.mensagens)
+
+    @property
+    def tokens(self) -> int:
+        return sum(mensagem['tokens'] for mensagem in self.mensagens)
+
+    def adicionar(self, papel: str, conteudo: str, turno: Optional[int] = None):
+        mensagem = {'role': papel, 'content': conteudo, 'tokens': contar_tokens(conteudo)}
+        if turno is not None:
+            mensagem['turno'] = turno
+        self.mensagens.append(mensagem)
+
+    def descartar_turno(self, turno: int) -> int:
+        """
+        Remove o turno `turno` e o que veio depois dele; retorna quantas mensagens saíram
+
+        Um turno refeito (nova tentativa da tarefa, conflito ao gravar o estado)
+        substitui o registro anterior em vez de duplicá-lo no histórico.
+        """
+        for posicao, mensagem in enumerate(self.mensagens):
+            if mensagem.get('turno', -1) >= turno:
+                removidas = len(self.mensagens) - posicao
+                del self.mensagens[posicao:]
+                return removidas
+        return 0
+
+    def aparar(self, limite_tokens: int) -> int:
+        """Remove turnos do início até caber em limite_tokens; retorna quantas mensagens saíram"""
+        removidas = 0
+        total = self.tokens
+        while self.mensagens and total > limite_tokens:
+            # Um turno completo por vez, para o histórico sempre começar pelo usuário
+            for _ in range(2 if len(self.mensagens) > 1 else 1):
+                total -= self.mensagens.pop(0)['tokens']
+                removidas += 1
+        if removidas:
+            logger.debug(f"Conversa da sessão {self.sessao_id}: {removidas} mensagem(ns) antiga(s) removida(s)")
+        return removidas
+
+    def historico(self) -> List[Dict[str, str]]:
+        """Mensagens no formato dos provedores ({'role', 'content'})"""
+        return [{'role': m['role'], 'content': m['content']} for m in self.mensagens]
+
+    @staticmethod
+    def _timeout() -> int:
+        return getattr(settings, 'IA_GM_CONVERSA_TIMEOUT', 6 * 3600)
+
+    @classmethod
+    def carregar(cls, sessao_id: int) -> 'Conversa':
+        return cls(sessao_id, obter_cache_ia().get(chave_conversa(sessao_id)))
+
+    def salvar(self):
+        obter_cache_ia().set(chave_conversa(self.sessao_id), self.mensagens, self._timeout())
+
+    @staticmethod
+    def remover(sessao_id: int):
+        """Descarta o histórico da sessão (fim de jogo)"""
+        obter_cache_ia().delete(chave_conversa(sessao_id))
+
+    @classmethod
+    async def acarregar(cls, sessao_id: int) -> 'Conversa':
+        return cls(sessao_id, await obter_cache_ia().aget(chave_conversa(sessao_id)))
+
+    async def asalvar(self):
+        await obter_cache_ia().aset(chave_conversa(self.sessao_id), self.mensagens, self._timeout())
+
+    @staticmethod
+    async def aremover(sessao_id: int):
+        """Versão assíncrona de remover"""
+        await obter_cache_ia().adelete(chave_conversa(sessao_id))
+
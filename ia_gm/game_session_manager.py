@@ -6,14 +6,22 @@ Implementa o comportamento de Mestre IA durante sessões ativas
 import json
 import logging
 from enum import Enum
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Any
+from dataclasses import dataclass, field
 from datetime import timezone, datetime
 
-from django.core.cache import cache
-from django.db import models
+import msgpack
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import models, transaction
 
 from .models import SessaoIA, InteracaoIA, NPCGerado
+from .conversation import Conversa
+from .interaction_log import BufferInteracoes
+from .memory_manager import get_memory_manager
+from .turn_store import ArmazemEstadoTurno, ConflitoEstadoTurno
 from personagens.models import Personagem
 from .master_rules import (
     MasterRulesEngine, ModoOperacao, FaseCicloJogo, 
@@ -38,7 +46,7 @@ class FaseJogo(Enum):
     PROCESSANDO_TURNO = "processando_turno"
 
 
-@dataclass
+@dataclass(slots=True)
 class AcaoJogador:
     """Representa uma ação declarada por um jogador"""
     personagem_nome: str
@@ -48,7 +56,40 @@ class AcaoJogador:
     processada: bool = False
 
 
-@dataclass
+def grupo_sessao(sessao_id: int) -> str:
+    """Nome do grupo de canais que recebe os eventos de uma sessão de jogo"""
+    return f"sessao_ia_{sessao_id}"
+
+
+def notificar_sessao(sessao_id: int, evento: str, dados: Dict[str, Any]):
+    """Envia um evento ao grupo de canais da sessão (falhas só são registradas)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            grupo_sessao(sessao_id),
+            {'type': 'sessao_evento', 'evento': evento, 'dados': dados}
+        )
+    except Exception as e:
+        logger.warning(f"Falha ao notificar sessão {sessao_id} ({evento}): {e}")
+
+
+async def anotificar_sessao(sessao_id: int, evento: str, dados: Dict[str, Any]):
+    """Versão assíncrona de notificar_sessao"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        await channel_layer.group_send(
+            grupo_sessao(sessao_id),
+            {'type': 'sessao_evento', 'evento': evento, 'dados': dados}
+        )
+    except Exception as e:
+        logger.warning(f"Falha ao notificar sessão {sessao_id} ({evento}): {e}")
+
+
+@dataclass(slots=True)
 class EstadoTurno:
     """Estado atual do turno de jogo"""
     numero_turno: int
@@ -58,40 +99,125 @@ class EstadoTurno:
     personagens_esperados: List[str]
     aguardando_personagens: List[str]
     narrativa_resultado: Optional[str] = None
+    job_id: Optional[str] = None  # tarefa que reivindicou a resolução do turno
+    versao: int = field(default=0, compare=False)  # versão do snapshot lido (compare-and-set); não é persistida
+
+
+# Formato binário (msgpack) do estado do turno: lista posicional precedida do
+# número do formato. Campos novos entram sempre no fim, com padrão None, e são
+# ignorados por código antigo; o formato só muda em alterações incompatíveis.
+FORMATO_ESTADO_TURNO = 1
+
+
+def codificar_estado_turno(estado: EstadoTurno) -> bytes:
+    """Serializa o estado do turno em msgpack compacto"""
+    return msgpack.packb([
+        FORMATO_ESTADO_TURNO,
+        estado.numero_turno,
+        estado.fase.value,
+        estado.descricao_situacao,
+        [
+            [acao.personagem_nome, acao.usuario_id, acao.acao, acao.timestamp, acao.processada]
+            for acao in estado.acoes_recebidas
+        ],
+        estado.personagens_esperados,
+        estado.aguardando_personagens,
+        estado.narrativa_resultado,
+        estado.job_id,
+    ], datetime=True)
+
+
+def decodificar_estado_turno(dados: bytes, versao: int = 0) -> EstadoTurno:
+    """Reconstrói o estado do turno a partir de codificar_estado_turno"""
+    campos = msgpack.unpackb(dados, timestamp=3)
+    if campos[0] != FORMATO_ESTADO_TURNO:
+        raise ValueError(f"Formato de estado de turno não suportado: {campos[0]}")
+    
+    campos = campos[1:9] + [None] * (9 - len(campos))
+    numero_turno, fase, descricao, acoes, esperados, aguardando, narrativa, job_id = campos
+    return EstadoTurno(
+        numero_turno=numero_turno,
+        fase=FaseJogo(fase),
+        descricao_situacao=descricao,
+        acoes_recebidas=[AcaoJogador(*acao[:5]) for acao in acoes],
+        personagens_esperados=esperados,
+        aguardando_personagens=aguardando,
+        narrativa_resultado=narrativa,
+        job_id=job_id,
+        versao=versao,
+    )
 
 
 class GameSessionManager:
-    """Gerenciador principal do modo de jogo"""
+    """
+    Gerenciador principal do modo de jogo
+    
+    O estado do turno é gravado com compare-and-set (ArmazemEstadoTurno):
+    toda alteração passa por _atualizar_estado_turno, que relê e reaplica a
+    mudança se outro worker gravou no meio. Cada mudança é publicada como
+    'status_sessao' no grupo de canais da sessão (SessaoJogoConsumer).
+    
+    As operações chamadas pelas views têm versões assíncronas (prefixo `a`,
+    como no ORM do Django) que usam apenas ORM e cache assíncronos; as
+    versões síncronas atendem o worker Celery e demais chamadores WSGI.
+    """
+    
+    # Releituras após conflito antes de desistir de gravar o turno
+    TENTATIVAS_CAS = 5
     
     def __init__(self, sessao: SessaoIA):
         self.sessao = sessao
-        self.cache_key_estado = f"game_session_{sessao.id}_estado"
-        self.cache_key_turno = f"game_session_{sessao.id}_turno"
-        self.cache_timeout = 3600  # 1 hora
+        self.armazem_turno = ArmazemEstadoTurno(sessao.id)
+        # Interações do loop de jogo, gravadas em lote ao fim de cada turno
+        self.interacoes = BufferInteracoes()
     
     @property
     def estado_sessao(self) -> EstadoSessao:
         """Obtém o estado atual da sessão"""
+        return self._estado_sessao_de(self.armazem_turno.ler('estado_sessao'))
+    
+    async def aobter_estado_sessao(self) -> EstadoSessao:
+        """Versão assíncrona de estado_sessao"""
+        return self._estado_sessao_de(await self.armazem_turno.aler('estado_sessao'))
+    
+    def _estado_sessao_de(self, snapshot: Optional[tuple]) -> EstadoSessao:
+        # O estado fica no snapshot do banco, visível para o worker Celery;
+        # sem snapshot a sessão ainda está em configuração
         if not self.sessao.ativa:
             return EstadoSessao.ENCERRADA
-        
-        estado_cache = cache.get(self.cache_key_estado)
-        if estado_cache:
-            return EstadoSessao(estado_cache)
-        
-        # Se não há cache, assume que é configuração
-        return EstadoSessao.CONFIGURACAO
+        return EstadoSessao(snapshot[0]) if snapshot and snapshot[0] else EstadoSessao.CONFIGURACAO
     
     def ativar_modo_jogo(self) -> Dict[str, Any]:
         """Ativa o modo de jogo e inicia primeira situação"""
-        # Marca sessão como ativa no cache
-        cache.set(self.cache_key_estado, EstadoSessao.ATIVA.value, self.cache_timeout)
-        
-        # Obtém personagens da campanha
+        # Obtém personagens da campanha e cria o primeiro turno
         personagens = self._obter_personagens_ativos()
+        primeiro_turno = self._criar_primeiro_turno(personagens)
+        self.armazem_turno.substituir(codificar_estado_turno(primeiro_turno))
+        
+        # Marca sessão como ativa (e descarta o resultado de um jogo anterior)
+        self.armazem_turno.atualizar(estado_sessao=EstadoSessao.ATIVA.value, ultimo_turno=None)
+        self._publicar_status(primeiro_turno)
+        
+        # Gera primeira descrição de situação
+        primeira_situacao = self._gerar_situacao_inicial(personagens)
+        
+        return self._resposta_modo_ativado(personagens, primeira_situacao)
+    
+    async def aativar_modo_jogo(self) -> Dict[str, Any]:
+        """Versão assíncrona de ativar_modo_jogo"""
+        personagens = await self._aobter_personagens_ativos()
+        primeiro_turno = self._criar_primeiro_turno(personagens)
+        await self.armazem_turno.asubstituir(codificar_estado_turno(primeiro_turno))
+        await self.armazem_turno.aatualizar(estado_sessao=EstadoSessao.ATIVA.value, ultimo_turno=None)
+        await self._apublicar_status(primeiro_turno)
         
-        # Cria primeiro turno
-        estado_turno = EstadoTurno(
+        primeira_situacao = await self._agerar_situacao_inicial(personagens)
+        
+        return self._resposta_modo_ativado(personagens, primeira_situacao)
+    
+    @staticmethod
+    def _criar_primeiro_turno(personagens: List[Personagem]) -> EstadoTurno:
+        return EstadoTurno(
             numero_turno=1,
             fase=FaseJogo.DESCREVENDO_SITUACAO,
             descricao_situacao="",
@@ -99,13 +225,9 @@ class GameSessionManager:
             personagens_esperados=[p.nome for p in personagens],
             aguardando_personagens=[]
         )
-        
-        # Salva no cache
-        cache.set(self.cache_key_turno, estado_turno.__dict__, self.cache_timeout)
-        
-        # Gera primeira descrição de situação
-        primeira_situacao = self._gerar_situacao_inicial()
-        
+    
+    @staticmethod
+    def _resposta_modo_ativado(personagens: List[Personagem], primeira_situacao: str) -> Dict[str, Any]:
         return {
             "modo": "jogo_ativo",
             "turno": 1,
@@ -120,35 +242,49 @@ class GameSessionManager:
         if self.estado_sessao != EstadoSessao.ATIVA:
             return {"erro": "Sessão não está ativa"}
         
-        estado_turno = self._obter_estado_turno()
-        if not estado_turno:
-            return {"erro": "Erro ao obter estado do turno"}
-        
         # Identifica o personagem do jogador
         personagem = self._obter_personagem_do_usuario(usuario_id)
         if not personagem:
             return {"erro": "Personagem não encontrado para este usuário"}
         
-        if estado_turno.fase == FaseJogo.AGUARDANDO_ACOES:
-            return self._processar_acao_jogador(entrada, personagem, estado_turno)
-        else:
-            return {"mensagem": f"Aguardando sua ação, {personagem.nome}!"}
+        return self._processar_acao_jogador(entrada, personagem)
+    
+    async def aprocessar_entrada_jogador(self, entrada: str, usuario_id: int) -> Dict[str, Any]:
+        """Versão assíncrona de processar_entrada_jogador"""
+        if await self.aobter_estado_sessao() != EstadoSessao.ATIVA:
+            return {"erro": "Sessão não está ativa"}
+        
+        personagem = await self._aobter_personagem_do_usuario(usuario_id)
+        if not personagem:
+            return {"erro": "Personagem não encontrado para este usuário"}
+        
+        return await self._aprocessar_acao_jogador(entrada, personagem)
     
     def iniciar_aguardo_acoes(self, situacao: str) -> Dict[str, Any]:
         """Inicia a fase de aguardo de ações dos jogadores"""
-        estado_turno = self._obter_estado_turno()
-        if not estado_turno:
-            return {"erro": "Erro ao obter estado do turno"}
-        
-        # Atualiza estado
+        estado_turno, recusa = self._atualizar_estado_turno(
+            lambda estado: self._preparar_aguardo(estado, situacao)
+        )
+        return recusa or self._resposta_aguardo(estado_turno)
+    
+    async def ainiciar_aguardo_acoes(self, situacao: str) -> Dict[str, Any]:
+        """Versão assíncrona de iniciar_aguardo_acoes"""
+        estado_turno, recusa = await self._aatualizar_estado_turno(
+            lambda estado: self._preparar_aguardo(estado, situacao)
+        )
+        return recusa or self._resposta_aguardo(estado_turno)
+    
+    @staticmethod
+    def _preparar_aguardo(estado_turno: EstadoTurno, situacao: str) -> None:
+        """Passa o turno para o aguardo de ações"""
         estado_turno.fase = FaseJogo.AGUARDANDO_ACOES
         estado_turno.descricao_situacao = situacao
         estado_turno.aguardando_personagens = estado_turno.personagens_esperados.copy()
         estado_turno.acoes_recebidas = []
-        
-        # Salva no cache
-        cache.set(self.cache_key_turno, estado_turno.__dict__, self.cache_timeout)
-        
+    
+    @staticmethod
+    def _resposta_aguardo(estado_turno: EstadoTurno) -> Dict[str, Any]:
+        situacao = estado_turno.descricao_situacao
         personagens_str = ", ".join(estado_turno.personagens_esperados)
         
         return {
@@ -159,10 +295,40 @@ class GameSessionManager:
             "instrucoes": "Aguardando as ações de todos os personagens antes de continuar..."
         }
     
-    def _processar_acao_jogador(self, acao: str, personagem: Personagem, estado_turno: EstadoTurno) -> Dict[str, Any]:
+    def _processar_acao_jogador(self, acao: str, personagem: Personagem) -> Dict[str, Any]:
         """Processa a ação de um jogador específico"""
+        estado_turno, recusa = self._atualizar_estado_turno(
+            lambda estado: self._registrar_acao_no_turno(acao, personagem, estado)
+        )
+        if recusa:
+            return recusa
+        
+        # A ação fica no estado do turno; vira InteracaoIA quando o turno é resolvido.
+        # A ação que completou o turno foi gravada junto com a mudança de fase,
+        # então só uma requisição chega aqui para enfileirar
+        if estado_turno.fase == FaseJogo.PROCESSANDO_TURNO:
+            return self._enfileirar_turno(estado_turno)
+        return self._resposta_acao_registrada(personagem.nome, acao, estado_turno)
+    
+    async def _aprocessar_acao_jogador(self, acao: str, personagem: Personagem) -> Dict[str, Any]:
+        estado_turno, recusa = await self._aatualizar_estado_turno(
+            lambda estado: self._registrar_acao_no_turno(acao, personagem, estado)
+        )
+        if recusa:
+            return recusa
+        
+        if estado_turno.fase == FaseJogo.PROCESSANDO_TURNO:
+            return await self._aenfileirar_turno(estado_turno)
+        return self._resposta_acao_registrada(personagem.nome, acao, estado_turno)
+    
+    @staticmethod
+    def _registrar_acao_no_turno(acao: str, personagem: Personagem, estado_turno: EstadoTurno) -> Optional[Dict[str, Any]]:
+        """Anota a ação no estado do turno; retorna a resposta de recusa se ela não cabe"""
         nome_personagem = personagem.nome
         
+        if estado_turno.fase != FaseJogo.AGUARDANDO_ACOES:
+            return {"mensagem": f"Aguardando sua ação, {nome_personagem}!"}
+        
         # Verifica se já declarou ação neste turno
         for acao_existente in estado_turno.acoes_recebidas:
             if acao_existente.personagem_nome == nome_personagem:
@@ -178,30 +344,150 @@ class GameSessionManager:
         # Registra a ação
         nova_acao = AcaoJogador(
             personagem_nome=nome_personagem,
-            usuario_id=personagem.usuario.id,
+            usuario_id=personagem.usuario_id,
             acao=acao,
             timestamp=datetime.now(timezone.utc)
         )
         
-        estado_turno.acoes_recebidas.append(nova_acao.__dict__)
+        estado_turno.acoes_recebidas.append(nova_acao)
         estado_turno.aguardando_personagens.remove(nome_personagem)
         
-        # Atualiza cache
-        cache.set(self.cache_key_turno, estado_turno.__dict__, self.cache_timeout)
-        
-        # Registra interação
-        self._registrar_interacao_jogador(personagem, acao)
+        # Todos declararam: o turno passa a ser resolvido
+        if not estado_turno.aguardando_personagens:
+            estado_turno.fase = FaseJogo.PROCESSANDO_TURNO
+        return None
+    
+    @staticmethod
+    def _resposta_acao_registrada(nome_personagem: str, acao: str, estado_turno: EstadoTurno) -> Dict[str, Any]:
+        aguardando_str = ", ".join(estado_turno.aguardando_personagens)
+        return {
+            "acao_confirmada": f"**{nome_personagem}**: {acao}",
+            "aguardando": aguardando_str,
+            "mensagem": f"Ação de **{nome_personagem}** registrada! Aguardando: **{aguardando_str}**"
+        }
+    
+    def _enfileirar_turno(self, estado_turno: EstadoTurno) -> Dict[str, Any]:
+        """
+        Envia a resolução do turno para a fila 'ia_gm' do Celery
+
+        Retorna imediatamente com o id do job; o resultado é publicado no grupo
+        de canais da sessão e fica disponível em obter_status_sessao. Se o
+        broker estiver indisponível, resolve o turno na própria requisição.
+        """
+        from .tasks import processar_turno_ia
+
+        try:
+            job = processar_turno_ia.delay(self.sessao.id, estado_turno.numero_turno)
+        except Exception as e:
+            logger.warning(f"Falha ao enfileirar turno {estado_turno.numero_turno} da sessão {self.sessao.id}: {e}")
+            return self._concluir_turno(self._processar_turno_completo(estado_turno))
+
+        return self._resposta_turno_enfileirado(job.id, estado_turno)
+    
+    async def _aenfileirar_turno(self, estado_turno: EstadoTurno) -> Dict[str, Any]:
+        from .tasks import processar_turno_ia
+
+        try:
+            # A publicação no broker é E/S bloqueante do cliente Celery
+            job = await sync_to_async(processar_turno_ia.delay, thread_sensitive=False)(
+                self.sessao.id, estado_turno.numero_turno
+            )
+        except Exception as e:
+            logger.warning(f"Falha ao enfileirar turno {estado_turno.numero_turno} da sessão {self.sessao.id}: {e}")
+            return await sync_to_async(
+                lambda: self._concluir_turno(self._processar_turno_completo(estado_turno))
+            )()
+
+        return self._resposta_turno_enfileirado(job.id, estado_turno)
+    
+    def _resposta_turno_enfileirado(self, job_id: str, estado_turno: EstadoTurno) -> Dict[str, Any]:
+        return {
+            "turno_enfileirado": True,
+            "job_id": job_id,
+            "numero_turno": estado_turno.numero_turno,
+            "acoes_processadas": self._formatar_acoes(estado_turno),
+            "mensagem": "⏳ **Todas as ações recebidas!** O Mestre está resolvendo o turno..."
+        }
+    
+    def resolver_turno(self, numero_turno: int, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Resolve um turno enfileirado (executado pelo worker Celery)
+        
+        Args:
+            numero_turno: Turno que foi enfileirado
+            job_id: Id da tarefa, devolvido ao cliente junto com o resultado
+        
+        Returns:
+            Resultado do turno, ou None se o turno já foi resolvido ou
+            está sendo resolvido por outra tarefa
+        """
+        def reivindicar(estado: EstadoTurno) -> Optional[Dict[str, Any]]:
+            if (estado.numero_turno != numero_turno or estado.fase != FaseJogo.PROCESSANDO_TURNO
+                    or estado.job_id not in (None, job_id)):
+                return {"ignorado": True}
+            # A mesma tarefa pode refazer o turno (reentrega após queda do worker)
+            estado.job_id = job_id
+            return None
+
+        # Reivindicar não muda nada visível para os jogadores
+        estado_turno, recusa = self._atualizar_estado_turno(reivindicar, publicar=False)
+        if recusa:
+            logger.info(f"Turno {numero_turno} da sessão {self.sessao.id} já resolvido ou em resolução")
+            return None
+
+        try:
+            resultado = self._processar_turno_completo(estado_turno)
+        except ConflitoEstadoTurno:
+            logger.warning(f"Turno {numero_turno} da sessão {self.sessao.id} alterado durante a resolução")
+            self.liberar_turno(numero_turno, job_id)
+            return None
+        return self._concluir_turno(resultado, job_id)
+    
+    def liberar_turno(self, numero_turno: int, job_id: Optional[str] = None) -> bool:
+        """
+        Devolve aos jogadores um turno cuja resolução falhou de vez
+        
+        O turno volta a aguardar ações (que precisam ser declaradas de novo) e
+        a reivindicação da tarefa é desfeita; os jogadores recebem 'turno_falhou'.
+        Não faz nada se o turno já avançou ou pertence a outra tarefa.
+        
+        Returns:
+            True se o turno foi liberado
+        """
+        acoes = []
+        
+        def liberar(estado: EstadoTurno) -> Optional[Dict[str, Any]]:
+            if (estado.numero_turno != numero_turno or estado.fase != FaseJogo.PROCESSANDO_TURNO
+                    or estado.job_id not in (None, job_id)):
+                return {"ignorado": True}
+            acoes[:] = self._formatar_acoes(estado)
+            estado.fase = FaseJogo.AGUARDANDO_ACOES
+            estado.job_id = None
+            estado.acoes_recebidas = []
+            estado.aguardando_personagens = estado.personagens_esperados.copy()
+            return None
         
-        # Verifica se todos já declararam
-        if len(estado_turno.aguardando_personagens) == 0:
-            return self._processar_turno_completo(estado_turno)
-        else:
-            aguardando_str = ", ".join(estado_turno.aguardando_personagens)
-            return {
-                "acao_confirmada": f"**{nome_personagem}**: {acao}",
-                "aguardando": aguardando_str,
-                "mensagem": f"Ação de **{nome_personagem}** registrada! Aguardando: **{aguardando_str}**"
-            }
+        _, recusa = self._atualizar_estado_turno(liberar)
+        if recusa:
+            return False
+        
+        logger.error(f"Turno {numero_turno} da sessão {self.sessao.id} liberado após falha na resolução")
+        notificar_sessao(self.sessao.id, 'turno_falhou', {
+            "numero_turno": numero_turno,
+            "job_id": job_id,
+            "acoes_descartadas": acoes,
+            "mensagem": "⚠️ **O Mestre não conseguiu resolver o turno.** Declarem suas ações novamente."
+        })
+        return True
+    
+    def _concluir_turno(self, resultado: Dict[str, Any], job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Guarda o resultado do turno e o publica para todos os jogadores da sessão"""
+        resultado['job_id'] = job_id
+        # No banco, para o status do processo web e o polling dos clientes
+        self.armazem_turno.atualizar(ultimo_turno=resultado)
+        notificar_sessao(self.sessao.id, 'turno_processado', resultado)
+        self._publicar_status()
+        return resultado
     
     def _processar_turno_completo(self, estado_turno: EstadoTurno) -> Dict[str, Any]:
         """Processa o turno quando todas as ações foram recebidas"""
@@ -215,15 +501,17 @@ class GameSessionManager:
         if not validacao['valida']:
             logger.warning(f"Violação do ciclo de jogo: {validacao['feedback']}")
         
-        estado_turno.fase = FaseJogo.PROCESSANDO_TURNO
-        cache.set(self.cache_key_turno, estado_turno.__dict__, self.cache_timeout)
+        for acao in estado_turno.acoes_recebidas:
+            self.interacoes.adicionar(**self._dados_interacao_jogador(acao, estado_turno.numero_turno))
         
         # Gera narrativa das consequências
         narrativa = self._gerar_narrativa_consequencias(estado_turno)
         
         # Gera nova situação para o próximo turno
         proximo_numero_turno = estado_turno.numero_turno + 1
-        nova_situacao = self.gerar_nova_situacao(proximo_numero_turno)
+        nova_situacao = self.gerar_nova_situacao(
+            proximo_numero_turno, [f"{acao.personagem_nome}: {acao.acao}" for acao in estado_turno.acoes_recebidas]
+        )
         
         # Prepara próximo turno com a nova situação
         novo_estado = EstadoTurno(
@@ -235,68 +523,98 @@ class GameSessionManager:
             aguardando_personagens=estado_turno.personagens_esperados.copy()
         )
         
-        cache.set(self.cache_key_turno, novo_estado.__dict__, self.cache_timeout)
+        # Só avança se ninguém mexeu no turno durante a geração. As interações
+        # do turno (ações, narrativa, nova situação) vão na mesma transação: se
+        # o compare-and-set ou o INSERT falhar, nada fica gravado e a nova
+        # tentativa refaz o turno sem duplicá-las
+        try:
+            with transaction.atomic():
+                self.armazem_turno.salvar(codificar_estado_turno(novo_estado), estado_turno.versao)
+                self.interacoes.descarregar()
+        except Exception:
+            self.interacoes.pendentes.clear()
+            raise
         
         return {
             "turno_processado": True,
             "numero_turno": estado_turno.numero_turno,
-            "acoes_processadas": [
-                f"**{acao['personagem_nome']}**: {acao['acao']}" 
-                for acao in estado_turno.acoes_recebidas
-            ],
+            "acoes_processadas": self._formatar_acoes(estado_turno),
             "narrativa_resultado": narrativa,
             "proximo_turno": novo_estado.numero_turno,
             "nova_situacao": nova_situacao,
             "mensagem": "✅ **Turno processado!** Todas as ações foram resolvidas."
         }
     
-    def _gerar_situacao_inicial(self) -> str:
+    def _gerar_situacao_inicial(self, personagens: Optional[List[Personagem]] = None) -> str:
         """Gera a primeira descrição de situação da sessão - VERSÃO OTIMIZADA"""
-        personagens = self._obter_personagens_ativos()
-        personagens_nomes = [p.nome for p in personagens]
-        personagens_str = ", ".join(personagens_nomes)
+        if personagens is None:
+            personagens = self._obter_personagens_ativos()
         
         # OTIMIZAÇÃO: Usa fallback inteligente imediatamente para melhor UX
         # Em produção, pode-se configurar para tentar IA com timeout curto
         
         logger.info("Gerando situação inicial otimizada (fallback inteligente)")
         
-        # Coleta contexto básico da campanha
-        nome_campanha = self.sessao.campanha.nome
-        descricao_campanha = self.sessao.campanha.descricao or ""
-        nome_sessao = self.sessao.nome
-        descricao_sessao = self.sessao.descricao or ""
-        
         # Verifica sessões anteriores para contexto
-        sessoes_anteriores = SessaoIA.objects.filter(
-            campanha=self.sessao.campanha
-        ).exclude(id=self.sessao.id).order_by('-data_criacao')[:2]
-        
-        tem_historico = sessoes_anteriores.exists()
+        tem_historico = self._sessoes_anteriores().exists()
         
-        # Gera situação contextualizada sem IA externa
-        situacao = self._gerar_situacao_inteligente(
-            personagens_str, nome_campanha, descricao_campanha,
-            nome_sessao, descricao_sessao, tem_historico
-        )
+        situacao = self._montar_situacao_inicial(personagens, tem_historico)
         
         # Registra como interação rápida
         InteracaoIA.objects.create(
-            sessao=self.sessao,
-            usuario=self.sessao.campanha.organizador,
-            tipo_interacao='SITUACAO_INICIAL',
-            prompt_usuario='Geração de situação inicial otimizada',
-            resposta_ia=situacao[:2000],
-            tokens_usados=0,
-            contexto={
+            **self._dados_interacao_situacao_inicial(situacao, personagens, tem_historico)
+        )
+        
+        return situacao
+    
+    async def _agerar_situacao_inicial(self, personagens: List[Personagem]) -> str:
+        logger.info("Gerando situação inicial otimizada (fallback inteligente)")
+        
+        await self._acarregar_campanha()
+        tem_historico = await self._sessoes_anteriores().aexists()
+        
+        situacao = self._montar_situacao_inicial(personagens, tem_historico)
+        
+        await InteracaoIA.objects.acreate(
+            **self._dados_interacao_situacao_inicial(situacao, personagens, tem_historico)
+        )
+        
+        return situacao
+    
+    def _sessoes_anteriores(self):
+        return SessaoIA.objects.filter(
+            campanha_id=self.sessao.campanha_id
+        ).exclude(id=self.sessao.id).order_by('-data_criacao')[:2]
+    
+    def _montar_situacao_inicial(self, personagens: List[Personagem], tem_historico: bool) -> str:
+        """Situação contextualizada sem IA externa (requer a campanha já carregada)"""
+        personagens_str = ", ".join(p.nome for p in personagens)
+        
+        return self._gerar_situacao_inteligente(
+            personagens_str,
+            self.sessao.campanha.nome,
+            self.sessao.campanha.descricao or "",
+            self.sessao.nome,
+            self.sessao.descricao or "",
+            tem_historico
+        )
+    
+    def _dados_interacao_situacao_inicial(self, situacao: str, personagens: List[Personagem],
+                                          tem_historico: bool) -> Dict[str, Any]:
+        return {
+            'sessao': self.sessao,
+            'usuario_id': self.sessao.campanha.organizador_id,
+            'tipo_interacao': 'SITUACAO_INICIAL',
+            'prompt_usuario': 'Geração de situação inicial otimizada',
+            'resposta_ia': situacao[:2000],
+            'tokens_usados': 0,
+            'contexto': {
                 'modo': 'jogo_ativo', 
                 'tipo': 'situacao_inicial_otimizada',
                 'personagens_count': len(personagens),
                 'tem_historico': tem_historico
             }
-        )
-        
-        return situacao
+        }
     
     def _gerar_situacao_inteligente(self, personagens_str: str, nome_campanha: str, 
                                     descricao_campanha: str, nome_sessao: str, 
@@ -364,10 +682,8 @@ O que vocês fazem?"""
         """Gera a narrativa das consequências das ações usando IA"""
         # Prepara as ações dos jogadores para o contexto
         acoes_detalhadas = []
-        for acao_dict in estado_turno.acoes_recebidas:
-            nome = acao_dict['personagem_nome']
-            acao = acao_dict['acao']
-            acoes_detalhadas.append(f"**{nome}**: {acao}")
+        for acao in estado_turno.acoes_recebidas:
+            acoes_detalhadas.append(f"**{acao.personagem_nome}**: {acao.acao}")
         
         acoes_texto = "\n".join(acoes_detalhadas)
         
@@ -381,9 +697,9 @@ O que vocês fazem?"""
         narrativa = self._gerar_narrativa_inteligente(estado_turno, acoes_detalhadas, situacao_anterior)
         
         # Registra a geração como interação rápida
-        InteracaoIA.objects.create(
+        self.interacoes.adicionar(
             sessao=self.sessao,
-            usuario=self.sessao.campanha.organizador,
+            usuario_id=self.sessao.campanha.organizador_id,
             tipo_interacao='NARRATIVA_CONSEQUENCIAS',
             prompt_usuario=f'Consequências do Turno {estado_turno.numero_turno} (Otimizada)',
             resposta_ia=narrativa[:2000],
@@ -459,54 +775,90 @@ A narrativa se desenvolve naturalmente a partir das decisões tomadas pelos her
         
         return narrativa_fallback
     
-    def gerar_nova_situacao(self, turno_numero: int) -> Dict[str, Any]:
-        """Gera nova situação após processar um turno"""
+    def gerar_nova_situacao(self, turno_numero: int, acoes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Gera nova situação após processar um turno
+        
+        A geração segue a conversa da sessão com a IA: as ações do turno e a
+        situação gerada são acrescentadas ao histórico, e resumo, memórias e
+        instruções vão só na mensagem deste turno.
+        """
         personagens = self._obter_personagens_ativos()
         personagens_nomes = [p.nome for p in personagens]
         personagens_str = ", ".join(personagens_nomes)
         
-        # Obtém últimas interações para contexto
-        interacoes_recentes = InteracaoIA.objects.filter(
-            sessao=self.sessao
-        ).order_by('-data_interacao')[:5]
+        # Resumo da sessão + interações recentes (compilado e em cache por sessão)
+        contexto = get_memory_manager().compilar_contexto_narrativo(self.sessao)
         
-        contexto_recente = ""
-        if interacoes_recentes.exists():
-            contexto_recente = "\n".join([
-                f"- {i.tipo_interacao}: {i.resposta_ia[:100]}..." 
-                for i in interacoes_recentes
-            ])
+        # Mais recente primeiro: o que é mais antigo é cortado antes
+        contexto_recente = [
+            f"            - {i['tipo']}: {i['resposta'][:100]}..."
+            for i in contexto['interacoes_recentes']
+        ]
+        resumo_sessao = [f"            - {texto}" for texto in reversed(contexto['resumo_sessao'])]
+        # Já vêm do mais para o menos relevante
+        memorias_relevantes = [
+            f"            - {m['titulo']}: {m['descricao'][:200]}" for m in contexto['memorias_relevantes']
+        ] + [
+            f"            - {npc['nome']} ({npc['ocupacao'] or 'NPC'}): {npc['motivacao'][:120]}"
+            for npc in contexto['npcs_relevantes']
+        ]
         
         # Tenta gerar situação contextual usando IA
         try:
-            from .ai_client import get_ia_client
-            from .prompts import ArquitetoDeMundosPrompts
-            import asyncio
+            from .ai_client import get_ia_client, executar_sync
+            from .prompts import ArquitetoDeMundosPrompts, MontadorPrompt
+            from .tokenizer import contar_tokens
             
-            prompt = f"""
-            {ArquitetoDeMundosPrompts.get_sistema_base(
+            # Prefixo estável entre turnos (base + regras do modo de jogo + campanha),
+            # enviado como sistema para o cache de prompt do provedor
+            sistema = ArquitetoDeMundosPrompts.compilar_sistema(
                 self.sessao.estilo_narrativo,
                 self.sessao.criatividade_nivel,
-                self.sessao.dificuldade_nivel
-            )}
-            
-            TAREFA: Criar uma nova situação após processar as ações dos jogadores
-            
+                self.sessao.dificuldade_nivel,
+                ModoOperacao.JOGO
+            ).texto + f"""
             CONTEXTO DA CAMPANHA:
             - Nome: {self.sessao.campanha.nome}
-            - Descrição: {self.sessao.campanha.descricao}
             - Sessão: {self.sessao.nome}
+            - Descrição: {self.sessao.campanha.descricao}
+            """
+            
+            ia_client = get_ia_client()
+            conversa = Conversa.carregar(self.sessao.id)
+            # O histórico da conversa tem prioridade sobre as seções cortáveis
+            tokens_historico = min(conversa.tokens, getattr(settings, 'IA_GM_CONVERSA_MAX_TOKENS', 4000))
+            montador = MontadorPrompt(
+                max(ia_client.orcamento_prompt() - contar_tokens(sistema) - tokens_historico, 0)
+            )
             
-            PERSONAGENS ATIVOS:
+            montador.adicionar("""            TAREFA: Criar uma nova situação após processar as ações dos jogadores""")
+            montador.adicionar(f"""            PERSONAGENS ATIVOS:
             {personagens_str}
             
             TURNO ATUAL:
-            {turno_numero}
-            
-            CONTEXTO RECENTE DA SESSÃO:
-            {contexto_recente if contexto_recente else "Início da sessão."}
-            
-            CRIE UMA NOVA SITUAÇÃO QUE:
+            {turno_numero}""")
+            if memorias_relevantes:
+                montador.adicionar_lista(
+                    "            MEMÓRIAS E NPCS LIGADOS À SITUAÇÃO:",
+                    memorias_relevantes,
+                    prioridade=0
+                )
+            if resumo_sessao:
+                montador.adicionar_lista(
+                    "            RESUMO DA SESSÃO ATÉ AQUI (mais recente primeiro):",
+                    resumo_sessao,
+                    prioridade=0
+                )
+            if not conversa:
+                # Sem histórico (primeiro turno ou conversa expirada): as interações recentes o substituem
+                montador.adicionar_lista(
+                    "            CONTEXTO RECENTE DA SESSÃO:",
+                    contexto_recente,
+                    prioridade=1,
+                    vazio="            Início da sessão."
+                )
+            montador.adicionar("""            CRIE UMA NOVA SITUAÇÃO QUE:
             
             1. EVOLUA NATURALMENTE:
                - Reflita as consequências das ações anteriores
@@ -535,37 +887,38 @@ A narrativa se desenvolve naturalmente a partir das decisões tomadas pelos her
             - Termine perguntando o que os personagens fazem
             
             Use o estilo narrativo definido e seja criativo mas coerente.
-            """
+            """)
+            acoes_turno = "\n".join(f"- {acao}" for acao in acoes) if acoes else "- Nenhuma ação declarada"
+            mensagem_turno = (
+                f"TURNO {turno_numero - 1} - AÇÕES DOS PERSONAGENS:\n{acoes_turno}\n\n"
+                f"Descreva a situação do turno {turno_numero}."
+            )
             
-            # Executa geração de forma síncrona
-            ia_client = get_ia_client()
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                resultado = loop.run_until_complete(
-                    ia_client.gerar_conteudo(prompt, usar_cache=False)
-                )
-                nova_situacao = resultado['conteudo']
-                
-                # Registra a geração como interação
-                InteracaoIA.objects.create(
-                    sessao=self.sessao,
-                    usuario=self.sessao.campanha.organizador,
-                    tipo_interacao='NOVA_SITUACAO',
-                    prompt_usuario=f'Nova situação para Turno {turno_numero}',
-                    resposta_ia=nova_situacao[:2000],
-                    tokens_usados=resultado.get('tokens_usados', 0),
-                    contexto={'turno': turno_numero}
+            # Executa no event loop persistente do processo (reaproveita o pool HTTP)
+            resultado = executar_sync(
+                ia_client.conversar(
+                    self.sessao.id, mensagem_turno, contexto=montador.montar(), sistema=sistema,
+                    turno=turno_numero, campanha_id=self.sessao.campanha_id
                 )
-                
-                return {
-                    'situacao': nova_situacao,
-                    'chamada_jogadores': f"**{personagens_str}**, o que vocês fazem agora?",
-                    'gerada_por_ia': True
-                }
-                
-            finally:
-                loop.close()
+            )
+            nova_situacao = resultado['conteudo']
+            
+            # Registra a geração como interação (gravada com o fim do turno)
+            self.interacoes.adicionar(
+                sessao=self.sessao,
+                usuario_id=self.sessao.campanha.organizador_id,
+                tipo_interacao='NOVA_SITUACAO',
+                prompt_usuario=f'Nova situação para Turno {turno_numero}',
+                resposta_ia=nova_situacao[:2000],
+                tokens_usados=resultado.get('tokens_usados', 0),
+                contexto={'turno': turno_numero}
+            )
+            
+            return {
+                'situacao': nova_situacao,
+                'chamada_jogadores': f"**{personagens_str}**, o que vocês fazem agora?",
+                'gerada_por_ia': True
+            }
                 
         except Exception as e:
             logger.warning(f"Falha ao gerar nova situação com IA: {e}")
@@ -594,18 +947,41 @@ O que vocês fazem?"""
             'gerada_por_ia': False
         }
     
+    async def _acarregar_campanha(self):
+        """Carrega a campanha da sessão sem acesso síncrono ao banco"""
+        if not SessaoIA._meta.get_field('campanha').is_cached(self.sessao):
+            from campanhas.models import Campanha
+            self.sessao.campanha = await Campanha.objects.aget(id=self.sessao.campanha_id)
+        return self.sessao.campanha
+    
+    def _personagens_ativos(self):
+        return Personagem.objects.filter(
+            campanha_id=self.sessao.campanha_id,
+            ativo=True
+        ).select_related('usuario')
+    
     def _obter_personagens_ativos(self) -> List[Personagem]:
         """Obtém lista de personagens ativos na campanha"""
-        return list(Personagem.objects.filter(
-            campanha=self.sessao.campanha,
-            ativo=True
-        ).select_related('usuario'))
+        return list(self._personagens_ativos())
+    
+    async def _aobter_personagens_ativos(self) -> List[Personagem]:
+        return [personagem async for personagem in self._personagens_ativos()]
     
     def _obter_personagem_do_usuario(self, usuario_id: int) -> Optional[Personagem]:
         """Obtém o personagem de um usuário específico nesta campanha"""
         try:
             return Personagem.objects.get(
-                campanha=self.sessao.campanha,
+                campanha_id=self.sessao.campanha_id,
+                usuario_id=usuario_id,
+                ativo=True
+            )
+        except Personagem.DoesNotExist:
+            return None
+    
+    async def _aobter_personagem_do_usuario(self, usuario_id: int) -> Optional[Personagem]:
+        try:
+            return await Personagem.objects.aget(
+                campanha_id=self.sessao.campanha_id,
                 usuario_id=usuario_id,
                 ativo=True
             )
@@ -613,37 +989,128 @@ O que vocês fazem?"""
             return None
     
     def _obter_estado_turno(self) -> Optional[EstadoTurno]:
-        """Obtém o estado atual do turno do cache"""
-        dados_turno = cache.get(self.cache_key_turno)
-        if not dados_turno:
+        """Obtém o estado atual do turno (snapshot no banco)"""
+        return self._estado_turno_de_dados(self.armazem_turno.carregar())
+    
+    async def _aobter_estado_turno(self) -> Optional[EstadoTurno]:
+        return self._estado_turno_de_dados(await self.armazem_turno.acarregar())
+    
+    @staticmethod
+    def _estado_turno_de_dados(snapshot: Optional[tuple]) -> Optional[EstadoTurno]:
+        if not snapshot:
             return None
+        return decodificar_estado_turno(*snapshot)
+    
+    def _atualizar_estado_turno(self, alteracao: Callable[[EstadoTurno], Optional[Dict[str, Any]]],
+                                publicar: bool = True):
+        """
+        Aplica `alteracao` ao estado do turno com compare-and-set
+        
+        A alteração muta o estado recebido e retorna None para gravar, ou uma
+        resposta para desistir sem gravar. Em caso de conflito o estado é relido
+        do banco e a alteração reaplicada. Com `publicar`, o novo status é
+        enviado aos WebSockets da sessão.
+        
+        Returns:
+            (estado_turno, recusa) - recusa é None quando a alteração foi gravada
+        """
+        for tentativa in range(self.TENTATIVAS_CAS):
+            estado_turno = self._obter_estado_turno()
+            if not estado_turno:
+                return None, {"erro": "Erro ao obter estado do turno"}
+            
+            recusa = alteracao(estado_turno)
+            if recusa:
+                return estado_turno, recusa
+            
+            try:
+                estado_turno.versao = self.armazem_turno.salvar(
+                    codificar_estado_turno(estado_turno), estado_turno.versao
+                )
+                if publicar:
+                    self._publicar_status(estado_turno)
+                return estado_turno, None
+            except ConflitoEstadoTurno:
+                logger.info(f"Conflito no turno da sessão {self.sessao.id}; tentativa {tentativa + 1}")
         
-        # Reconstrói objetos AcaoJogador
-        acoes_reconstruidas = []
-        for acao_dict in dados_turno.get('acoes_recebidas', []):
-            acao = AcaoJogador(**acao_dict)
-            acoes_reconstruidas.append(acao)
-        
-        dados_turno['acoes_recebidas'] = acoes_reconstruidas
-        
-        return EstadoTurno(**dados_turno)
+        raise ConflitoEstadoTurno(f"Turno da sessão {self.sessao.id} sob contenção excessiva")
     
-    def _registrar_interacao_jogador(self, personagem: Personagem, acao: str):
-        """Registra a interação do jogador no banco de dados"""
-        InteracaoIA.objects.create(
-            sessao=self.sessao,
-            usuario=personagem.usuario,
-            tipo_interacao='ACAO_JOGADOR',
-            prompt_usuario=f"{personagem.nome}: {acao}",
-            resposta_ia="Ação registrada - aguardando outros jogadores",
-            contexto={'personagem': personagem.nome, 'turno': 'aguardando'},
-            tokens_usados=0
+    def _publicar_status(self, estado_turno: Optional[EstadoTurno] = None):
+        """Envia o status resumido aos WebSockets da sessão (sem o resultado do último turno)"""
+        if estado_turno is None:
+            estado_turno = self._obter_estado_turno()
+        notificar_sessao(self.sessao.id, 'status_sessao', self._resumo_status(self.estado_sessao, estado_turno))
+    
+    async def _apublicar_status(self, estado_turno: Optional[EstadoTurno] = None):
+        if estado_turno is None:
+            estado_turno = await self._aobter_estado_turno()
+        await anotificar_sessao(
+            self.sessao.id, 'status_sessao', self._resumo_status(await self.aobter_estado_sessao(), estado_turno)
         )
     
+    async def _aatualizar_estado_turno(self, alteracao: Callable[[EstadoTurno], Optional[Dict[str, Any]]],
+                                       publicar: bool = True):
+        for tentativa in range(self.TENTATIVAS_CAS):
+            estado_turno = await self._aobter_estado_turno()
+            if not estado_turno:
+                return None, {"erro": "Erro ao obter estado do turno"}
+            
+            recusa = alteracao(estado_turno)
+            if recusa:
+                return estado_turno, recusa
+            
+            try:
+                estado_turno.versao = await self.armazem_turno.asalvar(
+                    codificar_estado_turno(estado_turno), estado_turno.versao
+                )
+                if publicar:
+                    await self._apublicar_status(estado_turno)
+                return estado_turno, None
+            except ConflitoEstadoTurno:
+                logger.info(f"Conflito no turno da sessão {self.sessao.id}; tentativa {tentativa + 1}")
+        
+        raise ConflitoEstadoTurno(f"Turno da sessão {self.sessao.id} sob contenção excessiva")
+    
+    @staticmethod
+    def _formatar_acoes(estado_turno: EstadoTurno) -> List[str]:
+        return [f"**{acao.personagem_nome}**: {acao.acao}" for acao in estado_turno.acoes_recebidas]
+    
+    def _dados_interacao_jogador(self, acao: AcaoJogador, numero_turno: int) -> Dict[str, Any]:
+        """Campos da InteracaoIA de uma ação declarada no turno"""
+        return {
+            'sessao': self.sessao,
+            'usuario_id': acao.usuario_id,
+            'tipo_interacao': 'ACAO_JOGADOR',
+            'prompt_usuario': f"{acao.personagem_nome}: {acao.acao}",
+            'resposta_ia': f"Ação registrada no turno {numero_turno}",
+            'contexto': {
+                'personagem': acao.personagem_nome,
+                'turno': numero_turno,
+                'declarada_em': acao.timestamp.isoformat()
+            },
+            'tokens_usados': 0
+        }
+    
+    def _dados_acoes_pendentes(self, estado_turno: Optional[EstadoTurno]) -> List[Dict[str, Any]]:
+        """Interações das ações de um turno que não chegou a ser resolvido"""
+        if not estado_turno:
+            return []
+        return [self._dados_interacao_jogador(acao, estado_turno.numero_turno) for acao in estado_turno.acoes_recebidas]
+    
     def pausar_sessao(self) -> Dict[str, Any]:
         """Pausa a sessão atual"""
-        cache.set(self.cache_key_estado, EstadoSessao.PAUSADA.value, self.cache_timeout)
-        
+        self.armazem_turno.atualizar(estado_sessao=EstadoSessao.PAUSADA.value)
+        self._publicar_status()
+        return self._resposta_pausa()
+    
+    async def apausar_sessao(self) -> Dict[str, Any]:
+        """Versão assíncrona de pausar_sessao"""
+        await self.armazem_turno.aatualizar(estado_sessao=EstadoSessao.PAUSADA.value)
+        await self._apublicar_status()
+        return self._resposta_pausa()
+    
+    @staticmethod
+    def _resposta_pausa() -> Dict[str, Any]:
         return {
             "sessao_pausada": True,
             "mensagem": "⏸️ **Sessão pausada**. Use 'retomar' para continuar."
@@ -651,38 +1118,94 @@ O que vocês fazem?"""
     
     def retomar_sessao(self) -> Dict[str, Any]:
         """Retoma uma sessão pausada"""
-        cache.set(self.cache_key_estado, EstadoSessao.ATIVA.value, self.cache_timeout)
+        self.armazem_turno.atualizar(estado_sessao=EstadoSessao.ATIVA.value)
         
         estado_turno = self._obter_estado_turno()
         if estado_turno:
-            return {
-                "sessao_retomada": True,
-                "turno_atual": estado_turno.numero_turno,
-                "fase_atual": estado_turno.fase.value,
-                "mensagem": "▶️ **Sessão retomada**! Continuando a aventura..."
-            }
+            self._publicar_status(estado_turno)
+            return self._resposta_retomada(estado_turno)
         else:
             return self.ativar_modo_jogo()
     
+    async def aretomar_sessao(self) -> Dict[str, Any]:
+        """Versão assíncrona de retomar_sessao"""
+        await self.armazem_turno.aatualizar(estado_sessao=EstadoSessao.ATIVA.value)
+        
+        estado_turno = await self._aobter_estado_turno()
+        if estado_turno:
+            await self._apublicar_status(estado_turno)
+            return self._resposta_retomada(estado_turno)
+        else:
+            return await self.aativar_modo_jogo()
+    
+    @staticmethod
+    def _resposta_retomada(estado_turno: EstadoTurno) -> Dict[str, Any]:
+        return {
+            "sessao_retomada": True,
+            "turno_atual": estado_turno.numero_turno,
+            "fase_atual": estado_turno.fase.value,
+            "mensagem": "▶️ **Sessão retomada**! Continuando a aventura..."
+        }
+    
     def encerrar_sessao(self, resumo: str = "") -> Dict[str, Any]:
         """Encerra a sessão de jogo"""
         self.sessao.ativa = False
         self.sessao.save()
         
-        cache.delete(self.cache_key_estado)
-        cache.delete(self.cache_key_turno)
+        for dados in self._dados_acoes_pendentes(self._obter_estado_turno()):
+            self.interacoes.adicionar(**dados)
+        self.interacoes.descarregar()
+        
+        Conversa.remover(self.sessao.id)
+        self.armazem_turno.remover()
+        notificar_sessao(self.sessao.id, 'status_sessao', self._resumo_status(EstadoSessao.ENCERRADA, None))
+        
+        return self._resposta_encerramento(resumo)
+    
+    async def aencerrar_sessao(self, resumo: str = "") -> Dict[str, Any]:
+        """Versão assíncrona de encerrar_sessao"""
+        self.sessao.ativa = False
+        await self.sessao.asave()
+        
+        for dados in self._dados_acoes_pendentes(await self._aobter_estado_turno()):
+            await self.interacoes.aadicionar(**dados)
+        await self.interacoes.adescarregar()
+        
+        await Conversa.aremover(self.sessao.id)
+        await self.armazem_turno.aremover()
+        await anotificar_sessao(self.sessao.id, 'status_sessao', self._resumo_status(EstadoSessao.ENCERRADA, None))
         
+        return self._resposta_encerramento(resumo)
+    
+    @staticmethod
+    def _resposta_encerramento(resumo: str) -> Dict[str, Any]:
         return {
             "sessao_encerrada": True,
             "resumo": resumo,
             "mensagem": "🏁 **Sessão encerrada**. Obrigado por jogarem!"
         }
     
+    # Estado do turno, da sessão e último resultado numa só leitura do snapshot
+    CAMPOS_STATUS = ('estado', 'versao', 'estado_sessao', 'ultimo_turno')
+    
     def obter_status_sessao(self) -> Dict[str, Any]:
         """Obtém status completo da sessão"""
-        estado = self.estado_sessao
-        estado_turno = self._obter_estado_turno()
-        
+        return self._montar_status(self.armazem_turno.ler(*self.CAMPOS_STATUS))
+    
+    async def aobter_status_sessao(self) -> Dict[str, Any]:
+        """Versão assíncrona de obter_status_sessao"""
+        return self._montar_status(await self.armazem_turno.aler(*self.CAMPOS_STATUS))
+    
+    def _montar_status(self, snapshot: Optional[tuple]) -> Dict[str, Any]:
+        estado = self._estado_sessao_de(snapshot[2:3] if snapshot else None)
+        if not snapshot:
+            return self._resumo_status(estado, None)
+        status = self._resumo_status(estado, decodificar_estado_turno(bytes(snapshot[0]), snapshot[1]))
+        status["ultimo_turno"] = snapshot[3]
+        return status
+    
+    @staticmethod
+    def _resumo_status(estado: EstadoSessao, estado_turno: Optional[EstadoTurno]) -> Dict[str, Any]:
         if estado_turno:
             return {
                 "estado_sessao": estado.value,
@@ -0,0 +1,61 @@
+"""
+Registro em lote das interações com a IA
+Acumula objetos InteracaoIA e os grava com bulk_create
+"""
+
+import logging
+from typing import List, Optional
+from django.conf import settings
+
+from .models import InteracaoIA
+
+
+logger = logging.getLogger(__name__)
+
+
+class BufferInteracoes:
+    """
+    Interações pendentes de gravação
+
+    Quem usa decide o momento de descarregar (ex.: fim do turno); o buffer
+    também descarrega sozinho ao atingir IA_GM_INTERACOES_LOTE itens.
+    """
+
+    def __init__(self, limite: Optional[int] = None):
+        self.limite = max(limite or getattr(settings, 'IA_GM_INTERACOES_LOTE', 50), 1)
+        self.pendentes: List[InteracaoIA] = []
+
+    def __len__(self):
+        return len(self.pendentes)
+
+    def adicionar(self, **dados) -> InteracaoIA:
+        """Enfileira uma interação (campos de InteracaoIA)"""
+        interacao = InteracaoIA(**dados)
+        self.pendentes.append(interacao)
+        if len(self.pendentes) >= self.limite:
+            self.descarregar()
+        return interacao
+
+    def descarregar(self) -> int:
+        """Grava as interações pendentes num único INSERT; retorna quantas"""
+        if not self.pendentes:
+            return 0
+        lote, self.pendentes = self.pendentes, []
+        InteracaoIA.objects.bulk_create(lote, batch_size=self.limite)
+        return len(lote)
+
+    async def aadicionar(self, **dados) -> InteracaoIA:
+        """Versão assíncrona de adicionar"""
+        interacao = InteracaoIA(**dados)
+        self.pendentes.append(interacao)
+        if len(self.pendentes) >= self.limite:
+            await self.adescarregar()
+        return interacao
+
+    async def adescarregar(self) -> int:
+        """Versão assíncrona de descarregar"""
+        if not self.pendentes:
+            return 0
+        lote, self.pendentes = self.pendentes, []
+        await InteracaoIA.objects.abulk_create(lote, batch_size=self.limite)
+        return len(lote)
@@ -4,9 +4,10 @@ Implementa os modos de operação, ciclo de jogo e regras de comportamento
 """
 
 from enum import Enum
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
-from .models import SessaoIA
+from .models import EstadoTurnoSessao, SessaoIA
 
 
 class ModoOperacao(Enum):
@@ -98,6 +99,18 @@ class MasterRulesEngine:
     @classmethod
     def gerar_prompt_comportamental(cls, modo: ModoOperacao, contexto_adicional: str = "") -> str:
         """Gera prompt com regras comportamentais para o modo especificado"""
+        antes, depois = cls.esqueleto_comportamental(modo)
+        return f"{antes}{contexto_adicional}{depois}"
+    
+    @classmethod
+    @lru_cache(maxsize=None)
+    def esqueleto_comportamental(cls, modo: ModoOperacao) -> Tuple[str, str]:
+        """
+        Partes fixas do prompt comportamental do modo, antes e depois do contexto adicional
+        
+        Só dependem do modo e de REGRAS_FUNDAMENTAIS, então são montadas uma vez
+        por processo (limpe com esqueleto_comportamental.cache_clear() se as regras mudarem).
+        """
         regras_aplicaveis = cls.obter_regras_para_modo(modo)
         
         if modo == ModoOperacao.CONFIGURACAO:
@@ -150,17 +163,18 @@ TRATAMENTO DE PERSONAGENS:
             for regra in regras_aplicaveis if regra.obrigatoria
         ])
         
-        prompt_completo = f"""
+        antes = f"""
 {prompt_modo}
 
 REGRAS ESPECÍFICAS DESTE MODO:
 {detalhes_regras}
 
-{contexto_adicional}
+"""
+        depois = """
 
 LEMBRE-SE: Estas regras são OBRIGATÓRIAS e devem ser seguidas rigorosamente.
 """
-        return prompt_completo
+        return antes, depois
     
     @classmethod  
     def validar_entrada_comando(cls, entrada: str, modo: ModoOperacao) -> Dict[str, Any]:
@@ -277,11 +291,12 @@ def obter_modo_operacao_sessao(sessao: SessaoIA) -> ModoOperacao:
     if not sessao.ativa:
         return ModoOperacao.CONFIGURACAO
     
-    # Verifica se há estado de jogo ativo no cache
-    from django.core.cache import cache
-    estado_cache = cache.get(f"game_session_{sessao.id}_estado")
+    # O estado de jogo fica junto do snapshot do turno (ver GameSessionManager)
+    estado_sessao = EstadoTurnoSessao.objects.filter(sessao_id=sessao.id).values_list(
+        'estado_sessao', flat=True
+    ).first()
     
-    if estado_cache == "ativa":
+    if estado_sessao == "ativa":
         return ModoOperacao.JOGO
     else:
         return ModoOperacao.CONFIGURACAO
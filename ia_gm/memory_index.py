@@ -0,0 +1,284 @@
+"""
+Índice de relevância das memórias de campanha
+BM25 em memória sobre MemoriaLongoPrazo e NPCGerado, com embedding local opcional
+"""
+
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import MemoriaLongoPrazo, NPCGerado
+from .resilience import obter_cache_ia
+
+
+logger = logging.getLogger(__name__)
+
+# Parâmetros usuais do BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_PADRAO_TERMOS = re.compile(r"\w+")
+
+PALAVRAS_VAZIAS = frozenset("""
+    a ao aos as com como da das de do dos e ela ele elas eles em entre era essa esse esta este
+    foi ha isso isto ja la mais mas me mesmo na nas nao no nos o os ou para pela pelas pelo pelos
+    por quando que se sem ser seu seus sua suas tambem te tem um uma umas uns voce voces
+""".split())
+
+# Campos indexados; o título entra duas vezes para pesar mais
+CAMPOS_MEMORIA = ('titulo', 'titulo', 'descricao')
+CAMPOS_NPC = (
+    'nome', 'nome', 'titulo', 'raca', 'classe', 'ocupacao',
+    'motivacao_principal', 'localizacao_atual', 'aliados', 'inimigos'
+)
+
+Chave = Tuple[str, int]  # ('memoria' | 'npc', id)
+
+
+def extrair_termos(texto: str) -> List[str]:
+    """Termos normalizados (minúsculas, sem acento, sem palavras vazias)"""
+    sem_acento = unicodedata.normalize('NFKD', texto.lower()).encode('ascii', 'ignore').decode()
+    return [
+        termo for termo in _PADRAO_TERMOS.findall(sem_acento)
+        if len(termo) > 1 and termo not in PALAVRAS_VAZIAS
+    ]
+
+
+@lru_cache(maxsize=4)
+def _carregar_embedding(caminho: str) -> Optional[Callable[[List[str]], List[List[float]]]]:
+    try:
+        return import_string(caminho)
+    except ImportError as e:
+        logger.warning(f"Embedding de memória '{caminho}' indisponível: {e}")
+        return None
+
+
+def obter_embedding() -> Optional[Callable[[List[str]], List[List[float]]]]:
+    """
+    Função de embedding configurada em IA_GM_EMBEDDING_MEMORIA (caminho pontuado)
+
+    Recebe uma lista de textos e devolve um vetor por texto; None desativa.
+    """
+    caminho = getattr(settings, 'IA_GM_EMBEDDING_MEMORIA', '')
+    return _carregar_embedding(caminho) if caminho else None
+
+
+def _cosseno(a: List[float], b: List[float]) -> float:
+    produto = sum(x * y for x, y in zip(a, b))
+    normas = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return produto / normas if normas else 0.0
+
+
+class IndiceMemoria:
+    """
+    Índice invertido BM25 das memórias e NPCs de uma campanha
+
+    Documentos novos são incorporados por marca d'água de id a cada busca
+    (sincronizar), sem reconstruir o índice; a busca percorre só as listas
+    dos termos da consulta. Edições e remoções mudam a versão da campanha
+    no cache compartilhado e o índice é refeito (ver obter_indice).
+    """
+
+    def __init__(self, campanha_id: int, versao: Optional[int] = None):
+        self.campanha_id = campanha_id
+        self.versao = versao
+        self.postings: Dict[str, Dict[Chave, int]] = {}
+        self.tamanhos: Dict[Chave, int] = {}
+        self.termos_documento: Dict[Chave, List[str]] = {}
+        self.vetores: Dict[Chave, List[float]] = {}
+        self.total_termos = 0
+        self.ultimo_id = {'memoria': 0, 'npc': 0}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tamanhos)
+
+    def adicionar(self, chave: Chave, texto: str, vetor: Optional[List[float]] = None):
+        """Indexa (ou reindexa) um documento"""
+        with self.lock:
+            self._remover(chave)
+            termos = Counter(extrair_termos(texto))
+            for termo, frequencia in termos.items():
+                self.postings.setdefault(termo, {})[chave] = frequencia
+            tamanho = sum(termos.values())
+            self.tamanhos[chave] = tamanho
+            self.termos_documento[chave] = list(termos)
+            self.total_termos += tamanho
+            if vetor is not None:
+                self.vetores[chave] = vetor
+            self.ultimo_id[chave[0]] = max(self.ultimo_id[chave[0]], chave[1])
+
+    def remover(self, chave: Chave):
+        with self.lock:
+            self._remover(chave)
+
+    def _remover(self, chave: Chave):
+        tamanho = self.tamanhos.pop(chave, None)
+        if tamanho is None:
+            return
+        self.total_termos -= tamanho
+        self.vetores.pop(chave, None)
+        for termo in self.termos_documento.pop(chave):
+            del self.postings[termo][chave]
+            if not self.postings[termo]:
+                del self.postings[termo]
+
+    def sincronizar(self):
+        """Incorpora memórias e NPCs criados desde a última sincronização"""
+        novos = [
+            (('memoria', dados[0]), ' '.join(filter(None, dados[1:])))
+            for dados in MemoriaLongoPrazo.objects.filter(
+                campanha_id=self.campanha_id, id__gt=self.ultimo_id['memoria']
+            ).values_list('id', *CAMPOS_MEMORIA)
+        ] + [
+            (('npc', dados[0]), ' '.join(filter(None, dados[1:])))
+            for dados in NPCGerado.objects.filter(
+                campanha_id=self.campanha_id, id__gt=self.ultimo_id['npc']
+            ).values_list('id', *CAMPOS_NPC)
+        ]
+        if not novos:
+            return
+
+        vetores = [None] * len(novos)
+        embedding = obter_embedding()
+        if embedding:
+            try:
+                vetores = embedding([texto for _, texto in novos])
+            except Exception as e:
+                logger.warning(f"Falha ao calcular embeddings da campanha {self.campanha_id}: {e}")
+
+        for (chave, texto), vetor in zip(novos, vetores):
+            self.adicionar(chave, texto, vetor)
+
+    def buscar(self, consulta: str, k: int = 5, tipo: Optional[str] = None) -> List[Tuple[Chave, float]]:
+        """
+        Os k documentos mais relevantes para a consulta
+
+        Args:
+            consulta: Texto da situação atual
+            k: Quantidade de resultados
+            tipo: 'memoria' ou 'npc' para filtrar
+
+        Returns:
+            Lista de (chave, pontuação), da mais para a menos relevante
+        """
+        termos = set(extrair_termos(consulta))
+        vetor_consulta = self._vetor_consulta(consulta)
+        with self.lock:
+            total_docs = len(self.tamanhos)
+            if not total_docs:
+                return []
+            media = self.total_termos / total_docs or 1.0
+
+            pontuacoes: Dict[Chave, float] = {}
+            for termo in termos:
+                documentos = self.postings.get(termo)
+                if not documentos:
+                    continue
+                idf = math.log(1 + (total_docs - len(documentos) + 0.5) / (len(documentos) + 0.5))
+                for chave, frequencia in documentos.items():
+                    normalizacao = BM25_K1 * (1 - BM25_B + BM25_B * self.tamanhos[chave] / media)
+                    pontuacoes[chave] = pontuacoes.get(chave, 0.0) + (
+                        idf * frequencia * (BM25_K1 + 1) / (frequencia + normalizacao)
+                    )
+
+            if vetor_consulta is not None:
+                pontuacoes = self._combinar_embedding(vetor_consulta, pontuacoes)
+
+        resultados = [
+            (chave, pontuacao) for chave, pontuacao in pontuacoes.items()
+            if pontuacao > 0 and (tipo is None or chave[0] == tipo)
+        ]
+        resultados.sort(key=lambda r: r[1], reverse=True)
+        return resultados[:k]
+
+    def _vetor_consulta(self, consulta: str) -> Optional[List[float]]:
+        embedding = obter_embedding()
+        if not embedding or not self.vetores:
+            return None
+        try:
+            return embedding([consulta])[0]
+        except Exception as e:
+            logger.warning(f"Falha ao calcular embedding da consulta: {e}")
+            return None
+
+    def _combinar_embedding(self, vetor_consulta: List[float], pontuacoes: Dict[Chave, float]) -> Dict[Chave, float]:
+        """Mistura o BM25 normalizado com a similaridade de cosseno"""
+        peso = getattr(settings, 'IA_GM_EMBEDDING_PESO', 0.5)
+        maximo = max(pontuacoes.values(), default=0.0) or 1.0
+        combinadas = {}
+        for chave in set(pontuacoes) | set(self.vetores):
+            similaridade = _cosseno(vetor_consulta, self.vetores[chave]) if chave in self.vetores else 0.0
+            combinadas[chave] = (1 - peso) * pontuacoes.get(chave, 0.0) / maximo + peso * max(similaridade, 0.0)
+        return combinadas
+
+
+# Índices por campanha neste processo, do menos ao mais recentemente usado
+_indices: "OrderedDict[int, IndiceMemoria]" = OrderedDict()
+_indices_lock = threading.Lock()
+
+
+def _chave_versao(campanha_id: int) -> str:
+    return f"ia_gm:indice_memoria:{campanha_id}:versao"
+
+
+def obter_indice(campanha_id: int) -> IndiceMemoria:
+    """
+    Índice da campanha neste processo, já sincronizado com o banco
+
+    Se a versão da campanha no cache mudou (memória ou NPC editado ou
+    removido em qualquer processo), o índice é reconstruído. Mantém no
+    máximo IA_GM_MEMORIA_INDICES_MAX campanhas, descartando a menos usada.
+    """
+    versao = obter_cache_ia().get(_chave_versao(campanha_id))
+    limite = getattr(settings, 'IA_GM_MEMORIA_INDICES_MAX', 256)
+    with _indices_lock:
+        indice = _indices.get(campanha_id)
+        if indice is None or indice.versao != versao:
+            indice = _indices[campanha_id] = IndiceMemoria(campanha_id, versao)
+        _indices.move_to_end(campanha_id)
+        while len(_indices) > limite:
+            _indices.popitem(last=False)
+    indice.sincronizar()
+    return indice
+
+
+def invalidar_indice(campanha_id: int):
+    """Muda a versão da campanha para que todos os processos refaçam o índice"""
+    cache_ia = obter_cache_ia()
+    chave = _chave_versao(campanha_id)
+    cache_ia.add(chave, 0, None)
+    try:
+        cache_ia.incr(chave)
+    except ValueError:
+        # Chave expulsa entre o add e o incr
+        cache_ia.set(chave, 1, None)
+
+
+@receiver(post_save, sender=MemoriaLongoPrazo, dispatch_uid='indice_memoria_salva')
+@receiver(post_save, sender=NPCGerado, dispatch_uid='indice_npc_salvo')
+def _documento_salvo(sender, instance, created, **kwargs):
+    # Criações entram pela marca d'água; só edições invalidam
+    if not created:
+        invalidar_indice(instance.campanha_id)
+
+
+@receiver(post_delete, sender=MemoriaLongoPrazo, dispatch_uid='indice_memoria_removida')
+@receiver(post_delete, sender=NPCGerado, dispatch_uid='indice_npc_removido')
+def _documento_removido(sender, instance, **kwargs):
+    invalidar_indice(instance.campanha_id)
+
+
+def descartar_indices():
+    """Esquece os índices do processo (reconstruídos na próxima busca)"""
+    with _indices_lock:
+        _indices.clear()
@@ -1,29 +1,111 @@
 """
-Gerenciador de Memória Simplificado para o Arquiteto de Mundos
+Gerenciador de Memória do Arquiteto de Mundos
+Resumo incremental da sessão em níveis e contexto narrativo compilado em cache
 """
 
-from typing import Dict, Any, List, Optional
-from .models import SessaoIA, MemoriaLongoPrazo, InteracaoIA
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
 from django.utils import timezone
 
+from .memory_index import obter_indice
+from .models import SessaoIA, MemoriaLongoPrazo, InteracaoIA, NPCGerado, ResumoNarrativo
+from .resilience import obter_cache_ia
+
+
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo de cada resumo, em caracteres
+LIMITE_RESUMO = 1200
+
 
 class MemoryManager:
-    """Gerenciador simplificado de memória para IA GM"""
+    """
+    Memória narrativa das sessões
+    
+    Interações antigas são condensadas em segundo plano (tarefa
+    compactar_memoria_sessao): cada IA_GM_MEMORIA_BLOCO interações viram um
+    resumo de nível 0 e cada IA_GM_MEMORIA_FATOR resumos de um nível viram um
+    do nível acima. O contexto compilado junta os resumos ainda não condensados
+    com as últimas interações e fica em cache até a próxima interação.
+    
+    Cache e trava de compactação ficam no cache compartilhado 'ia_gm', visível
+    para o processo web e para os workers Celery; a restrição única dos resumos
+    garante que uma compactação concorrente não grave o mesmo trecho duas vezes.
+    """
     
     def __init__(self):
-        pass
+        self.cache_timeout = getattr(settings, 'IA_GM_CACHE_TIMEOUT', 3600)
+    
+    @staticmethod
+    def _parametros() -> Tuple[int, int, int]:
+        """(bloco, fator, recentes) das configurações"""
+        return (
+            max(getattr(settings, 'IA_GM_MEMORIA_BLOCO', 20), 1),
+            max(getattr(settings, 'IA_GM_MEMORIA_FATOR', 4), 2),
+            max(getattr(settings, 'IA_GM_MEMORIA_RECENTES', 5), 0),
+        )
+    
+    @staticmethod
+    def _chave_contexto(sessao_id: int) -> str:
+        return f"memoria_contexto_{sessao_id}"
+    
+    @staticmethod
+    def _chave_geracao_campanha(campanha_id: int) -> str:
+        return f"memoria_campanha_{campanha_id}_geracao"
+    
+    @staticmethod
+    def _chave_compactacao(sessao_id: int) -> str:
+        return f"memoria_compactacao_{sessao_id}"
     
     def compilar_contexto_narrativo(self, sessao: SessaoIA) -> Dict[str, Any]:
-        """Compila contexto narrativo para a sessão"""
+        """
+        Contexto narrativo da sessão (campanha, memórias, resumo e interações recentes)
+        
+        O resultado em cache vale enquanto não houver interação nova na sessão
+        nem memória nova na campanha; a verificação custa uma consulta.
+        """
+        chave = self._chave_contexto(sessao.id)
+        marcador = self._marcador_contexto(sessao)
+        
+        em_cache = obter_cache_ia().get(chave)
+        if em_cache and em_cache.get('marcador') == marcador:
+            return em_cache['contexto']
+        
+        contexto = self._montar_contexto(sessao)
+        obter_cache_ia().set(chave, {'marcador': marcador, 'contexto': contexto}, self.cache_timeout)
+        return contexto
+    
+    def _marcador_contexto(self, sessao: SessaoIA) -> Tuple[Optional[int], int]:
+        ultima_interacao = InteracaoIA.objects.filter(
+            sessao=sessao
+        ).order_by('-id').values_list('id', flat=True).first()
+        return ultima_interacao, obter_cache_ia().get(self._chave_geracao_campanha(sessao.campanha_id), 0)
+    
+    def _montar_contexto(self, sessao: SessaoIA) -> Dict[str, Any]:
+        bloco, _, recentes = self._parametros()
+        
         # Busca últimas memórias importantes
         memorias_recentes = MemoriaLongoPrazo.objects.filter(
             campanha=sessao.campanha
         ).order_by('-data_evento')[:10]
         
-        # Últimas interações
-        interacoes_recentes = InteracaoIA.objects.filter(
-            sessao=sessao
-        ).order_by('-data_interacao')[:5]
+        resumos = ResumoNarrativo.objects.filter(
+            sessao=sessao, incorporado=False
+        ).order_by('primeira_interacao_id').values_list('texto', flat=True)
+        
+        # Interações ainda não resumidas; as mais antigas aguardam a compactação
+        pendentes = InteracaoIA.objects.filter(sessao=sessao, id__gt=self._coberto_ate(sessao))
+        interacoes_recentes = list(pendentes.order_by('-id')[:recentes])
+        if len(interacoes_recentes) == recentes and pendentes.count() >= bloco + recentes:
+            self.agendar_compactacao(sessao.id)
+        
+        # Memórias antigas e NPCs ligados ao que está acontecendo agora
+        situacao = ' '.join(f"{i.prompt_usuario} {i.resposta_ia}" for i in interacoes_recentes)
+        relevantes = self.buscar_memorias_relevantes(sessao, situacao)
+        ja_incluidas = {m.id for m in memorias_recentes}
         
         return {
             'campanha': {
@@ -38,6 +120,23 @@ class MemoryManager:
                     'data': m.data_evento.isoformat()
                 } for m in memorias_recentes
             ],
+            'memorias_relevantes': [
+                {
+                    'titulo': m.titulo,
+                    'descricao': m.descricao,
+                    'importancia': m.importancia,
+                    'data': m.data_evento.isoformat()
+                } for m in relevantes['memorias'] if m.id not in ja_incluidas
+            ],
+            'npcs_relevantes': [
+                {
+                    'nome': npc.nome,
+                    'ocupacao': npc.ocupacao,
+                    'motivacao': npc.motivacao_principal,
+                    'localizacao': npc.localizacao_atual
+                } for npc in relevantes['npcs']
+            ],
+            'resumo_sessao': list(resumos),
             'interacoes_recentes': [
                 {
                     'tipo': i.tipo_interacao,
@@ -52,6 +151,183 @@ class MemoryManager:
             }
         }
     
+    def buscar_memorias_relevantes(self, sessao: SessaoIA, consulta: str, k: int = 5) -> Dict[str, list]:
+        """
+        Memórias e NPCs da campanha mais relevantes para a situação (BM25)
+        
+        Returns:
+            {'memorias': [MemoriaLongoPrazo], 'npcs': [NPCGerado]}, do mais relevante ao menos
+        """
+        relevantes = {'memorias': [], 'npcs': []}
+        if not consulta.strip():
+            return relevantes
+        
+        indice = obter_indice(sessao.campanha_id)
+        for tipo, modelo, destino in (('memoria', MemoriaLongoPrazo, 'memorias'), ('npc', NPCGerado, 'npcs')):
+            ids = [chave[1] for chave, _ in indice.buscar(consulta, k, tipo=tipo)]
+            objetos = modelo.objects.in_bulk(ids)
+            for id_ in ids:
+                if id_ in objetos:
+                    relevantes[destino].append(objetos[id_])
+                else:
+                    # Apagado desde a indexação
+                    indice.remover((tipo, id_))
+        return relevantes
+    
+    def invalidar_contexto_campanha(self, campanha_id: int):
+        """Descarta o contexto compilado de todas as sessões da campanha"""
+        chave = self._chave_geracao_campanha(campanha_id)
+        cache_ia = obter_cache_ia()
+        cache_ia.add(chave, 0, None)
+        try:
+            cache_ia.incr(chave)
+        except ValueError:
+            # Expirou entre o add e o incr
+            cache_ia.set(chave, 1, None)
+    
+    # Compactação
+    
+    def agendar_compactacao(self, sessao_id: int):
+        """Enfileira a compactação da memória da sessão (uma por vez)"""
+        chave = self._chave_compactacao(sessao_id)
+        if not obter_cache_ia().add(chave, True, 600):
+            return
+        
+        try:
+            from .tasks import compactar_memoria_sessao
+            compactar_memoria_sessao.delay(sessao_id)
+        except Exception as e:
+            obter_cache_ia().delete(chave)
+            logger.warning(f"Falha ao agendar compactação da memória da sessão {sessao_id}: {e}")
+    
+    def compactar_memoria(self, sessao: SessaoIA) -> int:
+        """
+        Resume as interações antigas da sessão e condensa os níveis cheios
+        
+        Returns:
+            Número de resumos criados
+        """
+        try:
+            criados = self._resumir_interacoes(sessao) + self._condensar_niveis(sessao)
+        finally:
+            obter_cache_ia().delete(self._chave_compactacao(sessao.id))
+        
+        if criados:
+            obter_cache_ia().delete(self._chave_contexto(sessao.id))
+            logger.info(f"Memória da sessão {sessao.id} compactada ({criados} resumos)")
+        return criados
+    
+    @staticmethod
+    def _coberto_ate(sessao: SessaoIA) -> int:
+        """Id da última interação já incluída em algum resumo"""
+        return ResumoNarrativo.objects.filter(
+            sessao=sessao
+        ).aggregate(ultima=Max('ultima_interacao_id'))['ultima'] or 0
+    
+    def _resumir_interacoes(self, sessao: SessaoIA) -> int:
+        bloco, _, recentes = self._parametros()
+        
+        pendentes = list(
+            InteracaoIA.objects.filter(sessao=sessao, id__gt=self._coberto_ate(sessao))
+            .order_by('id')
+            .only('id', 'tipo_interacao', 'prompt_usuario', 'resposta_ia')
+        )
+        # As últimas interações ficam de fora: entram inteiras no contexto
+        pendentes = pendentes[:max(len(pendentes) - recentes, 0)]
+        
+        criados = 0
+        for inicio in range(0, len(pendentes) - bloco + 1, bloco):
+            trecho = pendentes[inicio:inicio + bloco]
+            texto = self._resumir(sessao, [self._texto_interacao(i) for i in trecho], 0)
+            try:
+                with transaction.atomic():
+                    ResumoNarrativo.objects.create(
+                        sessao=sessao,
+                        nivel=0,
+                        texto=texto,
+                        primeira_interacao_id=trecho[0].id,
+                        ultima_interacao_id=trecho[-1].id
+                    )
+            except IntegrityError:
+                self._compactacao_concorrente(sessao, 0)
+                break
+            criados += 1
+        return criados
+    
+    def _condensar_niveis(self, sessao: SessaoIA) -> int:
+        _, fator, _ = self._parametros()
+        
+        nivel_maximo = ResumoNarrativo.objects.filter(sessao=sessao).aggregate(nivel=Max('nivel'))['nivel']
+        criados = 0
+        nivel = 0
+        while nivel_maximo is not None and nivel <= nivel_maximo:
+            ativos = list(
+                ResumoNarrativo.objects.filter(sessao=sessao, nivel=nivel, incorporado=False)
+                .order_by('primeira_interacao_id')
+            )
+            for inicio in range(0, len(ativos) - fator + 1, fator):
+                grupo = ativos[inicio:inicio + fator]
+                texto = self._resumir(sessao, [r.texto for r in grupo], nivel + 1)
+                try:
+                    with transaction.atomic():
+                        ResumoNarrativo.objects.create(
+                            sessao=sessao,
+                            nivel=nivel + 1,
+                            texto=texto,
+                            primeira_interacao_id=grupo[0].primeira_interacao_id,
+                            ultima_interacao_id=grupo[-1].ultima_interacao_id
+                        )
+                        ResumoNarrativo.objects.filter(id__in=[r.id for r in grupo]).update(incorporado=True)
+                except IntegrityError:
+                    self._compactacao_concorrente(sessao, nivel + 1)
+                    return criados
+                criados += 1
+                nivel_maximo = max(nivel_maximo, nivel + 1)
+            nivel += 1
+        return criados
+    
+    @staticmethod
+    def _compactacao_concorrente(sessao: SessaoIA, nivel: int):
+        # Outra compactação gravou o trecho primeiro; ela segue com o restante
+        logger.info(f"Trecho de nível {nivel} da sessão {sessao.id} já resumido por outra compactação")
+    
+    @staticmethod
+    def _texto_interacao(interacao: InteracaoIA) -> str:
+        return f"{interacao.prompt_usuario[:300]} → {interacao.resposta_ia[:600]}"
+    
+    def _resumir(self, sessao: SessaoIA, textos: List[str], nivel: int) -> str:
+        """Resumo dos textos pela IA, ou extrativo se ela falhar"""
+        try:
+            from .ai_client import get_ia_client, executar_sync
+            
+            origem = "eventos de uma sessão de RPG" if nivel == 0 else "resumos consecutivos de uma campanha de RPG"
+            trechos = "\n".join(f"- {texto}" for texto in textos)
+            prompt = f"""Resuma em no máximo {LIMITE_RESUMO // 6} palavras os {origem} abaixo, em ordem.
+Mantenha nomes, decisões, consequências pendentes e segredos revelados; omita detalhes de estilo.
+
+{trechos}"""
+
+            resultado = executar_sync(get_ia_client().gerar_conteudo(
+                prompt, campanha_id=sessao.campanha_id, max_tokens=400, temperature=0.3
+            ))
+            texto = resultado['conteudo'].strip()
+            if texto:
+                return texto[:LIMITE_RESUMO]
+        except Exception as e:
+            logger.warning(f"Falha ao resumir memória da sessão {sessao.id} com IA: {e}")
+        
+        return self._resumo_extrativo(textos)
+    
+    @staticmethod
+    def _resumo_extrativo(textos: List[str]) -> str:
+        """O início de cada trecho, dividindo o limite igualmente entre eles"""
+        cota = max(LIMITE_RESUMO // max(len(textos), 1), 40)
+        partes = []
+        for texto in textos:
+            texto = ' '.join(texto.split())
+            partes.append(texto if len(texto) <= cota else texto[:cota].rsplit(' ', 1)[0] + '…')
+        return ' | '.join(partes)[:LIMITE_RESUMO]
+    
     def identificar_oportunidades_narrativas(self, sessao: SessaoIA) -> List[Dict[str, str]]:
         """Identifica oportunidades narrativas baseadas na memória"""
         # Por enquanto, retorna oportunidades genéricas
@@ -81,7 +357,7 @@ class MemoryManager:
         importancia: int = 3
     ) -> MemoriaLongoPrazo:
         """Registra um evento importante na memória de longo prazo"""
-        return MemoriaLongoPrazo.objects.create(
+        memoria = MemoriaLongoPrazo.objects.create(
             campanha=sessao.campanha,
             titulo=titulo,
             descricao=descricao,
@@ -90,6 +366,8 @@ class MemoryManager:
             importancia=min(importancia, 5),
             data_evento=timezone.now()
         )
+        self.invalidar_contexto_campanha(sessao.campanha_id)
+        return memoria
 
 
 # Instância singleton
@@ -100,4 +378,4 @@ def get_memory_manager() -> MemoryManager:
     global _memory_manager_instance
     if _memory_manager_instance is None:
         _memory_manager_instance = MemoryManager()
-    return _memory_manager_instance
\ No newline at end of file
+    return _memory_manager_instance
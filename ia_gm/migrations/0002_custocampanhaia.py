@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campanhas', '0007_campanha_publica'),
+        ('ia_gm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustoCampanhaIA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provedor', models.CharField(max_length=20)),
+                ('data', models.DateField(default=django.utils.timezone.localdate)),
+                ('requisicoes', models.PositiveIntegerField(default=0)),
+                ('tokens_usados', models.PositiveIntegerField(default=0)),
+                ('custo_estimado', models.DecimalField(decimal_places=6, default=0, help_text='Custo estimado acumulado em US$', max_digits=12)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('campanha', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custos_ia', to='campanhas.campanha')),
+            ],
+            options={
+                'verbose_name': 'Custo de IA da Campanha',
+                'verbose_name_plural': 'Custos de IA das Campanhas',
+                'ordering': ['-data', 'provedor'],
+                'unique_together': {('campanha', 'provedor', 'data')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ia_gm', '0002_custocampanhaia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoTurnoSessao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dados', models.JSONField(default=dict)),
+                ('versao', models.PositiveIntegerField(default=1)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('sessao', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='estado_turno', to='ia_gm.sessaoia')),
+            ],
+            options={
+                'verbose_name': 'Estado de Turno da Sessão',
+                'verbose_name_plural': 'Estados de Turno das Sessões',
+            },
+        ),
+    ]
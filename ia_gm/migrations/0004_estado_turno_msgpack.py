@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:36
+
+from datetime import datetime
+
+import msgpack
+from django.db import migrations, models
+
+
+def converter_json_para_msgpack(apps, schema_editor):
+    """Regrava os snapshots em JSON no formato 1 de codificar_estado_turno"""
+    EstadoTurnoSessao = apps.get_model('ia_gm', 'EstadoTurnoSessao')
+    for snapshot in EstadoTurnoSessao.objects.all():
+        dados = snapshot.dados
+        snapshot.estado = msgpack.packb([
+            1,
+            dados['numero_turno'],
+            dados['fase'],
+            dados['descricao_situacao'],
+            [
+                [acao['personagem_nome'], acao['usuario_id'], acao['acao'],
+                 datetime.fromisoformat(acao['timestamp']), acao['processada']]
+                for acao in dados['acoes_recebidas']
+            ],
+            dados['personagens_esperados'],
+            dados['aguardando_personagens'],
+            dados.get('narrativa_resultado'),
+            dados.get('job_id'),
+        ], datetime=True)
+        snapshot.save(update_fields=['estado'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ia_gm', '0003_estadoturnosessao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadoturnosessao',
+            name='estado',
+            field=models.BinaryField(default=bytes, help_text='Estado do turno em msgpack (codificar_estado_turno)'),
+        ),
+        migrations.RunPython(converter_json_para_msgpack, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='estadoturnosessao',
+            name='dados',
+        ),
+    ]
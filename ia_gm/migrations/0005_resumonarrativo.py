@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ia_gm', '0004_estado_turno_msgpack'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoNarrativo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nivel', models.PositiveSmallIntegerField(default=0)),
+                ('texto', models.TextField()),
+                ('primeira_interacao_id', models.PositiveBigIntegerField()),
+                ('ultima_interacao_id', models.PositiveBigIntegerField()),
+                ('incorporado', models.BooleanField(default=False, help_text='Já condensado num resumo do nível acima')),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('sessao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos', to='ia_gm.sessaoia')),
+            ],
+            options={
+                'verbose_name': 'Resumo Narrativo',
+                'verbose_name_plural': 'Resumos Narrativos',
+                'ordering': ['primeira_interacao_id', '-nivel'],
+                'indexes': [models.Index(fields=['sessao', 'incorporado', 'nivel'], name='ia_gm_resum_sessao__2ec893_idx')],
+            },
+        ),
+    ]
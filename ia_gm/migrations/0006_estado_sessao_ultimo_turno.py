@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+def marcar_sessoes_em_jogo(apps, schema_editor):
+    """Snapshots existentes pertencem a sessões que já estavam em modo de jogo"""
+    EstadoTurnoSessao = apps.get_model('ia_gm', 'EstadoTurnoSessao')
+    EstadoTurnoSessao.objects.filter(sessao__ativa=True).update(estado_sessao='ativa')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ia_gm', '0005_resumonarrativo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadoturnosessao',
+            name='estado_sessao',
+            field=models.CharField(blank=True, default='', help_text='EstadoSessao; vazio = configuração', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='estadoturnosessao',
+            name='ultimo_turno',
+            field=models.JSONField(blank=True, help_text='Resultado do último turno resolvido', null=True),
+        ),
+        migrations.RunPython(marcar_sessoes_em_jogo, migrations.RunPython.noop),
+    ]
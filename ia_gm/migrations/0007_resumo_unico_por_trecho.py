@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:05
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remover_resumos_duplicados(apps, schema_editor):
+    """Mantém o primeiro resumo de cada trecho gravado por compactações concorrentes"""
+    ResumoNarrativo = apps.get_model('ia_gm', 'ResumoNarrativo')
+    trechos = (
+        ResumoNarrativo.objects.values('sessao_id', 'nivel', 'primeira_interacao_id')
+        .annotate(primeiro=Min('id'))
+    )
+    manter = [trecho['primeiro'] for trecho in trechos]
+    ResumoNarrativo.objects.exclude(id__in=manter).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ia_gm', '0006_estado_sessao_ultimo_turno'),
+    ]
+
+    operations = [
+        migrations.RunPython(remover_resumos_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='resumonarrativo',
+            constraint=models.UniqueConstraint(fields=('sessao', 'nivel', 'primeira_interacao_id'), name='resumo_unico_por_trecho'),
+        ),
+    ]
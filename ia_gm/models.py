@@ -326,3 +326,88 @@ class MemoriaLongoPrazo(models.Model):
     
     def __str__(self):
         return f"{self.titulo} ({self.get_categoria_display()})"
+
+
+class CustoCampanhaIA(models.Model):
+    """
+    Livro-razão de custo da IA por campanha
+    Acumula, por dia e provedor, o custo estimado das gerações
+    """
+    campanha = models.ForeignKey('campanhas.Campanha', on_delete=models.CASCADE, related_name='custos_ia')
+    provedor = models.CharField(max_length=20)
+    data = models.DateField(default=timezone.localdate)
+    
+    requisicoes = models.PositiveIntegerField(default=0)
+    tokens_usados = models.PositiveIntegerField(default=0)
+    custo_estimado = models.DecimalField(
+        max_digits=12,
+        decimal_places=6,
+        default=0,
+        help_text="Custo estimado acumulado em US$"
+    )
+    atualizado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Custo de IA da Campanha"
+        verbose_name_plural = "Custos de IA das Campanhas"
+        ordering = ['-data', 'provedor']
+        unique_together = ['campanha', 'provedor', 'data']
+    
+    def __str__(self):
+        return f"{self.campanha_id} - {self.provedor} ({self.data}): US$ {self.custo_estimado}"
+
+
+class EstadoTurnoSessao(models.Model):
+    """
+    Snapshot durável do estado do turno de uma sessão de jogo
+    `versao` é incrementada a cada gravação e serve de compare-and-set
+    """
+    sessao = models.OneToOneField(SessaoIA, on_delete=models.CASCADE, related_name='estado_turno')
+    estado = models.BinaryField(default=bytes, help_text="Estado do turno em msgpack (codificar_estado_turno)")
+    versao = models.PositiveIntegerField(default=1)
+    # Compartilhados entre o processo web e os workers Celery (fora do compare-and-set)
+    estado_sessao = models.CharField(max_length=20, blank=True, default='', help_text="EstadoSessao; vazio = configuração")
+    ultimo_turno = models.JSONField(null=True, blank=True, help_text="Resultado do último turno resolvido")
+    atualizado_em = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Estado de Turno da Sessão"
+        verbose_name_plural = "Estados de Turno das Sessões"
+    
+    def __str__(self):
+        return f"Sessão {self.sessao_id} - v{self.versao}"
+
+
+class ResumoNarrativo(models.Model):
+    """
+    Resumo de um trecho de interações de uma sessão
+    Nível 0 resume interações; cada nível acima condensa resumos do nível
+    anterior, então o resumo da sessão cresce com o logaritmo do histórico
+    """
+    sessao = models.ForeignKey(SessaoIA, on_delete=models.CASCADE, related_name='resumos')
+    nivel = models.PositiveSmallIntegerField(default=0)
+    texto = models.TextField()
+    
+    # Intervalo de ids de InteracaoIA coberto pelo resumo
+    primeira_interacao_id = models.PositiveBigIntegerField()
+    ultima_interacao_id = models.PositiveBigIntegerField()
+    incorporado = models.BooleanField(default=False, help_text="Já condensado num resumo do nível acima")
+    criado_em = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Resumo Narrativo"
+        verbose_name_plural = "Resumos Narrativos"
+        ordering = ['primeira_interacao_id', '-nivel']
+        indexes = [models.Index(fields=['sessao', 'incorporado', 'nivel'])]
+        constraints = [
+            # Duas compactações simultâneas não podem resumir o mesmo trecho
+            models.UniqueConstraint(
+                fields=['sessao', 'nivel', 'primeira_interacao_id'], name='resumo_unico_por_trecho'
+            )
+        ]
+    
+    def __str__(self):
+        return (
+            f"Sessão {self.sessao_id} - nível {self.nivel} "
+            f"({self.primeira_interacao_id}-{self.ultima_interacao_id})"
+        )
@@ -3,8 +3,15 @@ Sistema de Prompts e Templates para o "Arquiteto de Mundos"
 Implementa as diretrizes da filosofia "Sim, e..." e criação colaborativa
 """
 
-from typing import Dict, Any, List
+import logging
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 from .models import EstiloNarrativo, TipoConteudo
+from .master_rules import MasterRulesEngine, ModoOperacao
+from .tokenizer import contar_tokens
+
+
+logger = logging.getLogger(__name__)
 
 
 class ArquitetoDeMundosPrompts:
@@ -60,18 +67,45 @@ class ArquitetoDeMundosPrompts:
     @classmethod
     def get_sistema_base(cls, estilo_narrativo: str, criatividade: int, dificuldade: int) -> str:
         """Retorna o prompt base com configurações específicas"""
-        estilo_desc = cls._get_descricao_estilo(estilo_narrativo)
+        return cls.compilar_sistema(estilo_narrativo, criatividade, dificuldade).texto
+    
+    @classmethod
+    @lru_cache(maxsize=256)
+    def compilar_sistema(
+        cls,
+        estilo_narrativo: str,
+        criatividade: int,
+        dificuldade: int,
+        modo: Optional[ModoOperacao] = None
+    ) -> 'PromptSistema':
+        """
+        Prompt de sistema memoizado por (estilo, criatividade, dificuldade, modo)
         
-        return f"""
+        Args:
+            estilo_narrativo: Estilo narrativo da sessão
+            criatividade: Nível de criatividade (1-10)
+            dificuldade: Nível de dificuldade (1-10)
+            modo: Se informado, as regras comportamentais do modo entram no prefixo
+        
+        Returns:
+            PromptSistema com o prefixo estável separado das configurações da sessão
+        """
+        prefixo = f"""
         {cls.PROMPT_BASE}
         
-        CONFIGURAÇÕES DESTA SESSÃO:
+"""
+        if modo is not None:
+            prefixo += MasterRulesEngine.gerar_prompt_comportamental(modo)
+        
+        estilo_desc = cls._get_descricao_estilo(estilo_narrativo)
+        configuracao = f"""        CONFIGURAÇÕES DESTA SESSÃO:
         - Estilo Narrativo: {estilo_desc}
         - Nível de Criatividade: {criatividade}/10 (quanto maior, mais elementos únicos e surpreendentes)
         - Nível de Dificuldade: {dificuldade}/10 (quanto maior, mais desafiador para os jogadores)
         
         Mantenha essas configurações em mente ao criar conteúdo.
         """
+        return PromptSistema(prefixo, configuracao)
     
     @classmethod
     def _get_descricao_estilo(cls, estilo: str) -> str:
@@ -89,6 +123,121 @@ class ArquitetoDeMundosPrompts:
         return estilos.get(estilo, "Equilibrado entre todos os elementos")
 
 
+class PromptSistema:
+    """
+    Prompt de sistema compilado
+    
+    `prefixo` depende só do modo e é idêntico entre sessões (pode ser reaproveitado
+    pelo cache de prompt do provedor); `configuracao` traz os ajustes da sessão.
+    """
+    
+    __slots__ = ('prefixo', 'configuracao')
+    
+    def __init__(self, prefixo: str, configuracao: str):
+        self.prefixo = prefixo
+        self.configuracao = configuracao
+    
+    @property
+    def texto(self) -> str:
+        return self.prefixo + self.configuracao
+
+
+class SecaoPrompt:
+    """Trecho de um prompt; seções com prioridade podem ser cortadas para caber no orçamento"""
+    
+    __slots__ = ('texto', 'prioridade', 'titulo', 'itens', 'vazio', 'tokens')
+    
+    def __init__(
+        self,
+        texto: str = '',
+        prioridade: Optional[int] = None,
+        titulo: str = '',
+        itens: Optional[List[str]] = None,
+        vazio: str = ''
+    ):
+        self.texto = texto
+        self.prioridade = prioridade
+        self.titulo = titulo
+        self.itens = list(itens) if itens is not None else None
+        self.vazio = vazio
+        self.tokens = 0
+    
+    def renderizar(self) -> str:
+        if self.itens is None:
+            return self.texto
+        corpo = "\n".join(self.itens) if self.itens else self.vazio
+        return f"{self.titulo}\n{corpo}" if self.titulo else corpo
+
+
+class MontadorPrompt:
+    """
+    Monta um prompt a partir de seções e o corta para caber no orçamento de tokens
+    
+    Seções sem prioridade são fixas. Quando o prompt passa do orçamento, a seção
+    de menor prioridade perde primeiro seus últimos itens (listas devem vir da
+    mais para a menos relevante) e, se não for lista, é removida inteira.
+    """
+    
+    def __init__(self, orcamento_tokens: Optional[int] = None, modelo: Optional[str] = None):
+        self.orcamento_tokens = orcamento_tokens
+        self.modelo = modelo
+        self.secoes: List[SecaoPrompt] = []
+    
+    def adicionar(self, texto: str, prioridade: Optional[int] = None) -> 'MontadorPrompt':
+        """Adiciona um trecho de texto (fixo se prioridade for None)"""
+        self.secoes.append(SecaoPrompt(texto=texto, prioridade=prioridade))
+        return self
+    
+    def adicionar_lista(
+        self,
+        titulo: str,
+        itens: List[str],
+        prioridade: int,
+        vazio: str = ''
+    ) -> 'MontadorPrompt':
+        """Adiciona uma lista cortável item a item (do mais para o menos relevante)"""
+        self.secoes.append(SecaoPrompt(titulo=titulo, itens=itens, prioridade=prioridade, vazio=vazio))
+        return self
+    
+    def _contar(self, secao: SecaoPrompt) -> int:
+        secao.tokens = contar_tokens(secao.renderizar(), self.modelo)
+        return secao.tokens
+    
+    def montar(self) -> str:
+        """Texto final do prompt, já dentro do orçamento sempre que possível"""
+        if self.orcamento_tokens is None:
+            return self._juntar(self.secoes)
+        
+        ativas = list(self.secoes)
+        total = sum(self._contar(secao) for secao in ativas)
+        
+        while total > self.orcamento_tokens:
+            cortaveis = [
+                (secao.prioridade, -indice, secao) for indice, secao in enumerate(ativas)
+                if secao.prioridade is not None
+            ]
+            if not cortaveis:
+                logger.warning(
+                    f"Prompt com {total} tokens excede o orçamento de {self.orcamento_tokens} "
+                    f"mesmo sem seções opcionais"
+                )
+                break
+            
+            _, _, alvo = min(cortaveis, key=lambda c: c[:2])
+            total -= alvo.tokens
+            if alvo.itens:
+                alvo.itens.pop()
+                total += self._contar(alvo)
+            else:
+                ativas.remove(alvo)
+        
+        return self._juntar(ativas)
+    
+    @staticmethod
+    def _juntar(secoes: List[SecaoPrompt]) -> str:
+        return "\n\n".join(texto for texto in (secao.renderizar() for secao in secoes) if texto)
+
+
 class PromptGenerator:
     """Gerador de prompts específicos para diferentes tipos de conteúdo"""
     
@@ -434,8 +583,16 @@ class PromptGenerator:
     
     @staticmethod
     def gerar_narrativa(contexto: Dict[str, Any]) -> str:
-        """Gera prompt para narrativa geral ou descrição de cena"""
-        return f"""
+        """
+        Gera prompt para narrativa geral ou descrição de cena
+        
+        Memórias (contexto['memorias']) e interações recentes
+        (contexto['interacoes_recentes']) entram como seções cortáveis,
+        ajustadas a contexto['orcamento_tokens'] quando informado.
+        """
+        montador = MontadorPrompt(contexto.get('orcamento_tokens'), contexto.get('modelo'))
+        
+        montador.adicionar(f"""
         {ArquitetoDeMundosPrompts.get_sistema_base(
             contexto.get('estilo', EstiloNarrativo.EPICO),
             contexto.get('criatividade', 7),
@@ -456,9 +613,28 @@ class PromptGenerator:
         CONTEXTO ATUAL:
         - Local: {contexto.get('local_atual', 'Não especificado')}
         - NPCs presentes: {contexto.get('npcs_presentes', 'Nenhum')}
-        - Tempo/Clima: {contexto.get('tempo_clima', 'Normal')}
+        - Tempo/Clima: {contexto.get('tempo_clima', 'Normal')}""")
+        
+        # Memórias mais importantes primeiro: as menos importantes são cortadas antes
+        memorias = sorted(
+            contexto.get('memorias', []), key=lambda m: m.get('importancia', 0), reverse=True
+        )
+        if memorias:
+            montador.adicionar_lista(
+                "        MEMÓRIAS DA CAMPANHA:",
+                [f"        - {m.get('titulo', '')}: {m.get('descricao', '')}" for m in memorias],
+                prioridade=2
+            )
+        
+        interacoes = contexto.get('interacoes_recentes', [])
+        if interacoes:
+            montador.adicionar_lista(
+                "        INTERAÇÕES RECENTES:",
+                [f"        - {i.get('tipo', '')}: {i.get('resposta', '')}" for i in interacoes],
+                prioridade=1
+            )
         
-        CRIE UMA NARRATIVA SEGUINDO ESTAS DIRETRIZES:
+        montador.adicionar("""        CRIE UMA NARRATIVA SEGUINDO ESTAS DIRETRIZES:
         
         1. FILOSOFIA "SIM, E...":
            - Como validar a ação dos jogadores de forma interessante?
@@ -488,7 +664,9 @@ class PromptGenerator:
         5. Oportunidades para os jogadores continuarem
         
         Lembre-se: o objetivo é sempre dizer "Sim, e..." de forma que faça a história avançar de maneira interessante.
-        """
+        """)
+        
+        return montador.montar()
     
     @staticmethod
     def processar_acao_impossivel(contexto: Dict[str, Any]) -> str:
@@ -0,0 +1,343 @@
+"""
+Limitação de taxa e orçamento de custo das gerações de IA
+Token buckets por provedor e por campanha (requisições/min e tokens/min),
+com enfileiramento em vez de rejeição, e livro-razão de custo por campanha
+"""
+
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple, Union
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache.backends.redis import RedisCache
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .resilience import obter_cache_ia
+
+
+logger = logging.getLogger(__name__)
+
+
+class LimiteTaxaExcedido(Exception):
+    """A espera na fila do limitador passaria de IA_GM_LIMITE_ESPERA_MAXIMA"""
+
+
+class OrcamentoExcedido(Exception):
+    """A campanha já consumiu o orçamento mensal de IA"""
+
+
+class TokenBucket:
+    """
+    Balde de fichas reposto continuamente (capacidade = limite por minuto)
+
+    Reservas podem deixar o saldo negativo: cada chamador recebe o tempo que
+    deve aguardar até que sua parte seja reposta, o que forma uma fila FIFO
+    sem precisar de locks.
+    """
+
+    __slots__ = ('capacidade', 'taxa', 'saldo', 'atualizado')
+
+    def __init__(self, por_minuto: float):
+        self.capacidade = float(por_minuto)
+        self.taxa = self.capacidade / 60.0
+        self.saldo = self.capacidade
+        self.atualizado = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.saldo = min(self.capacidade, self.saldo + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    def limitar(self, quantidade: float) -> float:
+        """Quanto de fato é reservado: pedido maior que o balde inteiro esperaria para sempre"""
+        return min(quantidade, self.capacidade)
+
+    def reservar(self, quantidade: float) -> float:
+        """Reserva fichas (até a capacidade) e retorna quantos segundos aguardar até estarem disponíveis"""
+        self._repor()
+        self.saldo -= self.limitar(quantidade)
+        return max(0.0, -self.saldo / self.taxa)
+
+    def devolver(self, quantidade: float):
+        """Devolve fichas reservadas e não usadas"""
+        self._repor()
+        self.saldo = min(self.capacidade, self.saldo + quantidade)
+
+    async def areservar(self, quantidade: float) -> float:
+        """Versão assíncrona de reservar (mesma interface do BaldeCompartilhado)"""
+        return self.reservar(quantidade)
+
+    async def adevolver(self, quantidade: float):
+        """Versão assíncrona de devolver"""
+        self.devolver(quantidade)
+
+
+# GCRA: em vez do saldo, guarda o instante teórico (tat) em que o balde estaria
+# cheio de novo; saldo = capacidade - (tat - agora) * taxa. Reservar avança o
+# tat, devolver recua (nunca antes de agora, o que equivale a saldo <= capacidade).
+# ARGV[1]: quantidade / taxa (negativo devolve); ARGV[2]: capacidade / taxa
+SCRIPT_BALDE = """
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), agora)
+tat = math.max(tat + tonumber(ARGV[1]), agora)
+redis.call('SET', KEYS[1], string.format('%.6f', tat), 'EX', math.ceil(tat - agora) + 1)
+return string.format('%.6f', math.max(0, tat - agora - tonumber(ARGV[2])))
+"""
+
+
+class BaldeCompartilhado:
+    """
+    Token bucket no Redis do cache 'ia_gm', comum a todos os processos
+
+    Reserva e devolução são um único script atômico, com o relógio do Redis
+    (os workers não precisam estar sincronizados). A espera devolvida tem o
+    mesmo significado do TokenBucket local. Se o Redis falhar, a chamada usa
+    o balde local deste processo em vez de derrubar a geração.
+    """
+
+    __slots__ = ('chave', 'capacidade', 'taxa', 'cache_ia', 'script', 'local')
+
+    def __init__(self, chave: str, por_minuto: float, cache_ia: RedisCache):
+        self.capacidade = float(por_minuto)
+        self.taxa = self.capacidade / 60.0
+        self.cache_ia = cache_ia
+        self.chave = cache_ia.make_and_validate_key(chave)
+        self.script = None
+        self.local = TokenBucket(por_minuto)
+
+    def limitar(self, quantidade: float) -> float:
+        return min(quantidade, self.capacidade)
+
+    def _executar(self, segundos: float) -> float:
+        if self.script is None:
+            cliente = self.cache_ia._cache.get_client(self.chave, write=True)
+            self.script = cliente.register_script(SCRIPT_BALDE)
+        return float(self.script(keys=[self.chave], args=[segundos, self.capacidade / self.taxa]))
+
+    async def _aplicar(self, quantidade: float) -> Optional[float]:
+        try:
+            return await sync_to_async(self._executar, thread_sensitive=False)(quantidade / self.taxa)
+        except Exception as e:
+            logger.debug(f"Balde compartilhado {self.chave} indisponível: {e}")
+            return None
+
+    async def areservar(self, quantidade: float) -> float:
+        """Reserva fichas (até a capacidade) e retorna quantos segundos aguardar"""
+        espera = await self._aplicar(self.limitar(quantidade))
+        return self.local.reservar(quantidade) if espera is None else espera
+
+    async def adevolver(self, quantidade: float):
+        """Devolve fichas reservadas e não usadas"""
+        if await self._aplicar(-quantidade) is None:
+            self.local.devolver(quantidade)
+
+
+Balde = Union[TokenBucket, BaldeCompartilhado]
+
+
+class ReservaTaxa:
+    """Fichas reservadas para uma chamada, ajustadas depois pelo consumo real"""
+
+    __slots__ = ('baldes_requisicoes', 'baldes_tokens', 'tokens')
+
+    def __init__(self, baldes_requisicoes: List[Balde], baldes_tokens: List[Balde], tokens: int):
+        self.baldes_requisicoes = baldes_requisicoes
+        self.baldes_tokens = baldes_tokens
+        self.tokens = tokens
+
+    async def ajustar_tokens(self, tokens_usados: int):
+        """Acerta os baldes de tokens com o total efetivamente consumido"""
+        for balde in self.baldes_tokens:
+            # Compara com o que o balde de fato reservou (limitado à capacidade)
+            diferenca = balde.limitar(self.tokens) - balde.limitar(tokens_usados)
+            if diferenca > 0:
+                await balde.adevolver(diferenca)
+            elif diferenca < 0:
+                await balde.areservar(-diferenca)
+        self.tokens = tokens_usados
+
+    async def cancelar(self):
+        """Devolve tudo (a chamada não chegou a ser feita)"""
+        for balde in self.baldes_requisicoes:
+            await balde.adevolver(1)
+        for balde in self.baldes_tokens:
+            await balde.adevolver(balde.limitar(self.tokens))
+        self.tokens = 0
+
+
+class LimitadorTaxa:
+    """
+    Limitador por provedor (IA_GM_LIMITES_TAXA) e por campanha+provedor
+    (IA_GM_LIMITES_TAXA_CAMPANHA)
+
+    Com o cache 'ia_gm' no Redis os baldes são compartilhados por todos os
+    workers web e Celery, então o limite configurado vale para a instalação
+    inteira; com cache local (desenvolvimento) cada processo tem os seus.
+    Perto do limite as chamadas aguardam a reposição do balde em vez de
+    serem rejeitadas; só falham se a espera passar de IA_GM_LIMITE_ESPERA_MAXIMA.
+    """
+
+    def __init__(self):
+        self.baldes: Dict[Tuple, Balde] = {}
+
+    def _balde(self, chave: Tuple, por_minuto: Optional[float]) -> Optional[Balde]:
+        if not por_minuto:
+            return None
+        if chave not in self.baldes:
+            cache_ia = obter_cache_ia()
+            if isinstance(cache_ia, RedisCache):
+                self.baldes[chave] = BaldeCompartilhado(
+                    'ia_gm:taxa:' + ':'.join(str(parte) for parte in chave), por_minuto, cache_ia
+                )
+            else:
+                self.baldes[chave] = TokenBucket(por_minuto)
+        return self.baldes[chave]
+
+    def _baldes_aplicaveis(self, nome: str, campanha_id: Optional[int]) -> Tuple[list, list]:
+        escopos = [(('provedor', nome), getattr(settings, 'IA_GM_LIMITES_TAXA', {}).get(nome, {}))]
+        if campanha_id is not None:
+            escopos.append((
+                ('campanha', campanha_id, nome),
+                getattr(settings, 'IA_GM_LIMITES_TAXA_CAMPANHA', {})
+            ))
+
+        requisicoes, tokens = [], []
+        for chave, limites in escopos:
+            balde = self._balde(chave + ('requisicoes',), limites.get('requisicoes_por_minuto'))
+            if balde:
+                requisicoes.append(balde)
+            balde = self._balde(chave + ('tokens',), limites.get('tokens_por_minuto'))
+            if balde:
+                tokens.append(balde)
+        return requisicoes, tokens
+
+    async def adquirir(self, nome: str, tokens: int, campanha_id: Optional[int] = None) -> ReservaTaxa:
+        """
+        Reserva uma requisição e `tokens` tokens, aguardando na fila se necessário
+
+        Args:
+            nome: Nome do provedor
+            tokens: Estimativa de tokens (entrada + máximo de saída)
+            campanha_id: Campanha que origina a chamada (limite próprio por campanha)
+        """
+        baldes_requisicoes, baldes_tokens = self._baldes_aplicaveis(nome, campanha_id)
+        reserva = ReservaTaxa(baldes_requisicoes, baldes_tokens, tokens)
+
+        espera = max(
+            [await balde.areservar(1) for balde in baldes_requisicoes] +
+            [await balde.areservar(tokens) for balde in baldes_tokens] +
+            [0.0]
+        )
+
+        espera_maxima = getattr(settings, 'IA_GM_LIMITE_ESPERA_MAXIMA', 30.0)
+        if espera > espera_maxima:
+            await reserva.cancelar()
+            raise LimiteTaxaExcedido(
+                f"Limite de taxa de {nome} exigiria {espera:.1f}s de espera "
+                f"(campanha={campanha_id})"
+            )
+
+        if espera > 0:
+            logger.info(f"Limite de taxa de {nome} próximo; aguardando {espera:.2f}s (campanha={campanha_id})")
+            try:
+                await asyncio.sleep(espera)
+            except asyncio.CancelledError:
+                await reserva.cancelar()
+                raise
+
+        return reserva
+
+
+def _chave_total_mensal(campanha_id: int) -> str:
+    return f"ia_gm:custo:{campanha_id}:{timezone.localdate():%Y%m}"
+
+
+# Custos são acumulados no cache em micro-dólares para permitir incr atômico
+MICRO = 1_000_000
+
+
+async def registrar_custo_campanha(campanha_id: int, provedor: str, tokens: int, custo: float):
+    """Lança o custo de uma geração no livro-razão da campanha (e no total mensal em cache)"""
+    from .models import CustoCampanhaIA
+
+    custo_decimal = Decimal(str(custo or 0))
+    hoje = timezone.localdate()
+
+    lancamento = CustoCampanhaIA.objects.filter(campanha_id=campanha_id, provedor=provedor, data=hoje)
+    incrementos = {
+        'requisicoes': F('requisicoes') + 1,
+        'tokens_usados': F('tokens_usados') + tokens,
+        'custo_estimado': F('custo_estimado') + custo_decimal,
+        'atualizado_em': timezone.now(),
+    }
+
+    try:
+        if not await lancamento.aupdate(**incrementos):
+            _, criado = await CustoCampanhaIA.objects.aget_or_create(
+                campanha_id=campanha_id, provedor=provedor, data=hoje,
+                defaults={'requisicoes': 1, 'tokens_usados': tokens, 'custo_estimado': custo_decimal}
+            )
+            if not criado:
+                # Outro worker criou a linha entre o update e o create
+                await lancamento.aupdate(**incrementos)
+    except Exception as e:
+        logger.error(f"Falha ao registrar custo de IA da campanha {campanha_id}: {e}")
+        return
+
+    try:
+        cache_ia = obter_cache_ia()
+        chave = _chave_total_mensal(campanha_id)
+        if await cache_ia.aget(chave) is not None:
+            await cache_ia.aincr(chave, int(custo_decimal * MICRO))
+    except Exception as e:
+        logger.debug(f"Falha ao atualizar total mensal de custo em cache: {e}")
+
+
+async def obter_custo_mensal_campanha(campanha_id: int) -> Decimal:
+    """
+    Custo estimado acumulado da campanha no mês corrente
+
+    O total em cache recebe os incrementos de registrar_custo_campanha, mas
+    custos lançados entre a agregação e a gravação do total se perdem; por
+    isso ele expira em IA_GM_CUSTO_CACHE_TTL segundos e é refeito do livro-razão.
+    """
+    from .models import CustoCampanhaIA
+
+    cache_ia = obter_cache_ia()
+    chave = _chave_total_mensal(campanha_id)
+    try:
+        micro = await cache_ia.aget(chave)
+        if micro is not None:
+            return Decimal(micro) / MICRO
+    except Exception:
+        pass
+
+    inicio_mes = timezone.localdate().replace(day=1)
+    agregado = await CustoCampanhaIA.objects.filter(
+        campanha_id=campanha_id, data__gte=inicio_mes
+    ).aaggregate(total=Sum('custo_estimado'))
+    total = agregado['total'] or Decimal('0')
+
+    try:
+        await cache_ia.aadd(chave, int(total * MICRO), timeout=getattr(settings, 'IA_GM_CUSTO_CACHE_TTL', 60))
+    except Exception:
+        pass
+    return total
+
+
+async def verificar_orcamento_campanha(campanha_id: int):
+    """Levanta OrcamentoExcedido se a campanha já gastou IA_GM_ORCAMENTO_MENSAL_CAMPANHA"""
+    orcamento = getattr(settings, 'IA_GM_ORCAMENTO_MENSAL_CAMPANHA', 0)
+    if not orcamento:
+        return
+
+    gasto = await obter_custo_mensal_campanha(campanha_id)
+    if gasto >= Decimal(str(orcamento)):
+        raise OrcamentoExcedido(
+            f"Campanha {campanha_id} atingiu o orçamento mensal de IA "
+            f"(US$ {gasto:.2f} de US$ {orcamento:.2f})"
+        )
@@ -0,0 +1,177 @@
+"""
+Resiliência das chamadas aos provedores de IA
+Circuit breaker por provedor (estado compartilhado entre workers via cache)
+e timeouts adaptativos derivados de um histograma de latência móvel
+"""
+
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def obter_cache_ia():
+    """Cache compartilhado de IA (import tardio: ai_client depende deste módulo)"""
+    from .ai_client import obter_cache_ia as _obter_cache_ia
+    return _obter_cache_ia()
+
+
+class HistogramaLatencia:
+    """Janela móvel das latências recentes (em segundos) de um provedor"""
+
+    __slots__ = ('amostras',)
+
+    def __init__(self, tamanho_janela: int = 200):
+        self.amostras = deque(maxlen=tamanho_janela)
+
+    def registrar(self, latencia: float):
+        self.amostras.append(latencia)
+
+    def percentil(self, p: float) -> Optional[float]:
+        """Percentil p (0-100) da janela, ou None se ainda não há amostras"""
+        if not self.amostras:
+            return None
+        ordenadas = sorted(self.amostras)
+        indice = max(0, math.ceil(p / 100 * len(ordenadas)) - 1)
+        return ordenadas[indice]
+
+    def __len__(self):
+        return len(self.amostras)
+
+
+class ControleTimeout:
+    """Timeout por provedor: p99 da latência recente com folga, limitado a [mínimo, máximo]"""
+
+    MULTIPLICADOR = 2.0
+    AMOSTRAS_MINIMAS = 20
+
+    def __init__(self):
+        self.histogramas: Dict[str, HistogramaLatencia] = {}
+
+    def _histograma(self, nome: str) -> HistogramaLatencia:
+        if nome not in self.histogramas:
+            self.histogramas[nome] = HistogramaLatencia()
+        return self.histogramas[nome]
+
+    def registrar(self, nome: str, latencia: float):
+        self._histograma(nome).registrar(latencia)
+
+    def percentil(self, nome: str, p: float) -> Optional[float]:
+        """Percentil da latência do provedor, só quando há amostras suficientes"""
+        histograma = self._histograma(nome)
+        if len(histograma) < self.AMOSTRAS_MINIMAS:
+            return None
+        return histograma.percentil(p)
+
+    def timeout(self, nome: str) -> float:
+        """Timeout (s) a aplicar na próxima chamada ao provedor"""
+        minimo = getattr(settings, 'IA_GM_TIMEOUT_MINIMO', 5.0)
+        maximo = getattr(settings, 'IA_GM_TIMEOUT_MAXIMO', 120.0)
+
+        p99 = self.percentil(nome, 99)
+        if p99 is None:
+            return getattr(settings, 'IA_GM_TIMEOUT_PADRAO', 60.0)
+
+        return min(maximo, max(minimo, p99 * self.MULTIPLICADOR))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um provedor (fechado/aberto/meio-aberto)
+
+    O estado vive no cache de IA, então todos os workers enxergam o mesmo
+    circuito: após IA_GM_CIRCUITO_LIMIAR_FALHAS falhas dentro da janela, o
+    provedor é pulado por IA_GM_CIRCUITO_TEMPO_ABERTO segundos; depois disso
+    uma única requisição de sonda decide se o circuito fecha ou reabre.
+    """
+
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.chave_falhas = f"ia_gm:circuito:{nome}:falhas"
+        self.chave_aberto_ate = f"ia_gm:circuito:{nome}:aberto_ate"
+        self.chave_sonda = f"ia_gm:circuito:{nome}:sonda"
+
+    @property
+    def limiar_falhas(self) -> int:
+        return getattr(settings, 'IA_GM_CIRCUITO_LIMIAR_FALHAS', 5)
+
+    @property
+    def janela(self) -> int:
+        return getattr(settings, 'IA_GM_CIRCUITO_JANELA', 60)
+
+    @property
+    def tempo_aberto(self) -> int:
+        return getattr(settings, 'IA_GM_CIRCUITO_TEMPO_ABERTO', 30)
+
+    @classmethod
+    def _estado_de(cls, aberto_ate: Optional[float]) -> str:
+        if aberto_ate is None:
+            return cls.FECHADO
+        return cls.ABERTO if time.time() < aberto_ate else cls.MEIO_ABERTO
+
+    async def pode_tentar(self) -> bool:
+        """Se o provedor pode ser chamado agora (no meio-aberto, só a primeira sonda passa)"""
+        cache_ia = obter_cache_ia()
+        try:
+            estado = self._estado_de(await cache_ia.aget(self.chave_aberto_ate))
+            if estado == self.FECHADO:
+                return True
+            if estado == self.ABERTO:
+                return False
+            # Meio-aberto: add é atômico, apenas um worker ganha a sonda
+            return await cache_ia.aadd(self.chave_sonda, 1, timeout=self.tempo_aberto)
+        except Exception as e:
+            # Cache fora do ar não deve derrubar a geração
+            logger.debug(f"Circuit breaker de {self.nome} indisponível: {e}")
+            return True
+
+    async def registrar_sucesso(self):
+        """Fecha o circuito e zera a contagem de falhas"""
+        try:
+            await obter_cache_ia().adelete_many(
+                [self.chave_falhas, self.chave_aberto_ate, self.chave_sonda]
+            )
+        except Exception as e:
+            logger.debug(f"Circuit breaker de {self.nome} indisponível: {e}")
+
+    async def registrar_falha(self):
+        """Conta a falha e abre o circuito ao atingir o limiar (ou se a sonda falhou)"""
+        cache_ia = obter_cache_ia()
+        try:
+            estado = self._estado_de(await cache_ia.aget(self.chave_aberto_ate))
+            if estado == self.MEIO_ABERTO:
+                await self._abrir(cache_ia)
+                return
+
+            await cache_ia.aadd(self.chave_falhas, 0, timeout=self.janela)
+            falhas = await cache_ia.aincr(self.chave_falhas)
+            if falhas >= self.limiar_falhas and estado == self.FECHADO:
+                await self._abrir(cache_ia)
+        except Exception as e:
+            logger.debug(f"Circuit breaker de {self.nome} indisponível: {e}")
+
+    async def _abrir(self, cache_ia):
+        await cache_ia.aset(self.chave_aberto_ate, time.time() + self.tempo_aberto, timeout=None)
+        await cache_ia.adelete_many([self.chave_falhas, self.chave_sonda])
+        logger.warning(f"Circuito do provedor {self.nome} aberto por {self.tempo_aberto}s")
+
+    def estado(self) -> Dict[str, Any]:
+        """Estado atual do circuito (para estatísticas)"""
+        try:
+            valores = obter_cache_ia().get_many([self.chave_falhas, self.chave_aberto_ate])
+        except Exception:
+            valores = {}
+
+        return {
+            'estado': self._estado_de(valores.get(self.chave_aberto_ate)),
+            'falhas_recentes': valores.get(self.chave_falhas, 0),
+        }
@@ -0,0 +1,11 @@
+"""
+Roteamento WebSocket das sessões de jogo
+"""
+
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    # Status e resultados de turno de uma sessão de jogo
+    re_path(r'ws/sessao/(?P<sessao_id>\d+)/$', consumers.SessaoJogoConsumer.as_asgi()),
+]
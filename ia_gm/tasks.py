@@ -0,0 +1,54 @@
+"""
+Tarefas Celery do Arquiteto de Mundos
+Executadas na fila 'ia_gm' (ver unified_chronicles/celery.py)
+"""
+
+import logging
+from celery import shared_task
+
+from .models import SessaoIA
+from .game_session_manager import GameSessionManager
+from .memory_manager import get_memory_manager
+
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='ia_gm.tasks.processar_turno_ia', bind=True, acks_late=True, max_retries=3)
+def processar_turno_ia(self, sessao_id: int, numero_turno: int):
+    """
+    Resolve um turno completo (narrativa + nova situação) fora do ciclo da requisição
+
+    O resultado é publicado no grupo de canais da sessão pelo GameSessionManager.
+    Falhas são repetidas com espera crescente (o retry mantém o id da tarefa,
+    que já reivindicou o turno); esgotadas as tentativas, o turno volta a
+    aguardar ações em vez de ficar preso em processamento.
+    """
+    try:
+        sessao = SessaoIA.objects.select_related('campanha').get(id=sessao_id)
+    except SessaoIA.DoesNotExist:
+        logger.warning(f"Sessão {sessao_id} não encontrada ao resolver turno {numero_turno}")
+        return None
+
+    manager = GameSessionManager(sessao)
+    try:
+        return manager.resolver_turno(numero_turno, job_id=self.request.id)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"Falha ao resolver turno {numero_turno} da sessão {sessao_id}: {e}; nova tentativa")
+            raise self.retry(exc=e, countdown=5 * 2 ** self.request.retries)
+        logger.error(f"Turno {numero_turno} da sessão {sessao_id} falhou após {self.request.retries} tentativas: {e}")
+        manager.liberar_turno(numero_turno, job_id=self.request.id)
+        return None
+
+
+@shared_task(name='ia_gm.tasks.compactar_memoria_sessao')
+def compactar_memoria_sessao(sessao_id: int):
+    """Condensa as interações antigas da sessão em resumos (ver MemoryManager)"""
+    try:
+        sessao = SessaoIA.objects.select_related('campanha').get(id=sessao_id)
+    except SessaoIA.DoesNotExist:
+        logger.warning(f"Sessão {sessao_id} não encontrada ao compactar memória")
+        return 0
+
+    return get_memory_manager().compactar_memoria(sessao)
@@ -1,3 +1,1385 @@
-from django.test import TestCase
+"""
+Testes do Arquiteto de Mundos (cliente de IA e gerenciamento de sessão)
+"""
 
-# Create your tests here.
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.cache.backends.redis import RedisCache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from campanhas.models import Campanha
+from personagens.models import Personagem
+from sistema_unificado.models import SistemaJogo
+
+from mensagens.utils import transmitir_narrativa_para_chat
+from .ai_client import (
+    AnthropicProvider, BaseIAProvider, IAClient, LocalProvider, OpenAIProvider, RespostaIA, obter_cache_ia
+)
+from .content_generators import ArquitetoDeMundosOrchestrator
+from .conversation import Conversa
+from .game_session_manager import (
+    AcaoJogador, EstadoTurno, FaseJogo, GameSessionManager,
+    codificar_estado_turno, decodificar_estado_turno, grupo_sessao
+)
+from .master_rules import MasterRulesEngine, ModoOperacao, obter_modo_operacao_sessao
+from .memory_index import descartar_indices, obter_indice
+from .memory_manager import MemoryManager
+from .models import (
+    CustoCampanhaIA, EstadoTurnoSessao, InteracaoIA, MemoriaLongoPrazo, NPCGerado, ResumoNarrativo, SessaoIA
+)
+from .prompts import ArquitetoDeMundosPrompts, MontadorPrompt, PromptGenerator
+from .routing import websocket_urlpatterns
+from .tasks import processar_turno_ia
+from .rate_limiter import (
+    LimitadorTaxa, LimiteTaxaExcedido, OrcamentoExcedido, ReservaTaxa, TokenBucket, obter_custo_mensal_campanha
+)
+from .resilience import CircuitBreaker, ControleTimeout
+from .tokenizer import _contar_aproximado, contar_tokens, orcamento_prompt
+from .turn_store import ConflitoEstadoTurno
+
+
+class PoolConexoesProviderTestCase(SimpleTestCase):
+    """Testes do pool de conexões HTTP dos provedores de IA"""
+
+    def test_reutiliza_sessao_no_mesmo_loop(self):
+        """Chamadas no mesmo event loop compartilham o mesmo ClientSession"""
+        provedor = OpenAIProvider('chave-teste')
+
+        async def cenario():
+            primeira = provedor.session
+            segunda = provedor.session
+            self.assertIs(primeira, segunda)
+            await provedor.fechar()
+            self.assertTrue(primeira.closed)
+            self.assertEqual(len(provedor._sessoes), 0)
+
+        asyncio.run(cenario())
+
+    def test_sessao_separada_por_loop(self):
+        """Cada event loop recebe seu próprio pool de conexões"""
+        provedor = OpenAIProvider('chave-teste')
+        sessoes = []
+
+        async def cenario():
+            sessoes.append(provedor.session)
+            await provedor.fechar()
+
+        asyncio.run(cenario())
+        asyncio.run(cenario())
+        self.assertIsNot(sessoes[0], sessoes[1])
+
+    def test_limites_do_connector(self):
+        """Limites configurados por provedor chegam ao TCPConnector"""
+        provedor = LocalProvider('http://localhost:11434', 'llama2', limite_por_host=2)
+
+        async def cenario():
+            connector = provedor.session.connector
+            self.assertEqual(connector.limit, LocalProvider.LIMITE_CONEXOES)
+            self.assertEqual(connector.limit_per_host, 2)
+            await provedor.fechar()
+
+        asyncio.run(cenario())
+
+
+class RespostaHTTPFalsa:
+    """Resposta aiohttp mínima para os testes de provedor"""
+
+    def __init__(self, dados):
+        self.status = 200
+        self.dados = dados
+
+    async def json(self):
+        return self.dados
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class CachePromptProvedorTestCase(SimpleTestCase):
+    """Prefixo de sistema marcado para o cache de prompt do provedor"""
+
+    def gerar(self, provedor, dados):
+        sessao = mock.Mock()
+        sessao.post.return_value = RespostaHTTPFalsa(dados)
+        with mock.patch.object(type(provedor), 'session', new_callable=mock.PropertyMock, return_value=sessao):
+            resposta = asyncio.run(provedor.gerar_conteudo('Turno 3', sistema='Regras do Mestre'))
+        return resposta, sessao.post.call_args.kwargs['json']
+
+    def test_anthropic_marca_sistema_e_registra_tokens_em_cache(self):
+        provedor = AnthropicProvider('chave-teste')
+        resposta, payload = self.gerar(provedor, {
+            'content': [{'text': 'A ponte range.'}],
+            'usage': {'input_tokens': 100, 'output_tokens': 50,
+                      'cache_read_input_tokens': 1000, 'cache_creation_input_tokens': 0},
+        })
+
+        self.assertEqual(payload['system'], [
+            {'type': 'text', 'text': 'Regras do Mestre', 'cache_control': {'type': 'ephemeral'}}
+        ])
+        self.assertEqual(payload['messages'], [{'role': 'user', 'content': 'Turno 3'}])
+        self.assertEqual(resposta.metadata['cached_tokens'], 1000)
+        self.assertEqual(resposta.tokens_usados, 1150)
+        # Leitura do cache custa 10% da entrada normal
+        self.assertAlmostEqual(
+            resposta.metadata['custo_estimado'],
+            provedor.calcular_custo_estimado(200, 50)
+        )
+
+    def test_openai_sistema_primeiro_e_tokens_em_cache(self):
+        provedor = OpenAIProvider('chave-teste')
+        resposta, payload = self.gerar(provedor, {
+            'choices': [{'message': {'content': 'A ponte range.'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1100, 'completion_tokens': 50, 'total_tokens': 1150,
+                      'prompt_tokens_details': {'cached_tokens': 1024}},
+        })
+
+        self.assertEqual(payload['messages'][0], {'role': 'system', 'content': 'Regras do Mestre'})
+        self.assertIn('prompt_cache_key', payload)
+        self.assertEqual(resposta.metadata['cached_tokens'], 1024)
+        self.assertAlmostEqual(
+            resposta.metadata['custo_estimado'],
+            provedor.calcular_custo_estimado(76 + 512, 50)
+        )
+
+    @override_settings(IA_GM_CACHE_PROMPT_PROVEDOR=False)
+    def test_cache_de_prompt_desativado(self):
+        payload = AnthropicProvider('chave-teste')._montar_payload('Turno 3', sistema='Regras do Mestre')
+        self.assertNotIn('cache_control', payload['system'][0])
+        self.assertNotIn('prompt_cache_key', OpenAIProvider('chave-teste')._montar_payload('x', sistema='y'))
+
+
+class ProvedorFalso(BaseIAProvider):
+    """Provedor em memória para testar o IAClient sem rede"""
+
+    def __init__(self, pedacos=None, erro=None, atraso=0.0):
+        super().__init__('chave-teste', 'modelo-falso')
+        self.pedacos = pedacos or []
+        self.erro = erro
+        self.atraso = atraso
+        self.chamadas = 0
+        self.cancelado = False
+        self.ultima_chamada = None
+
+    async def gerar_conteudo(self, prompt, **kwargs):
+        self.chamadas += 1
+        self.ultima_chamada = (prompt, kwargs)
+        try:
+            await asyncio.sleep(self.atraso)
+        except asyncio.CancelledError:
+            self.cancelado = True
+            raise
+        if self.erro:
+            raise self.erro
+        return RespostaIA(conteudo=''.join(self.pedacos), tipo='texto', metadata={}, modelo=self.modelo)
+
+    async def gerar_conteudo_stream(self, prompt, **kwargs):
+        if self.erro:
+            raise self.erro
+        for pedaco in self.pedacos:
+            yield pedaco
+
+    def calcular_custo_estimado(self, tokens_entrada, tokens_saida):
+        return 0.0
+
+
+def criar_cliente(*provedores):
+    """Cria um IAClient com provedores falsos, sem depender de settings"""
+    return IAClient(provedores=list(provedores))
+
+
+async def coletar(iterador):
+    return [pedaco async for pedaco in iterador]
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class StreamingNarrativaTestCase(SimpleTestCase):
+    """Testes da entrega de narrativa em streaming"""
+
+    def test_fallback_antes_do_primeiro_pedaco(self):
+        """Provedor que falha antes de entregar texto cede lugar ao próximo"""
+        cliente = criar_cliente(
+            ('openai', ProvedorFalso(erro=Exception('fora do ar'))),
+            ('local', ProvedorFalso(pedacos=['Era ', 'uma ', 'vez'])),
+        )
+
+        pedacos = asyncio.run(coletar(cliente.gerar_conteudo_stream('prompt')))
+        self.assertEqual(pedacos, ['Era ', 'uma ', 'vez'])
+
+    def test_transmite_pedacos_para_grupo_da_sala(self):
+        """Os pedaços chegam ao grupo chat_sala_{id} e o último evento é final"""
+        async def pedacos():
+            for pedaco in ['A porta ', 'range.']:
+                yield pedaco
+
+        async def cenario():
+            layer = get_channel_layer()
+            canal = await layer.new_channel()
+            await layer.group_add('chat_sala_7', canal)
+
+            texto = await transmitir_narrativa_para_chat(7, pedacos())
+
+            eventos = []
+            while True:
+                evento = await layer.receive(canal)
+                eventos.append(evento)
+                if evento['final']:
+                    break
+            return texto, eventos
+
+        texto, eventos = asyncio.run(cenario())
+        self.assertEqual(texto, 'A porta range.')
+        self.assertTrue(all(e['type'] == 'narrative_chunk' for e in eventos))
+        self.assertEqual(''.join(e['conteudo'] for e in eventos), texto)
+        self.assertEqual(len({e['stream_id'] for e in eventos}), 1)
+
+
+class ConversaSessaoTestCase(SimpleTestCase):
+    """Histórico de mensagens estruturadas mantido por sessão"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+
+    def test_acrescenta_so_o_turno_novo(self):
+        provedor = ProvedorFalso(pedacos=['A ponte desaba.'])
+        cliente = criar_cliente(('openai', provedor))
+
+        asyncio.run(cliente.conversar(1, 'Turno 1: Aria atravessa a ponte', contexto='RESUMO: ...'))
+        asyncio.run(cliente.conversar(1, 'Turno 2: Aria se agarra à corda', contexto='RESUMO: novo'))
+
+        prompt, kwargs = provedor.ultima_chamada
+        self.assertEqual(prompt, 'RESUMO: novo\n\nTurno 2: Aria se agarra à corda')
+        self.assertEqual(kwargs['mensagens'], [
+            {'role': 'user', 'content': 'Turno 1: Aria atravessa a ponte'},
+            {'role': 'assistant', 'content': 'A ponte desaba.'},
+        ])
+        self.assertEqual(len(Conversa.carregar(1)), 4)
+        self.assertEqual(len(Conversa.carregar(2)), 0)
+
+    def test_apara_turnos_antigos_pelo_inicio(self):
+        conversa = Conversa(1)
+        for numero in range(3):
+            conversa.adicionar('user', f'Turno {numero}: ' + 'ação ' * 20)
+            conversa.adicionar('assistant', 'resposta ' * 20)
+
+        removidas = conversa.aparar(conversa.tokens - 1)
+
+        self.assertEqual(removidas, 2)
+        self.assertEqual(conversa.historico()[0]['role'], 'user')
+        self.assertTrue(conversa.historico()[0]['content'].startswith('Turno 1'))
+
+    def test_anthropic_marca_fim_do_historico_para_cache(self):
+        historico = [{'role': 'user', 'content': 'Turno 1'}, {'role': 'assistant', 'content': 'A ponte desaba.'}]
+        payload = AnthropicProvider('chave-teste')._montar_payload('Turno 2', mensagens=historico)
+
+        self.assertEqual(payload['messages'][1]['content'][0]['cache_control'], {'type': 'ephemeral'})
+        self.assertEqual(payload['messages'][2], {'role': 'user', 'content': 'Turno 2'})
+        self.assertEqual(historico[1]['content'], 'A ponte desaba.')
+
+
+class CachePromptTestCase(SimpleTestCase):
+    """Testes do cache de prompts endereçado por conteúdo"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+
+    def test_chave_estavel_e_normalizada(self):
+        """Parâmetros omitidos, padrão explícito e int/float geram a mesma chave"""
+        chave = IAClient.gerar_chave_cache('openai', 'gpt-4', 'Descreva a taverna')
+        self.assertEqual(chave, IAClient.gerar_chave_cache(
+            'openai', 'gpt-4', 'Descreva a taverna  ', temperature=0.8, max_tokens=2000.0
+        ))
+        self.assertTrue(chave.startswith('ia_gm:prompt:'))
+        self.assertEqual(len(chave.rsplit(':', 1)[1]), 64)
+
+    def test_chave_distingue_modelo_e_parametros(self):
+        """Modelo, provedor e temperatura diferentes não compartilham cache"""
+        base = IAClient.gerar_chave_cache('openai', 'gpt-4', 'prompt')
+        self.assertNotEqual(base, IAClient.gerar_chave_cache('openai', 'gpt-4-turbo', 'prompt'))
+        self.assertNotEqual(base, IAClient.gerar_chave_cache('anthropic', 'gpt-4', 'prompt'))
+        self.assertNotEqual(base, IAClient.gerar_chave_cache('openai', 'gpt-4', 'prompt', temperature=0.2))
+
+    def test_segunda_chamada_vem_do_cache(self):
+        """Prompt repetido é servido do cache e contabilizado como acerto"""
+        provedor = ProvedorFalso(pedacos=['Uma névoa cobre a estrada.'])
+        chamadas = []
+        gerar_original = provedor.gerar_conteudo
+
+        async def gerar_contando(prompt, **kwargs):
+            chamadas.append(prompt)
+            return await gerar_original(prompt, **kwargs)
+
+        provedor.gerar_conteudo = gerar_contando
+        cliente = criar_cliente(('openai', provedor))
+
+        async def cenario():
+            primeira = await cliente.gerar_conteudo('prompt repetido')
+            segunda = await cliente.gerar_conteudo('prompt repetido')
+            return primeira, segunda
+
+        primeira, segunda = asyncio.run(cenario())
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(cliente.obter_estatisticas_cache()['acertos'], 1)
+        self.assertEqual(cliente.obter_estatisticas_cache()['falhas'], 1)
+
+
+@override_settings(IA_GM_HEDGE_LIMIAR=0.05)
+class HedgeProvedoresTestCase(SimpleTestCase):
+    """Testes do modo de requisições "hedged" entre provedores"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+
+    def test_secundario_rapido_vence_e_primario_e_cancelado(self):
+        """Primário lento dispara o secundário; a resposta mais rápida vence"""
+        lento = ProvedorFalso(pedacos=['lento'], atraso=5)
+        rapido = ProvedorFalso(pedacos=['rápido'])
+        cliente = criar_cliente(('openai', lento), ('local', rapido))
+
+        resultado = asyncio.run(cliente.gerar_conteudo('prompt', usar_cache=False, hedge=True))
+        self.assertEqual(resultado['provedor'], 'local')
+        self.assertEqual(resultado['conteudo'], 'rápido')
+        self.assertTrue(lento.cancelado)
+
+    def test_primario_rapido_nao_dispara_secundario(self):
+        """Se o primário responde dentro do limiar, o secundário nem é chamado"""
+        primario = ProvedorFalso(pedacos=['ok'])
+        secundario = ProvedorFalso(pedacos=['extra'])
+        cliente = criar_cliente(('openai', primario), ('local', secundario))
+
+        resultado = asyncio.run(cliente.gerar_conteudo('prompt', usar_cache=False, hedge=True))
+        self.assertEqual(resultado['provedor'], 'openai')
+        self.assertEqual(secundario.chamadas, 0)
+
+    def test_falha_do_primario_dispara_proximo_sem_esperar(self):
+        """Erro no primário aciona o fallback imediatamente"""
+        cliente = criar_cliente(
+            ('openai', ProvedorFalso(erro=Exception('fora do ar'))),
+            ('local', ProvedorFalso(pedacos=['fallback'])),
+        )
+
+        resultado = asyncio.run(cliente.gerar_conteudo('prompt', usar_cache=False, hedge=True))
+        self.assertEqual(resultado['provedor'], 'local')
+
+
+@override_settings(IA_GM_CIRCUITO_LIMIAR_FALHAS=2, IA_GM_CIRCUITO_TEMPO_ABERTO=30)
+class CircuitBreakerTestCase(SimpleTestCase):
+    """Testes do circuit breaker e dos timeouts adaptativos"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+
+    def test_provedor_com_circuito_aberto_e_pulado(self):
+        """Após o limiar de falhas o provedor deixa de ser chamado"""
+        quebrado = ProvedorFalso(erro=Exception('503'))
+        reserva = ProvedorFalso(pedacos=['ok'])
+        cliente = criar_cliente(('openai', quebrado), ('local', reserva))
+
+        async def cenario():
+            for _ in range(3):
+                await cliente.gerar_conteudo('prompt', usar_cache=False)
+
+        asyncio.run(cenario())
+        self.assertEqual(quebrado.chamadas, 2)
+        self.assertEqual(reserva.chamadas, 3)
+        self.assertEqual(cliente._circuito('openai').estado()['estado'], CircuitBreaker.ABERTO)
+
+    def test_meio_aberto_libera_uma_sonda_e_fecha_no_sucesso(self):
+        """Expirado o tempo aberto, uma única sonda passa e o sucesso fecha o circuito"""
+        circuito = CircuitBreaker('openai')
+
+        async def cenario():
+            await circuito.registrar_falha()
+            await circuito.registrar_falha()
+            self.assertFalse(await circuito.pode_tentar())
+
+            await obter_cache_ia().aset(circuito.chave_aberto_ate, 0, timeout=None)
+            self.assertTrue(await circuito.pode_tentar())
+            self.assertFalse(await circuito.pode_tentar())
+
+            await circuito.registrar_sucesso()
+            self.assertTrue(await circuito.pode_tentar())
+
+        asyncio.run(cenario())
+        self.assertEqual(circuito.estado()['estado'], CircuitBreaker.FECHADO)
+
+    @override_settings(IA_GM_TIMEOUT_MINIMO=0.01)
+    def test_timeout_adaptativo_pelo_histograma(self):
+        """Com amostras suficientes o timeout segue o p99 observado; sem elas, o padrão"""
+        controle = ControleTimeout()
+        with self.settings(IA_GM_TIMEOUT_PADRAO=60.0):
+            self.assertEqual(controle.timeout('openai'), 60.0)
+
+        for _ in range(ControleTimeout.AMOSTRAS_MINIMAS):
+            controle.registrar('openai', 0.02)
+        self.assertAlmostEqual(controle.timeout('openai'), 0.02 * ControleTimeout.MULTIPLICADOR)
+
+    @override_settings(IA_GM_TIMEOUT_PADRAO=0.05)
+    def test_provedor_lento_estoura_timeout_e_cai_no_fallback(self):
+        """Chamada que excede o timeout conta como falha e passa ao próximo provedor"""
+        lento = ProvedorFalso(pedacos=['lento'], atraso=5)
+        cliente = criar_cliente(('openai', lento), ('local', ProvedorFalso(pedacos=['ok'])))
+
+        resultado = asyncio.run(cliente.gerar_conteudo('prompt', usar_cache=False))
+        self.assertEqual(resultado['provedor'], 'local')
+        self.assertTrue(lento.cancelado)
+        self.assertEqual(cliente._circuito('openai').estado()['falhas_recentes'], 1)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """Testes da coalescência de prompts idênticos em andamento"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+
+    def test_prompts_identicos_simultaneos_chamam_provedor_uma_vez(self):
+        """Seguidores recebem o resultado do líder sem nova chamada ao provedor"""
+        provedor = ProvedorFalso(pedacos=['Sugestão única'], atraso=0.05)
+        cliente = criar_cliente(('openai', provedor))
+
+        async def cenario():
+            return await asyncio.gather(*[
+                cliente.gerar_conteudo('mesmo prompt', usar_cache=False) for _ in range(5)
+            ])
+
+        resultados = asyncio.run(cenario())
+        self.assertEqual(provedor.chamadas, 1)
+        self.assertTrue(all(r['conteudo'] == 'Sugestão única' for r in resultados))
+        self.assertEqual(cliente.requisicoes_coalescidas, 4)
+
+    def test_falha_do_lider_propaga_aos_seguidores(self):
+        """Erro do líder chega a todos os que aguardavam o mesmo prompt"""
+        provedor = ProvedorFalso(erro=Exception('fora do ar'), atraso=0.05)
+        cliente = criar_cliente(('openai', provedor))
+
+        async def cenario():
+            return await asyncio.gather(*[
+                cliente.gerar_conteudo('mesmo prompt', usar_cache=False) for _ in range(3)
+            ], return_exceptions=True)
+
+        resultados = asyncio.run(cenario())
+        self.assertEqual(provedor.chamadas, 1)
+        self.assertTrue(all(isinstance(r, Exception) for r in resultados))
+
+    def test_sem_coalescer_cada_chamada_vai_ao_provedor(self):
+        """coalescer=False mantém chamadas independentes"""
+        provedor = ProvedorFalso(pedacos=['ok'], atraso=0.01)
+        cliente = criar_cliente(('openai', provedor))
+
+        async def cenario():
+            await asyncio.gather(*[
+                cliente.gerar_conteudo('mesmo prompt', usar_cache=False, coalescer=False)
+                for _ in range(3)
+            ])
+
+        asyncio.run(cenario())
+        self.assertEqual(provedor.chamadas, 3)
+
+    @override_settings(IA_GM_SINGLE_FLIGHT_DISTRIBUIDO=True, IA_GM_SINGLE_FLIGHT_INTERVALO=0.01)
+    def test_seguidor_de_outro_worker_le_resultado_do_cache(self):
+        """Com o lock distribuído, outro processo aguarda e lê o resultado gravado pelo líder"""
+        lider = criar_cliente(('openai', ProvedorFalso(pedacos=['do líder'], atraso=0.05)))
+        provedor_seguidor = ProvedorFalso(pedacos=['do seguidor'])
+        seguidor = criar_cliente(('openai', provedor_seguidor))
+
+        async def cenario():
+            return await asyncio.gather(
+                lider.gerar_conteudo('prompt compartilhado'),
+                seguidor.gerar_conteudo('prompt compartilhado'),
+            )
+
+        primeiro, segundo = asyncio.run(cenario())
+        self.assertEqual(segundo['conteudo'], 'do líder')
+        self.assertEqual(provedor_seguidor.chamadas, 0)
+
+
+class RedisFalso:
+    """Cliente Redis mínimo: executa o script do balde com a mesma aritmética do Lua"""
+
+    def __init__(self):
+        self.valores = {}
+
+    def register_script(self, script):
+        def executar(keys, args):
+            agora = time.time()
+            tat = max(self.valores.get(keys[0], 0), agora)
+            tat = max(tat + float(args[0]), agora)
+            self.valores[keys[0]] = tat
+            return f'{max(0, tat - agora - float(args[1])):.6f}'.encode()
+        return executar
+
+
+class LimitadorTaxaTestCase(SimpleTestCase):
+    """Testes do token bucket por provedor e por campanha"""
+
+    def test_balde_enfileira_em_vez_de_rejeitar(self):
+        """Reservas além da capacidade recebem tempos de espera crescentes"""
+        balde = TokenBucket(60)  # 1 ficha por segundo
+        esperas = [balde.reservar(1) for _ in range(62)]
+        self.assertEqual(esperas[0], 0.0)
+        self.assertAlmostEqual(esperas[60], 1.0, places=1)
+        self.assertGreater(esperas[61], esperas[60])
+
+    @override_settings(
+        IA_GM_LIMITES_TAXA={},
+        IA_GM_LIMITES_TAXA_CAMPANHA={'requisicoes_por_minuto': 600},
+        IA_GM_LIMITE_ESPERA_MAXIMA=1.0
+    )
+    def test_limite_por_campanha_aguarda_e_isola_campanhas(self):
+        """Campanha no limite aguarda a reposição; outra campanha não é afetada"""
+        limitador = LimitadorTaxa()
+
+        async def cenario():
+            for _ in range(600):
+                await limitador.adquirir('openai', 10, campanha_id=1)
+            loop = asyncio.get_running_loop()
+
+            inicio = loop.time()
+            await limitador.adquirir('openai', 10, campanha_id=2)
+            sem_espera = loop.time() - inicio
+
+            inicio = loop.time()
+            await limitador.adquirir('openai', 10, campanha_id=1)
+            return sem_espera, loop.time() - inicio
+
+        sem_espera, com_espera = asyncio.run(cenario())
+        self.assertLess(sem_espera, 0.05)
+        self.assertGreaterEqual(com_espera, 0.05)
+
+    @override_settings(
+        IA_GM_LIMITES_TAXA={'openai': {'tokens_por_minuto': 1000}},
+        IA_GM_LIMITE_ESPERA_MAXIMA=5.0
+    )
+    def test_espera_acima_do_maximo_rejeita_e_devolve_reserva(self):
+        """Só rejeita quando a fila passaria da espera máxima, sem consumir fichas"""
+        limitador = LimitadorTaxa()
+
+        async def cenario():
+            await limitador.adquirir('openai', 1000)
+            with self.assertRaises(LimiteTaxaExcedido):
+                await limitador.adquirir('openai', 1000)
+
+        asyncio.run(cenario())
+        balde = limitador.baldes[('provedor', 'openai', 'tokens')]
+        self.assertGreater(balde.saldo, -1)
+
+
+    def test_devolucao_limitada_ao_que_foi_reservado(self):
+        """Prompt maior que o balde não devolve fichas que nunca saíram dele"""
+        balde = TokenBucket(1000)
+        reserva = ReservaTaxa([], [balde], 5000)
+        balde.reservar(5000)
+
+        asyncio.run(reserva.ajustar_tokens(100))
+        self.assertAlmostEqual(balde.saldo, 900, delta=1)
+
+        asyncio.run(reserva.cancelar())
+        self.assertLessEqual(balde.saldo, 1000)
+
+    @override_settings(
+        IA_GM_LIMITES_TAXA={},
+        IA_GM_LIMITES_TAXA_CAMPANHA={'requisicoes_por_minuto': 60},
+        IA_GM_LIMITE_ESPERA_MAXIMA=5.0
+    )
+    def test_baldes_compartilhados_entre_processos(self):
+        """Com o cache 'ia_gm' no Redis, dois limitadores (dois workers) consomem o mesmo balde"""
+        redis = RedisFalso()
+        cache_redis = RedisCache('redis://localhost:6379', {'KEY_PREFIX': 'uc'})
+        with mock.patch('ia_gm.rate_limiter.obter_cache_ia', return_value=cache_redis), \
+                mock.patch.object(cache_redis._cache, 'get_client', return_value=redis):
+            workers = [LimitadorTaxa(), LimitadorTaxa()]
+
+            async def cenario():
+                for _ in range(60):
+                    await workers[0].adquirir('openai', 10, campanha_id=1)
+                # O balde do outro worker já está vazio: a próxima chamada espera ~1s
+                with mock.patch('ia_gm.rate_limiter.asyncio.sleep', new=mock.AsyncMock()) as dormir:
+                    reserva = await workers[1].adquirir('openai', 10, campanha_id=1)
+                    await reserva.cancelar()
+                return dormir
+
+            dormir = asyncio.run(cenario())
+
+        dormir.assert_awaited_once()
+        self.assertAlmostEqual(dormir.await_args.args[0], 1.0, places=1)
+        self.assertEqual(list(redis.valores), [cache_redis.make_key('ia_gm:taxa:campanha:1:openai:requisicoes')])
+
+
+class CustoCampanhaTestCase(TestCase):
+    """Testes do livro-razão e orçamento de custo por campanha"""
+
+    def setUp(self):
+        obter_cache_ia().clear()
+        organizador = get_user_model().objects.create_user(
+            username='mestre', email='mestre@unified-chronicles.local', password='teste123'
+        )
+        sistema = SistemaJogo.objects.create(nome='D&D 5e', codigo='dnd5e', versao='5.1')
+        self.campanha = Campanha.objects.create(
+            nome='Campanha de Teste', descricao='Teste', organizador=organizador, sistema_jogo=sistema
+        )
+
+    async def test_geracoes_acumulam_no_livro_razao(self):
+        """Cada geração soma requisições, tokens e custo na linha do dia"""
+        provedor = ProvedorFalso(pedacos=['texto'])
+        provedor.gerar_conteudo = self._resposta_com_custo(provedor, 0.0125, 150)
+        cliente = criar_cliente(('openai', provedor))
+
+        for _ in range(2):
+            await cliente.gerar_conteudo('prompt', usar_cache=False, campanha_id=self.campanha.id)
+
+        lancamento = await CustoCampanhaIA.objects.aget(campanha=self.campanha, provedor='openai')
+        self.assertEqual(lancamento.requisicoes, 2)
+        self.assertEqual(lancamento.tokens_usados, 300)
+        self.assertEqual(lancamento.custo_estimado, Decimal('0.025'))
+
+    @override_settings(IA_GM_ORCAMENTO_MENSAL_CAMPANHA=0.02)
+    async def test_orcamento_estourado_bloqueia_novas_geracoes(self):
+        """Depois de atingir o orçamento mensal a campanha não chama mais o provedor"""
+        provedor = ProvedorFalso(pedacos=['texto'])
+        provedor.gerar_conteudo = self._resposta_com_custo(provedor, 0.0125, 150)
+        cliente = criar_cliente(('openai', provedor))
+
+        await cliente.gerar_conteudo('primeiro', usar_cache=False, campanha_id=self.campanha.id)
+        await cliente.gerar_conteudo('segundo', usar_cache=False, campanha_id=self.campanha.id)
+        with self.assertRaises(OrcamentoExcedido):
+            await cliente.gerar_conteudo('terceiro', usar_cache=False, campanha_id=self.campanha.id)
+        self.assertEqual(provedor.chamadas, 2)
+
+    async def test_total_mensal_refeito_do_livro_razao(self):
+        """Um custo que escapou do total em cache entra na recarga seguinte (IA_GM_CUSTO_CACHE_TTL)"""
+        self.assertEqual(await obter_custo_mensal_campanha(self.campanha.id), 0)
+        # Lançado entre a agregação e a gravação do total: nenhum incr o viu
+        await CustoCampanhaIA.objects.acreate(
+            campanha=self.campanha, provedor='openai', requisicoes=1, tokens_usados=10,
+            custo_estimado=Decimal('0.5')
+        )
+        self.assertEqual(await obter_custo_mensal_campanha(self.campanha.id), 0)
+
+        depois_do_ttl = time.time() + settings.IA_GM_CUSTO_CACHE_TTL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=depois_do_ttl):
+            self.assertEqual(await obter_custo_mensal_campanha(self.campanha.id), Decimal('0.5'))
+
+    def test_view_responde_429_com_orcamento_estourado(self):
+        sessao = SessaoIA.objects.create(campanha=self.campanha, nome='Sessão 1', ativa=True)
+        self.client.force_login(self.campanha.organizador)
+
+        with mock.patch('ia_gm.views.get_ia_client'), \
+                mock.patch.object(ArquitetoDeMundosOrchestrator, '_gerar_conteudo_generico',
+                                  side_effect=OrcamentoExcedido('Orçamento mensal esgotado')):
+            resposta = self.client.post(
+                reverse('ia_gm:api_gerar_conteudo'),
+                {'sessao_id': sessao.id, 'tipo': 'LOCAL'}, content_type='application/json'
+            )
+
+        self.assertEqual(resposta.status_code, 429)
+        self.assertFalse(resposta.json()['sucesso'])
+
+    @staticmethod
+    def _resposta_com_custo(provedor, custo, tokens):
+        async def gerar(prompt, **kwargs):
+            provedor.chamadas += 1
+            return RespostaIA(
+                conteudo='texto', tipo='texto', metadata={'custo_estimado': custo},
+                tokens_usados=tokens, modelo=provedor.modelo
+            )
+        return gerar
+
+
+class OrcamentoPromptTestCase(SimpleTestCase):
+    """Testes da contagem de tokens e do corte de prompts ao orçamento"""
+
+    def test_contagem_aproximada(self):
+        """A aproximação conta pontuação e divide palavras longas"""
+        self.assertEqual(_contar_aproximado('Olá, mundo!'), 5)
+        self.assertEqual(_contar_aproximado('consequências'), 4)
+        self.assertEqual(contar_tokens(''), 0)
+
+    @override_settings(IA_GM_ORCAMENTO_PROMPT_MAXIMO=None, IA_GM_LIMITES_CONTEXTO={'meu-modelo': 1000})
+    def test_orcamento_por_modelo(self):
+        """Janela do modelo menos a resposta reservada, com prefixo mais longo vencendo"""
+        self.assertEqual(orcamento_prompt('gpt-4', 2000), 8192 - 2000 - 64)
+        self.assertEqual(orcamento_prompt('gpt-4-turbo-preview', 2000), 128000 - 2000 - 64)
+        self.assertEqual(orcamento_prompt('meu-modelo-7b', 500), 1000 - 500 - 64)
+        with self.settings(IA_GM_ORCAMENTO_PROMPT_MAXIMO=3000):
+            self.assertEqual(orcamento_prompt('claude-3-sonnet-20240229', 2000), 3000)
+
+    def test_corta_itens_menos_relevantes_primeiro(self):
+        """Perde primeiro o fim da lista de menor prioridade; seções fixas ficam"""
+        itens = [f'- interação {n} ' + 'palavra ' * 20 for n in range(10)]
+        montador = MontadorPrompt(orcamento_tokens=contar_tokens('INSTRUÇÕES FIXAS') + 60)
+        montador.adicionar('INSTRUÇÕES FIXAS')
+        montador.adicionar('descrição longa ' * 50, prioridade=1)
+        montador.adicionar_lista('RECENTE:', itens, prioridade=2)
+
+        prompt = montador.montar()
+        self.assertIn('INSTRUÇÕES FIXAS', prompt)
+        self.assertIn('interação 0', prompt)
+        self.assertNotIn('interação 9', prompt)
+        self.assertNotIn('descrição longa', prompt)
+        self.assertLessEqual(contar_tokens(prompt), montador.orcamento_tokens)
+
+    def test_sem_orcamento_nao_corta(self):
+        """Sem orçamento o prompt sai completo"""
+        contexto = {
+            'memorias': [
+                {'titulo': 'Traição', 'descricao': 'O duque mentiu', 'importancia': 5},
+                {'titulo': 'Chuva', 'descricao': 'Choveu na vila', 'importancia': 1},
+            ]
+        }
+        prompt = PromptGenerator.gerar_narrativa(contexto)
+        self.assertIn('Traição', prompt)
+        self.assertIn('Chuva', prompt)
+
+        contexto['orcamento_tokens'] = contar_tokens(prompt) - 3
+        prompt_cortado = PromptGenerator.gerar_narrativa(contexto)
+        self.assertIn('Traição', prompt_cortado)
+        self.assertNotIn('Chuva', prompt_cortado)
+
+
+class CodificacaoEstadoTurnoTestCase(SimpleTestCase):
+    """Testes do formato binário do estado do turno"""
+
+    def criar_estado(self):
+        return EstadoTurno(
+            numero_turno=3,
+            fase=FaseJogo.AGUARDANDO_ACOES,
+            descricao_situacao='Uma porta range.',
+            acoes_recebidas=[
+                AcaoJogador('Aria', 7, 'Abro a porta', datetime(2026, 10, 17, 12, 30, tzinfo=timezone.utc))
+            ],
+            personagens_esperados=['Aria', 'Borin'],
+            aguardando_personagens=['Borin'],
+            job_id='job-1',
+            versao=4,
+        )
+
+    def test_ida_e_volta(self):
+        """O estado decodificado é igual ao original, e compacto"""
+        estado = self.criar_estado()
+        dados = codificar_estado_turno(estado)
+
+        self.assertEqual(decodificar_estado_turno(dados, versao=4), estado)
+        self.assertLess(len(dados), 120)
+        self.assertFalse(hasattr(estado, '__dict__'))
+
+    def test_campos_futuros_sao_ignorados(self):
+        """Campos acrescentados no fim por versões novas não quebram a leitura"""
+        campos = msgpack.unpackb(codificar_estado_turno(self.criar_estado()), timestamp=3)
+        dados = msgpack.packb(campos + ['campo-novo'], datetime=True)
+
+        self.assertEqual(decodificar_estado_turno(dados).job_id, 'job-1')
+
+    def test_formato_desconhecido(self):
+        with self.assertRaises(ValueError):
+            decodificar_estado_turno(msgpack.packb([99, 1]))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class TurnoAssincronoTestCase(TestCase):
+    """Testes da resolução de turnos pela fila do Celery"""
+
+    def setUp(self):
+        cache.clear()
+        obter_cache_ia().clear()
+        # A camada de canais em memória é global; eventos de outros testes não devem vazar
+        async_to_sync(get_channel_layer().flush)()
+        User = get_user_model()
+        self.organizador = organizador = User.objects.create_user(username='mestre')
+        self.jogadores = [
+            User.objects.create_user(username=f'jogador{i}') for i in (1, 2)
+        ]
+        sistema = SistemaJogo.objects.create(nome='D&D 5e', codigo='dnd5e', versao='5.1')
+        campanha = Campanha.objects.create(
+            nome='Campanha de Teste', descricao='Teste', organizador=organizador, sistema_jogo=sistema
+        )
+        for jogador, nome in zip(self.jogadores, ['Aria', 'Borin']):
+            Personagem.objects.create(nome=nome, usuario=jogador, campanha=campanha, sistema_jogo=sistema)
+        self.sessao = SessaoIA.objects.create(campanha=campanha, nome='Sessão 1', ativa=True)
+
+        self.manager = GameSessionManager(self.sessao)
+        self.manager.ativar_modo_jogo()
+        self.manager.iniciar_aguardo_acoes('Uma porta range.')
+
+    def declarar_acoes(self):
+        self.manager.processar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+        with mock.patch('ia_gm.tasks.processar_turno_ia.delay') as delay:
+            delay.return_value.id = 'job-1'
+            resultado = self.manager.processar_entrada_jogador('Vigio o corredor', self.jogadores[1].id)
+        return resultado, delay
+
+    def test_nova_situacao_segue_conversa_da_sessao(self):
+        """Cada turno acrescenta ações e situação ao histórico enviado ao provedor"""
+        provedor = ProvedorFalso(pedacos=['O corredor escurece.'])
+        # O livro-razão de custo grava de outra thread; o SQLite de teste está travado pela transação
+        with mock.patch('ia_gm.ai_client.get_ia_client', return_value=criar_cliente(('openai', provedor))), \
+                mock.patch('ia_gm.ai_client.registrar_custo_campanha', new=mock.AsyncMock()):
+            primeira = self.manager.gerar_nova_situacao(2, ['Aria: Abro a porta'])
+            self.manager.gerar_nova_situacao(3, ['Borin: Acendo a tocha'])
+
+        self.assertTrue(primeira['gerada_por_ia'])
+        prompt, kwargs = provedor.ultima_chamada
+        self.assertIn('Borin: Acendo a tocha', prompt)
+        self.assertNotIn('CONTEXTO RECENTE', prompt)
+        self.assertIn('MODO DE JOGO ATIVO', kwargs['sistema'])
+        self.assertEqual([m['role'] for m in kwargs['mensagens']], ['user', 'assistant'])
+        self.assertIn('Aria: Abro a porta', kwargs['mensagens'][0]['content'])
+
+    def test_ultima_acao_enfileira_turno(self):
+        """A última ação retorna o id do job sem resolver o turno na requisição"""
+        resultado, delay = self.declarar_acoes()
+
+        delay.assert_called_once_with(self.sessao.id, 1)
+        self.assertTrue(resultado['turno_enfileirado'])
+        self.assertEqual(resultado['job_id'], 'job-1')
+        self.assertNotIn('narrativa_resultado', resultado)
+        self.assertEqual(self.manager._obter_estado_turno().fase, FaseJogo.PROCESSANDO_TURNO)
+
+    def test_resolver_turno_publica_no_grupo_da_sessao(self):
+        """O worker resolve o turno, publica o resultado e ignora reentregas"""
+        self.declarar_acoes()
+
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(grupo_sessao(self.sessao.id), 'canal-teste')
+
+        nova_situacao = {'situacao': 'Passos ecoam.', 'chamada_jogadores': '', 'gerada_por_ia': False}
+        with mock.patch.object(GameSessionManager, 'gerar_nova_situacao', return_value=nova_situacao):
+            resultado = GameSessionManager(self.sessao).resolver_turno(1, job_id='job-1')
+
+        self.assertTrue(resultado['turno_processado'])
+        self.assertEqual(resultado['acoes_processadas'], ['**Aria**: Abro a porta', '**Borin**: Vigio o corredor'])
+
+        evento = async_to_sync(layer.receive)('canal-teste')
+        self.assertEqual(evento['evento'], 'turno_processado')
+        self.assertEqual(evento['dados']['job_id'], 'job-1')
+
+        status = self.manager.obter_status_sessao()
+        self.assertEqual(status['turno_atual'], 2)
+        self.assertEqual(status['fase_atual'], FaseJogo.AGUARDANDO_ACOES.value)
+        self.assertEqual(status['ultimo_turno']['job_id'], 'job-1')
+
+        self.assertIsNone(GameSessionManager(self.sessao).resolver_turno(1, job_id='job-1'))
+
+    def test_worker_publica_estado_real_da_sessao(self):
+        """O worker não compartilha memória com o processo web: estado e resultado vêm do banco"""
+        self.declarar_acoes()
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(grupo_sessao(self.sessao.id), 'canal-teste')
+        cache.clear()
+
+        nova_situacao = {'situacao': 'Passos ecoam.', 'chamada_jogadores': '', 'gerada_por_ia': False}
+        with mock.patch.object(GameSessionManager, 'gerar_nova_situacao', return_value=nova_situacao):
+            GameSessionManager(SessaoIA.objects.get(id=self.sessao.id)).resolver_turno(1, job_id='job-1')
+
+        async_to_sync(layer.receive)('canal-teste')
+        status = async_to_sync(layer.receive)('canal-teste')
+        self.assertEqual(status['evento'], 'status_sessao')
+        self.assertEqual(status['dados']['estado_sessao'], 'ativa')
+
+        cache.clear()
+        self.assertEqual(self.manager.obter_status_sessao()['ultimo_turno']['job_id'], 'job-1')
+        self.assertEqual(obter_modo_operacao_sessao(self.sessao), ModoOperacao.JOGO)
+
+    def test_falha_na_tarefa_libera_o_turno(self):
+        """Esgotadas as tentativas, o turno volta a aguardar ações e a reivindicação é desfeita"""
+        self.declarar_acoes()
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(grupo_sessao(self.sessao.id), 'canal-teste')
+
+        with mock.patch.object(GameSessionManager, '_processar_turno_completo',
+                               side_effect=RuntimeError('provedor fora do ar')) as processar:
+            processar_turno_ia.apply(args=(self.sessao.id, 1), task_id='job-1')
+
+        self.assertEqual(processar.call_count, processar_turno_ia.max_retries + 1)
+        estado = self.manager._obter_estado_turno()
+        self.assertEqual(estado.numero_turno, 1)
+        self.assertEqual(estado.fase, FaseJogo.AGUARDANDO_ACOES)
+        self.assertIsNone(estado.job_id)
+        self.assertEqual(estado.aguardando_personagens, ['Aria', 'Borin'])
+
+        eventos = [async_to_sync(layer.receive)('canal-teste')['evento'] for _ in range(2)]
+        self.assertEqual(eventos, ['status_sessao', 'turno_falhou'])
+
+    def test_acoes_simultaneas_nao_se_perdem(self):
+        """Uma gravação concorrente entre a leitura e a escrita é reaplicada, não sobrescrita"""
+        concorrente = GameSessionManager(self.sessao)
+        registrar_original = GameSessionManager._registrar_acao_no_turno
+        chamadas = []
+
+        def registrar_com_concorrencia(acao, personagem, estado):
+            chamadas.append(personagem.nome)
+            if len(chamadas) == 1:
+                # Outro worker grava a ação de Borin depois da nossa leitura
+                concorrente.processar_entrada_jogador('Vigio o corredor', self.jogadores[1].id)
+            return registrar_original(acao, personagem, estado)
+
+        with mock.patch.object(self.manager, '_registrar_acao_no_turno', registrar_com_concorrencia), \
+                mock.patch('ia_gm.tasks.processar_turno_ia.delay') as delay:
+            delay.return_value.id = 'job-1'
+            resultado = self.manager.processar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+
+        self.assertEqual(chamadas, ['Aria', 'Aria'])
+        self.assertTrue(resultado['turno_enfileirado'])
+        delay.assert_called_once_with(self.sessao.id, 1)
+        self.assertCountEqual(
+            resultado['acoes_processadas'], ['**Aria**: Abro a porta', '**Borin**: Vigio o corredor']
+        )
+
+    def test_gravacao_com_versao_antiga_falha(self):
+        """O compare-and-set recusa versões desatualizadas"""
+        estado = self.manager._obter_estado_turno()
+        self.manager.armazem_turno.salvar(codificar_estado_turno(estado), estado.versao)
+
+        with self.assertRaises(ConflitoEstadoTurno):
+            self.manager.armazem_turno.salvar(codificar_estado_turno(estado), estado.versao)
+
+    def test_estado_lido_do_banco_em_cada_acesso(self):
+        """Uma gravação de outro processo (ex.: worker) vale na próxima ação, sem recusa por estado velho"""
+        self.declarar_acoes()
+        self.assertEqual(self.manager._obter_estado_turno().fase, FaseJogo.PROCESSANDO_TURNO)
+
+        # Outro processo devolve o turno aos jogadores gravando direto no banco
+        estado = self.manager._obter_estado_turno()
+        estado.fase = FaseJogo.AGUARDANDO_ACOES
+        estado.acoes_recebidas = []
+        estado.aguardando_personagens = ['Aria', 'Borin']
+        EstadoTurnoSessao.objects.filter(sessao=self.sessao).update(
+            estado=codificar_estado_turno(estado), versao=estado.versao + 1
+        )
+
+        resultado = self.manager.processar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+        self.assertIn('acao_confirmada', resultado)
+        estado = self.manager._obter_estado_turno()
+        self.assertEqual(estado.aguardando_personagens, ['Borin'])
+        self.assertEqual(estado.versao, EstadoTurnoSessao.objects.get(sessao=self.sessao).versao)
+
+    def test_interacoes_do_turno_gravadas_em_lote_antes_do_resultado(self):
+        """Ações não escrevem no caminho da requisição; o turno grava tudo antes de publicar"""
+        antes = InteracaoIA.objects.count()
+        self.declarar_acoes()
+        self.assertEqual(InteracaoIA.objects.count(), antes)
+
+        gravadas_ao_publicar = []
+        nova_situacao = {'situacao': 'Passos ecoam.', 'chamada_jogadores': '', 'gerada_por_ia': False}
+        with mock.patch.object(GameSessionManager, 'gerar_nova_situacao', return_value=nova_situacao), \
+                mock.patch('ia_gm.game_session_manager.notificar_sessao',
+                           side_effect=lambda *args: gravadas_ao_publicar.append(InteracaoIA.objects.count())), \
+                mock.patch.object(InteracaoIA.objects, 'bulk_create',
+                                  wraps=InteracaoIA.objects.bulk_create) as bulk_create:
+            GameSessionManager(self.sessao).resolver_turno(1, job_id='job-1')
+
+        bulk_create.assert_called_once()
+        self.assertEqual(gravadas_ao_publicar[0], antes + 3)
+        self.assertEqual(
+            list(InteracaoIA.objects.filter(tipo_interacao='ACAO_JOGADOR').order_by('id')
+                 .values_list('prompt_usuario', flat=True)),
+            ['Aria: Abro a porta', 'Borin: Vigio o corredor']
+        )
+
+    def test_turno_refeito_nao_duplica_interacoes_nem_conversa(self):
+        """Falha ao gravar o turno não deixa interações; a nova tentativa substitui o turno na conversa"""
+        self.declarar_acoes()
+        antes = InteracaoIA.objects.count()
+        provedor = ProvedorFalso(pedacos=['Passos ecoam.'])
+
+        with mock.patch('ia_gm.ai_client.get_ia_client', return_value=criar_cliente(('openai', provedor))), \
+                mock.patch('ia_gm.ai_client.registrar_custo_campanha', new=mock.AsyncMock()):
+            with mock.patch.object(InteracaoIA.objects, 'bulk_create', side_effect=DatabaseError('fora do ar')):
+                with self.assertRaises(DatabaseError):
+                    GameSessionManager(self.sessao).resolver_turno(1, job_id='job-1')
+
+            self.assertEqual(InteracaoIA.objects.count(), antes)
+            estado = self.manager._obter_estado_turno()
+            self.assertEqual((estado.numero_turno, estado.fase), (1, FaseJogo.PROCESSANDO_TURNO))
+
+            resultado = GameSessionManager(self.sessao).resolver_turno(1, job_id='job-1')
+
+        self.assertTrue(resultado['turno_processado'])
+        self.assertEqual(InteracaoIA.objects.filter(tipo_interacao='ACAO_JOGADOR').count(), 2)
+        self.assertEqual(InteracaoIA.objects.filter(tipo_interacao='NOVA_SITUACAO').count(), 1)
+        self.assertEqual(len(Conversa.carregar(self.sessao.id)), 2)
+
+    def test_encerrar_grava_acoes_de_turno_incompleto(self):
+        self.manager.processar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+        conversa = Conversa(self.sessao.id)
+        conversa.adicionar('user', 'Turno 1: Aria abre a porta')
+        conversa.salvar()
+        self.manager.encerrar_sessao()
+
+        self.assertEqual(len(Conversa.carregar(self.sessao.id)), 0)
+
+        interacao = InteracaoIA.objects.get(tipo_interacao='ACAO_JOGADOR')
+        self.assertEqual(interacao.usuario_id, self.jogadores[0].id)
+        self.assertEqual(interacao.contexto['turno'], 1)
+
+    def test_turno_reivindicado_nao_e_refeito_por_outra_tarefa(self):
+        """Uma segunda tarefa para o mesmo turno desiste enquanto a primeira o resolve"""
+        self.declarar_acoes()
+        self.manager._atualizar_estado_turno(lambda estado: setattr(estado, 'job_id', 'job-1'))
+
+        self.assertIsNone(GameSessionManager(self.sessao).resolver_turno(1, job_id='job-2'))
+        self.assertEqual(self.manager._obter_estado_turno().fase, FaseJogo.PROCESSANDO_TURNO)
+
+    async def test_api_assincrona_sem_acesso_sincrono_ao_banco(self):
+        """As versões `a*` funcionam num event loop com sessão carregada sem select_related"""
+        sessao = await SessaoIA.objects.aget(id=self.sessao.id)
+        manager = GameSessionManager(sessao)
+
+        ativacao = await manager.aativar_modo_jogo()
+        self.assertEqual(ativacao['personagens'], ['Aria', 'Borin'])
+        await manager.ainiciar_aguardo_acoes(ativacao['situacao'])
+
+        primeira = await manager.aprocessar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+        self.assertEqual(primeira['aguardando'], 'Borin')
+
+        with mock.patch('ia_gm.tasks.processar_turno_ia.delay') as delay:
+            delay.return_value.id = 'job-2'
+            segunda = await manager.aprocessar_entrada_jogador('Vigio o corredor', self.jogadores[1].id)
+
+        self.assertEqual(segunda['job_id'], 'job-2')
+        status = await manager.aobter_status_sessao()
+        self.assertEqual(status['fase_atual'], FaseJogo.PROCESSANDO_TURNO.value)
+        self.assertEqual(status['acoes_recebidas'], 2)
+
+    def test_view_status_verifica_participacao(self):
+        """A view assíncrona de status responde ao organizador e recusa quem não participa"""
+        url = reverse('ia_gm:api_status_sessao', args=[self.sessao.id])
+
+        self.client.force_login(self.organizador)
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['status']['fase_atual'], FaseJogo.AGUARDANDO_ACOES.value)
+
+        self.client.force_login(self.jogadores[0])
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_view_encerrar_publica_encerramento(self):
+        """A view encerra pelo manager: grava ações pendentes e avisa o grupo da sessão"""
+        self.manager.processar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(grupo_sessao(self.sessao.id), 'canal-teste')
+
+        self.client.force_login(self.organizador)
+        resposta = self.client.post(
+            reverse('ia_gm:api_encerrar_sessao'),
+            json.dumps({'sessao_id': self.sessao.id, 'resumo_final': 'A porta foi aberta.'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.json()['resultado']['sessao_encerrada'])
+        self.sessao.refresh_from_db()
+        self.assertFalse(self.sessao.ativa)
+        self.assertFalse(EstadoTurnoSessao.objects.filter(sessao=self.sessao).exists())
+        self.assertTrue(InteracaoIA.objects.filter(tipo_interacao='ACAO_JOGADOR').exists())
+
+        evento = async_to_sync(layer.receive)('canal-teste')
+        self.assertEqual(evento['evento'], 'status_sessao')
+        self.assertEqual(evento['dados']['estado_sessao'], 'encerrada')
+
+    async def conectar_websocket(self, usuario):
+        # channels.testing exige daphne; o ApplicationCommunicator do asgiref basta
+        caminho = f'/ws/sessao/{self.sessao.id}/'
+        comunicador = ApplicationCommunicator(URLRouter(websocket_urlpatterns), {
+            'type': 'websocket', 'path': caminho, 'raw_path': caminho.encode(),
+            'query_string': b'', 'headers': [], 'subprotocols': [], 'user': usuario,
+        })
+        await comunicador.send_input({'type': 'websocket.connect'})
+        resposta = await comunicador.receive_output(timeout=3)
+        return comunicador, resposta['type'] == 'websocket.accept', resposta.get('code')
+
+    async def receber_json(self, comunicador):
+        return json.loads((await comunicador.receive_output(timeout=3))['text'])
+
+    async def test_websocket_envia_snapshot_e_mudancas(self):
+        """O consumer manda o status ao conectar e depois cada ação registrada, sem polling"""
+        comunicador, conectado, _ = await self.conectar_websocket(self.organizador)
+        self.assertTrue(conectado)
+
+        snapshot = await self.receber_json(comunicador)
+        self.assertEqual(snapshot['type'], 'status_sessao')
+        self.assertEqual(snapshot['dados']['aguardando_personagens'], ['Aria', 'Borin'])
+
+        manager = GameSessionManager(await SessaoIA.objects.aget(id=self.sessao.id))
+        await manager.aprocessar_entrada_jogador('Abro a porta', self.jogadores[0].id)
+
+        mudanca = await self.receber_json(comunicador)
+        self.assertEqual(mudanca['type'], 'status_sessao')
+        self.assertEqual(mudanca['dados']['aguardando_personagens'], ['Borin'])
+        self.assertEqual(mudanca['dados']['acoes_recebidas'], 1)
+        self.assertNotIn('ultimo_turno', mudanca['dados'])
+
+        await comunicador.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await comunicador.wait(timeout=3)
+
+    async def test_websocket_recusa_quem_nao_participa(self):
+        _, conectado, codigo = await self.conectar_websocket(self.jogadores[0])
+        self.assertFalse(conectado)
+        self.assertEqual(codigo, 4003)
+
+
+class ProvedorConcorrencia(ProvedorFalso):
+    """Registra quantas gerações ficaram em andamento ao mesmo tempo"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.em_andamento = 0
+        self.maximo_simultaneo = 0
+
+    async def gerar_conteudo(self, prompt, **kwargs):
+        self.em_andamento += 1
+        self.maximo_simultaneo = max(self.maximo_simultaneo, self.em_andamento)
+        try:
+            return await super().gerar_conteudo(prompt, **kwargs)
+        finally:
+            self.em_andamento -= 1
+
+
+@override_settings(IA_GM_LOTE_CONCORRENCIA=2)
+class GeracaoLoteTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        organizador = get_user_model().objects.create_user(username='mestre')
+        sistema = SistemaJogo.objects.create(nome='D&D 5e', codigo='dnd5e', versao='5.1')
+        campanha = Campanha.objects.create(
+            nome='Campanha de Teste', descricao='Teste', organizador=organizador, sistema_jogo=sistema
+        )
+        self.sessao = SessaoIA.objects.select_related('campanha').get(
+            id=SessaoIA.objects.create(campanha=campanha, nome='Sessão 1').id
+        )
+        self.provedor = ProvedorConcorrencia(
+            pedacos=['Nome: Aldric\nMotivação: proteger a vila, porque perdeu a família. ' * 3], atraso=0.01
+        )
+
+    async def test_lote_limita_concorrencia_e_grava_npcs_de_uma_vez(self):
+        orchestrator = ArquitetoDeMundosOrchestrator(criar_cliente(('openai', self.provedor)))
+        itens = [{'tipo': 'NPC', 'parametros': {'papel': 'aldeão'}}] * 5 + [{'tipo': 'LOCAL'}, {'tipo': 'DESCONHECIDO'}]
+
+        eventos = [evento async for evento in orchestrator.processar_lote(self.sessao, itens)]
+
+        resultados = [evento for evento in eventos if evento['evento'] == 'item']
+        self.assertEqual(sorted(evento['indice'] for evento in resultados), list(range(7)))
+        self.assertFalse(next(e for e in resultados if e['indice'] == 6)['sucesso'])
+        # Especificações iguais não são coalescidas numa só chamada
+        self.assertEqual(self.provedor.chamadas, 6)
+        self.assertLessEqual(self.provedor.maximo_simultaneo, 2)
+
+        fim = eventos[-1]
+        self.assertEqual((fim['evento'], fim['falhas']), ('fim', 1))
+        self.assertEqual(await NPCGerado.objects.filter(sessao=self.sessao).acount(), 5)
+        self.assertEqual(sorted(fim['npcs']), [0, 1, 2, 3, 4])
+        self.assertEqual(await InteracaoIA.objects.filter(sessao=self.sessao).acount(), 6)
+
+    async def test_lote_grava_itens_prontos_quando_cliente_desconecta(self):
+        """Itens já gerados (e cobrados) são gravados mesmo sem o evento 'fim'"""
+        orchestrator = ArquitetoDeMundosOrchestrator(criar_cliente(('openai', self.provedor)))
+        eventos = orchestrator.processar_lote(self.sessao, [{'tipo': 'NPC'}] * 4)
+
+        primeiro = await eventos.__anext__()
+        # Outro item termina antes de o cliente ir embora, sem ter sido entregue
+        await asyncio.sleep(0.05)
+        await eventos.aclose()
+
+        self.assertTrue(primeiro['sucesso'])
+        npcs = await NPCGerado.objects.filter(sessao=self.sessao).acount()
+        self.assertGreaterEqual(npcs, 2)
+        self.assertEqual(await InteracaoIA.objects.filter(sessao=self.sessao).acount(), npcs)
+
+
+@override_settings(IA_GM_MEMORIA_BLOCO=2, IA_GM_MEMORIA_FATOR=2, IA_GM_MEMORIA_RECENTES=1)
+class MemoriaNarrativaTestCase(TestCase):
+    """Testes do resumo incremental e do contexto narrativo em cache"""
+
+    def setUp(self):
+        cache.clear()
+        obter_cache_ia().clear()
+        self.usuario = get_user_model().objects.create_user(username='mestre')
+        sistema = SistemaJogo.objects.create(nome='D&D 5e', codigo='dnd5e', versao='5.1')
+        campanha = Campanha.objects.create(
+            nome='Campanha de Teste', descricao='Teste', organizador=self.usuario, sistema_jogo=sistema
+        )
+        self.sessao = SessaoIA.objects.create(campanha=campanha, nome='Sessão 1', ativa=True)
+        self.memoria = MemoryManager()
+        descartar_indices()
+
+    def criar_interacoes(self, quantidade):
+        for numero in range(quantidade):
+            InteracaoIA.objects.create(
+                sessao=self.sessao, usuario=self.usuario, tipo_interacao='NARRATIVA',
+                prompt_usuario=f'Ação {numero}', resposta_ia=f'Resultado {numero}'
+            )
+
+    def test_contexto_em_cache_ate_nova_interacao(self):
+        self.criar_interacoes(1)
+        self.memoria.compilar_contexto_narrativo(self.sessao)
+
+        with self.assertNumQueries(1):
+            self.memoria.compilar_contexto_narrativo(self.sessao)
+
+        self.criar_interacoes(1)
+        contexto = self.memoria.compilar_contexto_narrativo(self.sessao)
+        self.assertEqual(contexto['interacoes_recentes'][0]['prompt'], 'Ação 0')
+        self.assertEqual(len(contexto['interacoes_recentes']), 1)
+
+    def test_evento_registrado_pela_api_invalida_contexto(self):
+        self.criar_interacoes(1)
+        self.memoria.compilar_contexto_narrativo(self.sessao)
+
+        self.client.force_login(self.usuario)
+        resposta = self.client.post(
+            reverse('ia_gm:api_registrar_evento'),
+            data=json.dumps({'sessao_id': self.sessao.id, 'evento': 'O grupo libertou os prisioneiros'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        contexto = self.memoria.compilar_contexto_narrativo(self.sessao)
+        self.assertIn(
+            'O grupo libertou os prisioneiros', [m['titulo'] for m in contexto['memorias_importantes']]
+        )
+
+    def test_compactacao_hierarquica(self):
+        """8 interações antigas viram 4 resumos, depois 2 e por fim 1 no topo"""
+        self.criar_interacoes(9)
+
+        with mock.patch('ia_gm.ai_client.get_ia_client', side_effect=RuntimeError('sem IA')):
+            criados = self.memoria.compactar_memoria(self.sessao)
+
+        self.assertEqual(criados, 7)
+        topo = ResumoNarrativo.objects.get(sessao=self.sessao, incorporado=False)
+        self.assertEqual(topo.nivel, 2)
+        self.assertIn('Ação 0', topo.texto)
+
+        contexto = self.memoria.compilar_contexto_narrativo(self.sessao)
+        self.assertEqual(contexto['resumo_sessao'], [topo.texto])
+        self.assertEqual([i['prompt'] for i in contexto['interacoes_recentes']], ['Ação 8'])
+
+        # Nada novo para compactar
+        self.assertEqual(self.memoria.compactar_memoria(self.sessao), 0)
+
+    def test_compactacao_concorrente_nao_duplica_trechos(self):
+        """Se outra compactação grava o trecho primeiro, a restrição única descarta a cópia"""
+        self.criar_interacoes(3)
+        outra = MemoryManager()
+        resumir_original = MemoryManager._resumir
+
+        def resumir_com_concorrencia(memoria, sessao, textos, nivel):
+            if memoria is self.memoria:
+                # Outro worker compacta a mesma sessão enquanto esta espera a IA
+                outra.compactar_memoria(sessao)
+            return resumir_original(memoria, sessao, textos, nivel)
+
+        with mock.patch('ia_gm.ai_client.get_ia_client', side_effect=RuntimeError('sem IA')), \
+                mock.patch.object(MemoryManager, '_resumir', autospec=True, side_effect=resumir_com_concorrencia):
+            self.assertEqual(self.memoria.compactar_memoria(self.sessao), 0)
+
+        self.assertEqual(ResumoNarrativo.objects.filter(sessao=self.sessao).count(), 1)
+
+    def test_compactacao_agendada_uma_vez(self):
+        self.criar_interacoes(3)
+
+        with mock.patch('ia_gm.tasks.compactar_memoria_sessao.delay') as delay:
+            self.memoria.compilar_contexto_narrativo(self.sessao)
+            self.criar_interacoes(1)
+            self.memoria.compilar_contexto_narrativo(self.sessao)
+
+        delay.assert_called_once_with(self.sessao.id)
+
+    def criar_memoria(self, titulo, descricao, dias_atras=0):
+        return MemoriaLongoPrazo.objects.create(
+            campanha=self.sessao.campanha, titulo=titulo, descricao=descricao, categoria='DECISAO',
+            impacto_narrativo='-', data_evento=datetime.now(timezone.utc) - timedelta(days=dias_atras)
+        )
+
+    def test_busca_relevante_encontra_memoria_antiga(self):
+        """Uma memória fora das 10 mais recentes aparece se combina com a situação"""
+        antiga = self.criar_memoria('Traição do duque Valerian', 'O duque entregou a cidade aos orcs.', 400)
+        for numero in range(12):
+            self.criar_memoria(f'Viagem {numero}', 'O grupo seguiu pela estrada sem incidentes.')
+        NPCGerado.objects.create(
+            sessao=self.sessao, campanha=self.sessao.campanha, nome='Valerian', ocupacao='Duque',
+            descricao_fisica='-', motivacao_principal='Recuperar o trono', falha_personalidade='-', segredo='-'
+        )
+
+        relevantes = self.memoria.buscar_memorias_relevantes(self.sessao, 'Um mensageiro do Duque Valérian chega.')
+
+        self.assertEqual(relevantes['memorias'][0], antiga)
+        self.assertEqual([npc.nome for npc in relevantes['npcs']], ['Valerian'])
+
+    def test_indice_atualizado_incrementalmente(self):
+        self.criar_memoria('Dragão negro', 'Um dragão negro vive no pântano.')
+        indice = obter_indice(self.sessao.campanha_id)
+        self.assertEqual(len(indice), 1)
+
+        nova = self.criar_memoria('Pacto com a bruxa', 'A bruxa do pântano exige um preço.')
+        relevantes = self.memoria.buscar_memorias_relevantes(self.sessao, 'bruxa')
+
+        self.assertIs(obter_indice(self.sessao.campanha_id), indice)
+        self.assertEqual(len(indice), 2)
+        self.assertEqual(relevantes['memorias'], [nova])
+
+    def test_indice_refeito_apos_edicao_e_remocao(self):
+        memoria = self.criar_memoria('Dragão negro', 'Um dragão negro vive no pântano.')
+        outra = self.criar_memoria('Pacto com a bruxa', 'A bruxa do pântano exige um preço.')
+        self.assertEqual(self.memoria.buscar_memorias_relevantes(self.sessao, 'dragão')['memorias'], [memoria])
+
+        memoria.titulo = 'Serpente marinha'
+        memoria.descricao = 'Uma serpente ronda o porto.'
+        memoria.save()
+        self.assertEqual(self.memoria.buscar_memorias_relevantes(self.sessao, 'dragão')['memorias'], [])
+        self.assertEqual(self.memoria.buscar_memorias_relevantes(self.sessao, 'serpente')['memorias'], [memoria])
+
+        outra.delete()
+        self.assertEqual(len(obter_indice(self.sessao.campanha_id)), 1)
+
+    @override_settings(IA_GM_MEMORIA_INDICES_MAX=1)
+    def test_indices_limitados_por_lru(self):
+        primeiro = obter_indice(self.sessao.campanha_id)
+        obter_indice(self.sessao.campanha_id + 1)
+
+        self.assertIsNot(obter_indice(self.sessao.campanha_id), primeiro)
+
+
+class PromptSistemaTestCase(SimpleTestCase):
+    def test_sistema_compilado_uma_vez_por_configuracao(self):
+        sistema = ArquitetoDeMundosPrompts.compilar_sistema('epico', 5, 7, ModoOperacao.JOGO)
+
+        self.assertIs(ArquitetoDeMundosPrompts.compilar_sistema('epico', 5, 7, ModoOperacao.JOGO), sistema)
+        self.assertTrue(sistema.texto.startswith(sistema.prefixo))
+        self.assertIn('Nível de Dificuldade: 7/10', sistema.configuracao)
+
+    def test_prefixo_estavel_entre_sessoes(self):
+        """Só as configurações da sessão variam; o prefixo depende apenas do modo"""
+        epico = ArquitetoDeMundosPrompts.compilar_sistema('epico', 3, 4, ModoOperacao.JOGO)
+        horror = ArquitetoDeMundosPrompts.compilar_sistema('horror', 9, 8, ModoOperacao.JOGO)
+        configuracao = ArquitetoDeMundosPrompts.compilar_sistema('epico', 3, 4, ModoOperacao.CONFIGURACAO)
+
+        self.assertEqual(epico.prefixo, horror.prefixo)
+        self.assertNotEqual(epico.configuracao, horror.configuracao)
+        self.assertNotEqual(epico.prefixo, configuracao.prefixo)
+        self.assertIn('MODO DE JOGO ATIVO', epico.prefixo)
+
+    def test_prompt_comportamental_envolve_contexto(self):
+        antes, depois = MasterRulesEngine.esqueleto_comportamental(ModoOperacao.JOGO)
+        prompt = MasterRulesEngine.gerar_prompt_comportamental(ModoOperacao.JOGO, 'Taverna do Javali')
+
+        self.assertEqual(prompt, f'{antes}Taverna do Javali{depois}')
+        self.assertEqual(ArquitetoDeMundosPrompts.get_sistema_base('epico', 3, 4),
+                         ArquitetoDeMundosPrompts.compilar_sistema('epico', 3, 4).texto)
@@ -0,0 +1,97 @@
+"""
+Contagem de tokens e orçamento de prompt por modelo
+Usa o tokenizer real (tiktoken) quando instalado, com aproximação em Python puro
+"""
+
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Optional
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # dependência opcional
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Janela de contexto por prefixo de modelo (o prefixo mais longo vence)
+LIMITES_CONTEXTO = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'claude-3': 200000,
+    'claude-2': 100000,
+    'llama2': 4096,
+    'llama3': 8192,
+}
+LIMITE_CONTEXTO_PADRAO = 4096
+
+# Folga para tokens de formatação das mensagens (role, separadores etc.)
+MARGEM_SEGURANCA = 64
+
+# Aproximação BPE: palavras viram ~1 token a cada 4 caracteres, pontuação 1 token
+_PADRAO_TOKENS = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=32)
+def _obter_codificador(modelo: Optional[str]):
+    """Codificador tiktoken do modelo (cl100k_base se desconhecido); None se indisponível"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(modelo) if modelo else tiktoken.get_encoding('cl100k_base')
+    except KeyError:
+        pass
+    try:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        # Sem rede para baixar o BPE, por exemplo
+        logger.warning(f"Tokenizer indisponível, usando aproximação: {e}")
+        return None
+
+
+def _contar_aproximado(texto: str) -> int:
+    total = 0
+    for pedaco in _PADRAO_TOKENS.findall(texto):
+        total += math.ceil(len(pedaco) / 4) if pedaco[0].isalnum() or pedaco[0] == '_' else 1
+    return total
+
+
+def contar_tokens(texto: str, modelo: Optional[str] = None) -> int:
+    """Número de tokens do texto para o modelo"""
+    if not texto:
+        return 0
+
+    codificador = _obter_codificador(modelo)
+    if codificador is not None:
+        return len(codificador.encode(texto, disallowed_special=()))
+    return _contar_aproximado(texto)
+
+
+def limite_contexto(modelo: Optional[str]) -> int:
+    """Janela de contexto do modelo (IA_GM_LIMITES_CONTEXTO sobrescreve os padrões)"""
+    limites = {**LIMITES_CONTEXTO, **getattr(settings, 'IA_GM_LIMITES_CONTEXTO', {})}
+    for prefixo in sorted(limites, key=len, reverse=True):
+        if modelo and modelo.startswith(prefixo):
+            return limites[prefixo]
+    return LIMITE_CONTEXTO_PADRAO
+
+
+def orcamento_prompt(modelo: Optional[str], max_tokens: int = 2000) -> int:
+    """
+    Tokens disponíveis para o prompt: a janela do modelo menos a resposta
+    reservada, limitado a IA_GM_ORCAMENTO_PROMPT_MAXIMO (prompts menores
+    custam menos e respondem mais rápido)
+    """
+    disponivel = limite_contexto(modelo) - max_tokens - MARGEM_SEGURANCA
+    teto = getattr(settings, 'IA_GM_ORCAMENTO_PROMPT_MAXIMO', None)
+    if teto:
+        disponivel = min(disponivel, teto)
+    return max(disponivel, 0)
@@ -0,0 +1,139 @@
+"""
+Armazenamento do estado de turno das sessões de jogo
+Snapshot durável no banco com compare-and-set por versão
+"""
+
+import logging
+from typing import Optional, Tuple
+from django.utils import timezone
+
+from .models import EstadoTurnoSessao
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConflitoEstadoTurno(Exception):
+    """O estado do turno foi alterado por outra requisição desde a leitura"""
+
+
+class ArmazemEstadoTurno:
+    """
+    Estado do turno de uma sessão (bytes codificados + versão)
+
+    O banco é a fonte da verdade: cada gravação é um UPDATE condicionado à
+    versão lida, então escritas concorrentes de workers diferentes nunca se
+    sobrescrevem - a perdedora recebe ConflitoEstadoTurno e relê o estado.
+    Toda leitura vai à linha da sessão (sessao_id é único): um cache por
+    processo devolveria a worker e processo web estados diferentes e recusas
+    baseadas em turnos já superados.
+    """
+
+    def __init__(self, sessao_id: int):
+        self.sessao_id = sessao_id
+
+    def _snapshots(self):
+        return EstadoTurnoSessao.objects.filter(sessao_id=self.sessao_id)
+
+    @staticmethod
+    def _do_banco(snapshot) -> Optional[Tuple[bytes, int]]:
+        # Alguns drivers devolvem memoryview para campos binários
+        return (bytes(snapshot[0]), snapshot[1]) if snapshot else None
+
+    def carregar(self) -> Optional[Tuple[bytes, int]]:
+        """Retorna (estado codificado, versao) ou None se a sessão não tem turno"""
+        return self._do_banco(self._snapshots().values_list('estado', 'versao').first())
+
+    async def acarregar(self) -> Optional[Tuple[bytes, int]]:
+        """Versão assíncrona de carregar"""
+        return self._do_banco(await self._snapshots().values_list('estado', 'versao').afirst())
+
+    def salvar(self, dados: bytes, versao_esperada: int) -> int:
+        """
+        Grava os dados se a versão atual ainda for `versao_esperada`
+
+        Args:
+            dados: Estado codificado (ver codificar_estado_turno)
+            versao_esperada: Versão lida antes da alteração (0 = o turno ainda não existe)
+
+        Returns:
+            A nova versão
+
+        Raises:
+            ConflitoEstadoTurno: outra gravação aconteceu desde a leitura
+        """
+        if versao_esperada == 0:
+            _, criado = EstadoTurnoSessao.objects.get_or_create(
+                sessao_id=self.sessao_id, defaults={'estado': dados, 'versao': 1}
+            )
+            atualizado = criado
+        else:
+            atualizado = self._snapshots().filter(versao=versao_esperada).update(
+                estado=dados, versao=versao_esperada + 1, atualizado_em=timezone.now()
+            )
+
+        if not atualizado:
+            raise ConflitoEstadoTurno(f"Turno da sessão {self.sessao_id} alterado (versão {versao_esperada})")
+        return versao_esperada + 1
+
+    async def asalvar(self, dados: bytes, versao_esperada: int) -> int:
+        """Versão assíncrona de salvar"""
+        if versao_esperada == 0:
+            _, criado = await EstadoTurnoSessao.objects.aget_or_create(
+                sessao_id=self.sessao_id, defaults={'estado': dados, 'versao': 1}
+            )
+            atualizado = criado
+        else:
+            atualizado = await self._snapshots().filter(versao=versao_esperada).aupdate(
+                estado=dados, versao=versao_esperada + 1, atualizado_em=timezone.now()
+            )
+
+        if not atualizado:
+            raise ConflitoEstadoTurno(f"Turno da sessão {self.sessao_id} alterado (versão {versao_esperada})")
+        return versao_esperada + 1
+
+    def substituir(self, dados: bytes) -> int:
+        """Grava os dados independentemente da versão atual (início de um novo jogo)"""
+        while True:
+            atual = self.carregar()
+            try:
+                return self.salvar(dados, atual[1] if atual else 0)
+            except ConflitoEstadoTurno:
+                continue
+
+    async def asubstituir(self, dados: bytes) -> int:
+        """Versão assíncrona de substituir"""
+        while True:
+            atual = await self.acarregar()
+            try:
+                return await self.asalvar(dados, atual[1] if atual else 0)
+            except ConflitoEstadoTurno:
+                continue
+
+    def ler(self, *campos) -> Optional[tuple]:
+        """Campos do snapshot lidos direto do banco (None se a sessão não tem turno)"""
+        return self._snapshots().values_list(*campos).first()
+
+    async def aler(self, *campos) -> Optional[tuple]:
+        """Versão assíncrona de ler"""
+        return await self._snapshots().values_list(*campos).afirst()
+
+    def atualizar(self, **valores) -> bool:
+        """
+        Grava campos fora do compare-and-set (estado da sessão, último resultado)
+
+        Não mexe em `estado` nem em `versao`; retorna False se a sessão não tem turno.
+        """
+        return bool(self._snapshots().update(**valores))
+
+    async def aatualizar(self, **valores) -> bool:
+        """Versão assíncrona de atualizar"""
+        return bool(await self._snapshots().aupdate(**valores))
+
+    def remover(self):
+        """Apaga o snapshot"""
+        self._snapshots().delete()
+
+    async def aremover(self):
+        """Versão assíncrona de remover"""
+        await self._snapshots().adelete()
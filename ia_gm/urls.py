@@ -20,6 +20,7 @@ urlpatterns = [
     
     # APIs para interação em tempo real
     path('api/gerar-conteudo/', views.api_gerar_conteudo, name='api_gerar_conteudo'),
+    path('api/gerar-conteudo-lote/', views.api_gerar_conteudo_lote, name='api_gerar_conteudo_lote'),
     path('api/registrar-evento/', views.api_registrar_evento, name='api_registrar_evento'),
     path('api/sugestoes/<int:sessao_id>/', views.api_obter_sugestoes, name='api_sugestoes'),
     path('api/configuracoes/', views.api_atualizar_configuracoes_sessao, name='api_configuracoes'),
@@ -8,8 +8,9 @@ Implementa interface web para interação durante as sessões
 import json
 import asyncio
 from typing import Dict, Any, List, Optional
-from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpRequest, HttpResponse
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
+from django.conf import settings
+from django.http import JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
@@ -23,6 +24,7 @@ import logging
 from django.utils import timezone
 
 from campanhas.models import Campanha
+from mensagens.models import SalaChat
 from .models import (
     SessaoIA, NPCGerado, InteracaoIA, 
     MemoriaLongoPrazo, EstiloNarrativo, TipoConteudo
@@ -30,6 +32,7 @@ from .models import (
 from .content_generators import ArquitetoDeMundosOrchestrator
 from .memory_manager import get_memory_manager
 from .ai_client import get_ia_client
+from .rate_limiter import OrcamentoExcedido
 from .game_session_manager import GameSessionManager
 
 logger = logging.getLogger(__name__)
@@ -120,12 +123,20 @@ class SessaoGMView(TemplateView):
                 campanha=sessao.campanha
             ).order_by('-data_evento')[:10]
             
+            # Memórias e NPCs relevantes para as últimas interações, de qualquer época
+            relevantes = get_memory_manager().buscar_memorias_relevantes(
+                sessao,
+                ' '.join(f"{i.prompt_usuario} {i.resposta_ia}" for i in interacoes[:3])
+            )
+            
             context.update({
                 'sessao': sessao,
                 'personagens': personagens,
                 'npcs': npcs,
                 'interacoes': interacoes,
                 'memorias_recentes': memorias_recentes,
+                'memorias_relevantes': relevantes['memorias'],
+                'npcs_relevantes': relevantes['npcs'],
                 'estilos_narrativos': EstiloNarrativo.choices,
                 'tipos_conteudo': TipoConteudo.choices,
             })
@@ -200,7 +211,8 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
     API endpoint para gerar conteúdo usando IA (Versão Simplificada)
     Suporta NPCs, locais, missões, itens e narrativa
     """
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
@@ -219,7 +231,7 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
         campanha_organizador = await sync_to_async(lambda: sessao.campanha.organizador)()
         jogadores = await sync_to_async(list)(sessao.campanha.jogadores.all())
         
-        if not (campanha_organizador == request.user or request.user in jogadores):
+        if not (campanha_organizador == usuario or usuario in jogadores):
             return JsonResponse({'erro': 'Sem permissão'}, status=403)
         
         # Gera conteúdo usando IA real
@@ -227,6 +239,27 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
             ia_client = get_ia_client()
             orchestrator = ArquitetoDeMundosOrchestrator(ia_client)
             
+            # Narrativa em streaming: os pedaços vão direto para o chat da campanha
+            if dados.get('stream') and tipo_conteudo == TipoConteudo.NARRATIVA:
+                sala_id = await SalaChat.objects.filter(
+                    campanha_id=sessao.campanha_id
+                ).values_list('id', flat=True).afirst()
+                
+                if sala_id:
+                    conteudo = await orchestrator.transmitir_narrativa(
+                        sessao=sessao,
+                        sala_id=sala_id,
+                        contexto=parametros
+                    )
+                    return JsonResponse({
+                        'sucesso': True,
+                        'tipo': conteudo.tipo,
+                        'conteudo': conteudo.conteudo,
+                        'metadata': conteudo.metadata,
+                        'tokens_usados': conteudo.tokens_usados,
+                        'sala_id': sala_id
+                    })
+            
             # Processa solicitação usando IA
             resultado = await orchestrator.processar_solicitacao(
                 sessao=sessao,
@@ -249,6 +282,9 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
                     'sucesso': False,
                     'erro': resultado['erro']
                 }, status=400)
+        
+        except OrcamentoExcedido as e:
+            return JsonResponse({'sucesso': False, 'erro': str(e)}, status=429)
                 
         except Exception as e:
             # Fallback para conteúdo de exemplo se a IA falhar
@@ -262,9 +298,9 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
             }
             
             # Registra interação de fallback
-            InteracaoIA.objects.create(
+            await InteracaoIA.objects.acreate(
                 sessao=sessao,
-                usuario=request.user,
+                usuario=usuario,
                 tipo_interacao=tipo_conteudo,
                 prompt_usuario=f"Gerar {tipo_conteudo}: {parametros} [FALLBACK]",
                 resposta_ia=conteudo_exemplo.get(tipo_conteudo, 'Conteúdo não implementado'),
@@ -288,6 +324,47 @@ async def api_gerar_conteudo(request: HttpRequest) -> JsonResponse:
         return JsonResponse({'erro': str(e)}, status=500)
 
 
+@csrf_exempt
+@require_POST
+async def api_gerar_conteudo_lote(request: HttpRequest) -> HttpResponse:
+    """
+    API para gerar vários conteúdos (NPCs, locais, missões, narrativas) numa só requisição
+    
+    Corpo: {"sessao_id": 1, "itens": [{"tipo": "NPC", "parametros": {...}}, ...]}
+    Resposta: NDJSON, uma linha por item assim que fica pronto e uma linha final
+    com os ids dos NPCs gravados
+    """
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
+        return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
+    
+    try:
+        dados = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'erro': 'JSON inválido'}, status=400)
+    
+    itens = dados.get('itens')
+    maximo = getattr(settings, 'IA_GM_LOTE_MAXIMO', 50)
+    if not isinstance(itens, list) or not itens:
+        return JsonResponse({'erro': 'Informe a lista de itens a gerar'}, status=400)
+    if len(itens) > maximo:
+        return JsonResponse({'erro': f'O lote aceita no máximo {maximo} itens'}, status=400)
+    if not all(isinstance(item, dict) for item in itens):
+        return JsonResponse({'erro': 'Cada item deve ser um objeto com tipo e parametros'}, status=400)
+    
+    sessao = await _aobter_sessao_jogo(dados.get('sessao_id'))
+    if not await _ausuario_participa(sessao, usuario):
+        return JsonResponse({'erro': 'Sem permissão'}, status=403)
+    
+    orchestrator = ArquitetoDeMundosOrchestrator(get_ia_client())
+    
+    async def linhas():
+        async for evento in orchestrator.processar_lote(sessao, itens, usuario_id=usuario.id):
+            yield json.dumps(evento, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingHttpResponse(linhas(), content_type='application/x-ndjson')
+
+
 @csrf_exempt
 @require_POST
 def api_registrar_evento(request: HttpRequest) -> JsonResponse:
@@ -321,6 +398,8 @@ def api_registrar_evento(request: HttpRequest) -> JsonResponse:
             importancia=min(importancia, 5),  # Máx 5
             data_evento=timezone.now()
         )
+        # O contexto narrativo em cache precisa ver a memória nova
+        get_memory_manager().invalidar_contexto_campanha(sessao.campanha_id)
         
         return JsonResponse({
             'sucesso': True,
@@ -527,9 +606,10 @@ def api_atualizar_configuracoes_sessao(request: HttpRequest) -> JsonResponse:
 
 @csrf_exempt
 @require_POST
-def api_encerrar_sessao(request: HttpRequest) -> JsonResponse:
+async def api_encerrar_sessao(request: HttpRequest) -> JsonResponse:
     """API para encerrar uma sessão"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
@@ -537,18 +617,17 @@ def api_encerrar_sessao(request: HttpRequest) -> JsonResponse:
         sessao_id = dados.get('sessao_id')
         resumo_final = dados.get('resumo_final', '')
         
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica permissão
-        if sessao.campanha.organizador != request.user:
+        if sessao.campanha.organizador_id != usuario.id:
             return JsonResponse({'erro': 'Apenas o organizador pode encerrar a sessão'}, status=403)
         
-        # Encerra sessão
-        sessao.ativa = False
-        sessao.save()
+        # Encerra pelo manager: grava ações pendentes e avisa os WebSockets da sessão
+        resultado = await GameSessionManager(sessao).aencerrar_sessao(resumo_final)
         
         # Registra na memória
-        MemoriaLongoPrazo.objects.create(
+        await MemoriaLongoPrazo.objects.acreate(
             campanha=sessao.campanha,
             titulo=f"Sessão {sessao.nome} encerrada",
             descricao=f"Sessão encerrada. Resumo: {resumo_final}",
@@ -557,9 +636,11 @@ def api_encerrar_sessao(request: HttpRequest) -> JsonResponse:
             importancia=4,
             data_evento=timezone.now()
         )
+        await sync_to_async(get_memory_manager().invalidar_contexto_campanha)(sessao.campanha_id)
         
         return JsonResponse({
             'sucesso': True,
+            'resultado': resultado,
             'mensagem': 'Sessão encerrada com sucesso'
         })
     
@@ -570,29 +651,42 @@ def api_encerrar_sessao(request: HttpRequest) -> JsonResponse:
         return JsonResponse({'erro': str(e)}, status=500)
 
 
+async def _aobter_sessao_jogo(sessao_id) -> SessaoIA:
+    """Sessão com a campanha já carregada (evita acesso síncrono ao banco nas views assíncronas)"""
+    return await aget_object_or_404(SessaoIA.objects.select_related('campanha'), id=sessao_id)
+
+
+async def _ausuario_participa(sessao: SessaoIA, usuario) -> bool:
+    """Se o usuário é organizador ou jogador da campanha da sessão"""
+    if sessao.campanha.organizador_id == usuario.id:
+        return True
+    return await sessao.campanha.jogadores.filter(id=usuario.id).aexists()
+
+
 @csrf_exempt
 @require_POST
-def api_ativar_modo_jogo(request: HttpRequest) -> JsonResponse:
+async def api_ativar_modo_jogo(request: HttpRequest) -> JsonResponse:
     """API para ativar o modo de jogo da sessão"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
         dados = json.loads(request.body)
         sessao_id = dados.get('sessao_id')
         
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica permissão (apenas organizador pode ativar)
-        if sessao.campanha.organizador != request.user:
+        if sessao.campanha.organizador_id != usuario.id:
             return JsonResponse({'erro': 'Apenas o organizador pode ativar o modo de jogo'}, status=403)
         
         # Ativa modo de jogo
         game_manager = GameSessionManager(sessao)
-        resultado = game_manager.ativar_modo_jogo()
+        resultado = await game_manager.aativar_modo_jogo()
         
         # Inicia aguardo de ações
-        aguardo_resultado = game_manager.iniciar_aguardo_acoes(resultado['situacao'])
+        aguardo_resultado = await game_manager.ainiciar_aguardo_acoes(resultado['situacao'])
         
         return JsonResponse({
             'sucesso': True,
@@ -609,9 +703,10 @@ def api_ativar_modo_jogo(request: HttpRequest) -> JsonResponse:
 
 @csrf_exempt
 @require_POST
-def api_processar_acao_jogador(request: HttpRequest) -> JsonResponse:
+async def api_processar_acao_jogador(request: HttpRequest) -> JsonResponse:
     """API para processar ação de um jogador"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
@@ -622,16 +717,15 @@ def api_processar_acao_jogador(request: HttpRequest) -> JsonResponse:
         if not acao:
             return JsonResponse({'erro': 'Ação é obrigatória'}, status=400)
         
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica se usuário pode participar
-        if not (sessao.campanha.organizador == request.user or 
-               request.user in sessao.campanha.jogadores.all()):
+        if not await _ausuario_participa(sessao, usuario):
             return JsonResponse({'erro': 'Sem permissão para participar desta sessão'}, status=403)
         
         # Processa ação do jogador
         game_manager = GameSessionManager(sessao)
-        resultado = game_manager.processar_entrada_jogador(acao, request.user.id)
+        resultado = await game_manager.aprocessar_entrada_jogador(acao, usuario.id)
         
         return JsonResponse({
             'sucesso': True,
@@ -647,22 +741,22 @@ def api_processar_acao_jogador(request: HttpRequest) -> JsonResponse:
 
 @csrf_exempt
 @require_http_methods(['GET'])
-def api_status_sessao(request: HttpRequest, sessao_id: int) -> JsonResponse:
+async def api_status_sessao(request: HttpRequest, sessao_id: int) -> JsonResponse:
     """API para obter status da sessão de jogo"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica permissão
-        if not (sessao.campanha.organizador == request.user or 
-               request.user in sessao.campanha.jogadores.all()):
+        if not await _ausuario_participa(sessao, usuario):
             return JsonResponse({'erro': 'Sem permissão para acessar esta sessão'}, status=403)
         
         # Obtém status
         game_manager = GameSessionManager(sessao)
-        status = game_manager.obter_status_sessao()
+        status = await game_manager.aobter_status_sessao()
         
         return JsonResponse({
             'sucesso': True,
@@ -676,23 +770,24 @@ def api_status_sessao(request: HttpRequest, sessao_id: int) -> JsonResponse:
 
 @csrf_exempt
 @require_POST
-def api_pausar_sessao(request: HttpRequest) -> JsonResponse:
+async def api_pausar_sessao(request: HttpRequest) -> JsonResponse:
     """API para pausar sessão de jogo"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
         dados = json.loads(request.body)
         sessao_id = dados.get('sessao_id')
         
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica permissão (apenas organizador)
-        if sessao.campanha.organizador != request.user:
+        if sessao.campanha.organizador_id != usuario.id:
             return JsonResponse({'erro': 'Apenas o organizador pode pausar a sessão'}, status=403)
         
         game_manager = GameSessionManager(sessao)
-        resultado = game_manager.pausar_sessao()
+        resultado = await game_manager.apausar_sessao()
         
         return JsonResponse({
             'sucesso': True,
@@ -708,23 +803,24 @@ def api_pausar_sessao(request: HttpRequest) -> JsonResponse:
 
 @csrf_exempt
 @require_POST
-def api_retomar_sessao(request: HttpRequest) -> JsonResponse:
+async def api_retomar_sessao(request: HttpRequest) -> JsonResponse:
     """API para retomar sessão pausada"""
-    if not request.user.is_authenticated:
+    usuario = await request.auser()
+    if not usuario.is_authenticated:
         return JsonResponse({'erro': 'Usuário não autenticado'}, status=401)
     
     try:
         dados = json.loads(request.body)
         sessao_id = dados.get('sessao_id')
         
-        sessao = get_object_or_404(SessaoIA, id=sessao_id)
+        sessao = await _aobter_sessao_jogo(sessao_id)
         
         # Verifica permissão (apenas organizador)
-        if sessao.campanha.organizador != request.user:
+        if sessao.campanha.organizador_id != usuario.id:
             return JsonResponse({'erro': 'Apenas o organizador pode retomar a sessão'}, status=403)
         
         game_manager = GameSessionManager(sessao)
-        resultado = game_manager.retomar_sessao()
+        resultado = await game_manager.aretomar_sessao()
         
         return JsonResponse({
             'sucesso': True,
@@ -7,6 +7,7 @@ from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
 from .models import SalaChat, ParticipacaoChat, Mensagem, TipoMensagem
+from .utils import invalidar_contexto_chat
 
 
 class MensagemInline(admin.TabularInline):
@@ -113,6 +114,11 @@ class SalaChatAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related(
             'campanha', 'ultima_mensagem', 'ultima_mensagem__usuario'
         ).prefetch_related('participacoes')
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Conexões abertas relêem as configurações da sala
+        invalidar_contexto_chat(obj.id)
 
 
 
@@ -137,7 +143,7 @@ class ParticipacaoChatAdmin(admin.ModelAdmin):
     ]
     
     readonly_fields = [
-        'primeira_conexao', 'total_mensagens_enviadas'
+        'primeira_conexao', 'total_mensagens_enviadas', 'mensagens_nao_lidas'
     ]
     
     fieldsets = (
@@ -149,7 +155,7 @@ class ParticipacaoChatAdmin(admin.ModelAdmin):
         }),
         ('Mensagens', {
             'fields': (
-                'mensagens_nao_lidas', 'ultima_mensagem_vista',
+                'mensagens_nao_lidas', 'cursor_leitura', 'ultima_mensagem_vista',
                 'total_mensagens_enviadas'
             )
         }),
@@ -189,6 +195,11 @@ class ParticipacaoChatAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related(
             'usuario', 'sala'
         )
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Silenciamento/moderação valem já nas conexões abertas do usuário
+        invalidar_contexto_chat(obj.sala_id, obj.usuario_id)
 
 
 @admin.register(Mensagem)
@@ -13,13 +13,63 @@ from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
 from .models import SalaChat, ParticipacaoChat, Mensagem, TipoMensagem
-from .serializers import MensagemDetailSerializer, ParticipacaoChatSerializer
+from .serializers import ParticipacaoChatSerializer, dados_mensagem
+from .presence import obter_agregador
 from usuarios.models import Usuario
 from personagens.models import Personagem
+from campanhas.models import ParticipacaoCampanha
 
 logger = logging.getLogger(__name__)
 
 
+def codificar_chat_message(mensagem_data: Dict[str, Any]) -> str:
+    """
+    Quadro WebSocket 'chat_message' já em JSON
+    
+    Gerado uma vez pelo remetente e repassado pelo channel layer como texto;
+    cada consumer da sala escreve a mesma string no socket sem reserializar.
+    """
+    return json.dumps({'type': 'chat_message', 'mensagem': mensagem_data})
+
+
+class PapelChat:
+    """Papel do usuário na sala, derivado da campanha e da participação"""
+    
+    ORGANIZADOR = 'organizador'
+    MODERADOR = 'moderador'
+    JOGADOR = 'jogador'
+
+
+class ContextoConexao:
+    """
+    Identidade e permissões de uma conexão de chat
+    
+    Resolvido uma vez no connect e mantido enquanto o socket estiver aberto;
+    só é recarregado quando chega um evento 'contexto_invalidado' pelo grupo
+    da sala (ver utils.invalidar_contexto_chat).
+    """
+    
+    __slots__ = (
+        'usuario_id', 'usuario_nome', 'papel', 'mutado', 'is_moderador',
+        'comandos_habilitados', 'rolagens_publicas', 'historico_visivel'
+    )
+    
+    def __init__(self, usuario, sala: SalaChat, participacao: ParticipacaoChat):
+        self.usuario_id = usuario.id
+        self.usuario_nome = usuario.get_full_name() or usuario.username
+        self.mutado = participacao.mutado
+        self.is_moderador = participacao.is_moderador
+        if sala.campanha.organizador_id == usuario.id:
+            self.papel = PapelChat.ORGANIZADOR
+        elif participacao.is_moderador:
+            self.papel = PapelChat.MODERADOR
+        else:
+            self.papel = PapelChat.JOGADOR
+        self.comandos_habilitados = sala.comandos_habilitados
+        self.rolagens_publicas = sala.rolagens_publicas
+        self.historico_visivel = sala.historico_visivel
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     """
     Consumer para chat em tempo real por sala
@@ -35,6 +85,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.user = None
         self.sala = None
         self.participacao = None
+        self.contexto = None
     
     async def connect(self):
         """Conectar usuário à sala de chat"""
@@ -50,7 +101,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         # Verificar acesso à sala
         try:
-            self.sala, self.participacao = await self.verificar_acesso_sala()
+            self.sala, self.participacao, self.contexto = await self.verificar_acesso_sala()
         except ObjectDoesNotExist:
             logger.warning(f"Usuário {self.user.id} tentou acessar sala inexistente {self.sala_id}")
             await self.close(code=4004)
@@ -72,37 +123,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Marcar usuário como online
         await self.marcar_usuario_online(True)
         
-        # Notificar outros usuários que entrou na sala
-        await self.channel_layer.group_send(
-            self.sala_group_name,
-            {
-                'type': 'usuario_status',
-                'action': 'entrou',
-                'usuario_id': self.user.id,
-                'usuario_nome': await self.get_usuario_nome(),
-                'timestamp': timezone.now().isoformat()
-            }
-        )
+        # Anunciar a entrada no próximo snapshot de presença da sala
+        self.registrar_presenca(online=True)
         
         logger.info(f"Usuário {self.user.username} conectou à sala {self.sala_id}")
     
     async def disconnect(self, close_code):
         """Desconectar usuário da sala de chat"""
-        if hasattr(self, 'sala_group_name') and self.sala_group_name:
+        if self.contexto:
             # Marcar usuário como offline
             await self.marcar_usuario_online(False)
             
-            # Notificar outros usuários que saiu da sala
-            await self.channel_layer.group_send(
-                self.sala_group_name,
-                {
-                    'type': 'usuario_status',
-                    'action': 'saiu',
-                    'usuario_id': self.user.id if self.user else None,
-                    'usuario_nome': await self.get_usuario_nome() if self.user else 'Usuário',
-                    'timestamp': timezone.now().isoformat()
-                }
-            )
+            # Anunciar a saída no próximo snapshot de presença da sala
+            self.registrar_presenca(online=False, digitando=False)
             
             # Sair do grupo da sala
             await self.channel_layer.group_discard(
@@ -147,6 +180,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Mensagem não pode estar vazia")
             return
         
+        if not await self.pode_enviar(comando=conteudo.startswith('/')):
+            return
+        
         try:
             # Validar personagem se fornecido
             personagem = None
@@ -178,20 +214,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     await self.send_error(resultado['erro'])
                     return
             
-            # Serializar mensagem
-            mensagem_data = await self.serializar_mensagem(mensagem)
+            # Serializar mensagem (uma única vez para todos os destinatários)
+            quadro = codificar_chat_message(await self.serializar_mensagem(mensagem))
             
             # Determinar destinatários
             if mensagem.tipo == TipoMensagem.WHISPER:
                 # Enviar whisper apenas para remetente e destinatário
-                await self.enviar_whisper(mensagem_data, destinatario)
+                await self.enviar_whisper(quadro, destinatario)
             else:
                 # Enviar para toda a sala
                 await self.channel_layer.group_send(
                     self.sala_group_name,
                     {
                         'type': 'chat_message',
-                        'mensagem': mensagem_data
+                        'texto': quadro
                     }
                 )
             
@@ -211,6 +247,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Comando inválido")
             return
         
+        if not await self.pode_enviar(comando=True):
+            return
+        
         try:
             # Validar personagem se fornecido
             personagem = None
@@ -230,12 +269,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 return
             
             # Serializar e enviar resultado
-            mensagem_data = await self.serializar_mensagem(mensagem)
+            quadro = codificar_chat_message(await self.serializar_mensagem(mensagem))
             await self.channel_layer.group_send(
                 self.sala_group_name,
                 {
                     'type': 'chat_message',
-                    'mensagem': mensagem_data
+                    'texto': quadro
                 }
             )
         
@@ -244,18 +283,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error("Erro ao executar comando")
     
     async def handle_typing(self, data):
-        """Processar indicação de digitação"""
-        is_typing = data.get('is_typing', False)
-        
-        await self.channel_layer.group_send(
-            self.sala_group_name,
-            {
-                'type': 'user_typing',
-                'usuario_id': self.user.id,
-                'usuario_nome': await self.get_usuario_nome(),
-                'is_typing': is_typing
-            }
-        )
+        """Processar indicação de digitação (agregada, sem group_send por tecla)"""
+        self.registrar_presenca(digitando=bool(data.get('is_typing', False)))
     
     async def handle_mark_read(self, data):
         """Marcar mensagens como lidas"""
@@ -268,34 +297,45 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # Handlers para mensagens do grupo
     
     async def chat_message(self, event):
-        """Enviar mensagem de chat para WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'mensagem': event['mensagem']
-        }))
+        """Enviar mensagem de chat para WebSocket (quadro já codificado)"""
+        await self.send(text_data=self._quadro_chat(event))
+    
+    @staticmethod
+    def _quadro_chat(event) -> str:
+        # Eventos sem 'texto' vêm de remetentes anteriores ao quadro pré-codificado
+        if 'texto' in event:
+            return event['texto']
+        return codificar_chat_message(event['mensagem'])
+    
+    async def presence_snapshot(self, event):
+        """Enviar snapshot de presença/digitação da sala (quadro já codificado)"""
+        await self.send(text_data=event['texto'])
+    
+    async def narrative_chunk(self, event):
+        """Enviar pedaço de narrativa gerada pela IA (streaming)"""
+        payload = {
+            'type': 'narrative_chunk',
+            'stream_id': event['stream_id'],
+            'indice': event['indice'],
+            'conteudo': event['conteudo'],
+            'final': event['final']
+        }
+        if event['final']:
+            payload['metadata'] = event.get('metadata', {})
+        if event.get('erro'):
+            payload['erro'] = event['erro']
+        
+        await self.send(text_data=json.dumps(payload))
     
-    async def usuario_status(self, event):
-        """Notificar mudança de status do usuário"""
-        # Não enviar notificação para o próprio usuário
-        if event['usuario_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_status',
-                'action': event['action'],
-                'usuario_id': event['usuario_id'],
-                'usuario_nome': event['usuario_nome'],
-                'timestamp': event['timestamp']
-            }))
-    
-    async def user_typing(self, event):
-        """Notificar que usuário está digitando"""
-        # Não enviar notificação para o próprio usuário
-        if event['usuario_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_typing',
-                'usuario_id': event['usuario_id'],
-                'usuario_nome': event['usuario_nome'],
-                'is_typing': event['is_typing']
-            }))
+    async def contexto_invalidado(self, event):
+        """Recarregar o contexto da conexão (usuario_id None vale para toda a sala)"""
+        usuario_id = event.get('usuario_id')
+        if usuario_id is not None and usuario_id != self.user.id:
+            return
+        try:
+            self.sala, self.participacao, self.contexto = await self.carregar_contexto()
+        except ObjectDoesNotExist:
+            await self.close(code=4003)
     
     async def system_notification(self, event):
         """Enviar notificação do sistema"""
@@ -308,6 +348,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     # Métodos auxiliares
     
+    def registrar_presenca(self, **estado: bool):
+        """Anotar online/digitando no agregador de presença da sala"""
+        obter_agregador(self.sala.id).registrar(
+            self.contexto.usuario_id, self.contexto.usuario_nome, **estado
+        )
+    
+    async def pode_enviar(self, comando: bool = False) -> bool:
+        """Checar silenciamento e comandos da sala pelo contexto da conexão"""
+        if self.contexto.mutado:
+            await self.send_error("Você foi silenciado nesta sala")
+            return False
+        if comando and not self.contexto.comandos_habilitados:
+            await self.send_error("Comandos desabilitados nesta sala")
+            return False
+        return True
+    
     async def send_error(self, message: str):
         """Enviar mensagem de erro"""
         await self.send(text_data=json.dumps({
@@ -316,20 +372,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'timestamp': timezone.now().isoformat()
         }))
     
-    async def enviar_whisper(self, mensagem_data: Dict, destinatario: Usuario):
-        """Enviar whisper para remetente e destinatário"""
+    async def enviar_whisper(self, quadro: str, destinatario: Usuario):
+        """Enviar whisper (quadro já codificado) para remetente e destinatário"""
         # Enviar para o remetente
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'mensagem': mensagem_data
-        }))
+        await self.send(text_data=quadro)
         
         # Enviar para o destinatário (se estiver online na sala)
         await self.channel_layer.group_send(
             self.sala_group_name,
             {
                 'type': 'whisper_message',
-                'mensagem': mensagem_data,
+                'texto': quadro,
                 'destinatario_id': destinatario.id
             }
         )
@@ -337,53 +390,53 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def whisper_message(self, event):
         """Receber whisper se for o destinatário"""
         if event['destinatario_id'] == self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'chat_message',
-                'mensagem': event['mensagem']
-            }))
+            await self.send(text_data=self._quadro_chat(event))
     
     # Métodos de banco de dados (database_sync_to_async)
     
     @database_sync_to_async
     def verificar_acesso_sala(self):
-        """Verificar se usuário tem acesso à sala"""
+        """Verificar acesso à sala e resolver o contexto da conexão"""
         try:
-            sala = SalaChat.objects.get(id=self.sala_id)
-            
-            # Verificar se usuário é participante da campanha
-            if not sala.campanha.participantes.filter(id=self.user.id).exists():
-                raise PermissionError("Usuário não é participante da campanha")
-            
-            # Obter ou criar participação
-            participacao, created = ParticipacaoChat.objects.get_or_create(
-                sala=sala,
-                usuario=self.user,
-                defaults={
-                    'primeira_conexao': timezone.now(),
-                    'online': True
-                }
-            )
-            
-            return sala, participacao
-            
+            sala = SalaChat.objects.select_related('campanha').get(id=self.sala_id)
         except SalaChat.DoesNotExist:
             raise ObjectDoesNotExist("Sala de chat não encontrada")
+        
+        # Organizador ou jogador ativo da campanha
+        if sala.campanha.organizador_id != self.user.id and not ParticipacaoCampanha.objects.filter(
+            campanha_id=sala.campanha_id, usuario_id=self.user.id, ativo=True
+        ).exists():
+            raise PermissionError("Usuário não é participante da campanha")
+        
+        # Obter ou criar participação
+        participacao, created = ParticipacaoChat.objects.get_or_create(
+            sala=sala,
+            usuario=self.user,
+            defaults={
+                'primeira_conexao': timezone.now(),
+                'online': True
+            }
+        )
+        
+        return sala, participacao, ContextoConexao(self.user, sala, participacao)
+    
+    @database_sync_to_async
+    def carregar_contexto(self):
+        """Reler sala e participação após uma invalidação"""
+        participacao = ParticipacaoChat.objects.select_related('sala__campanha').get(
+            sala_id=self.sala_id, usuario_id=self.user.id
+        )
+        return participacao.sala, participacao, ContextoConexao(self.user, participacao.sala, participacao)
     
     @database_sync_to_async
     def marcar_usuario_online(self, online: bool):
         """Marcar usuário como online/offline"""
+        # UPDATE só dos campos de conexão, sem sobrescrever mutado/moderador
+        # alterados por outro processo desde o connect
         if self.participacao:
-            self.participacao.online = online
-            if online:
-                self.participacao.ultima_conexao = timezone.now()
-            self.participacao.save()
-    
-    @database_sync_to_async
-    def get_usuario_nome(self) -> str:
-        """Obter nome do usuário"""
-        if self.user:
-            return self.user.get_full_name() or self.user.username
-        return "Usuário"
+            ParticipacaoChat.objects.filter(pk=self.participacao.pk).update(
+                online=online, ultima_conexao=timezone.now()
+            )
     
     @database_sync_to_async
     def get_personagem(self, personagem_id: int):
@@ -420,33 +473,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Processar comando da mensagem"""
         return mensagem.processar_comando()
     
-    @database_sync_to_async
-    def serializar_mensagem(self, mensagem: Mensagem) -> Dict[str, Any]:
-        """Serializar mensagem para envio"""
-        # Refresh da mensagem para pegar dados atualizados
-        mensagem.refresh_from_db()
-        serializer = MensagemDetailSerializer(mensagem)
-        return serializer.data
+    async def serializar_mensagem(self, mensagem: Mensagem) -> Dict[str, Any]:
+        """
+        Serializar mensagem para envio
+        
+        Usa os objetos já carregados na criação (usuário, personagem,
+        destinatário, rolagem), sem nenhuma consulta ao banco.
+        """
+        return dados_mensagem(mensagem)
     
-    @database_sync_to_async
-    def marcar_mensagens_lidas(self):
+    async def marcar_mensagens_lidas(self):
         """Marcar todas as mensagens como lidas"""
         if self.participacao:
-            self.participacao.mensagens_nao_lidas = 0
-            self.participacao.ultima_mensagem_vista = timezone.now()
-            self.participacao.save()
+            await self.participacao.amarcar_como_lida()
     
-    @database_sync_to_async
-    def atualizar_mensagens_nao_lidas(self, mensagem: Mensagem):
-        """Atualizar contador de mensagens não lidas para outros participantes"""
-        outros_participantes = ParticipacaoChat.objects.filter(
-            sala=self.sala
-        ).exclude(usuario=self.user)
-        
-        for participacao in outros_participantes:
-            if participacao.ultima_mensagem_vista < mensagem.timestamp:
-                participacao.mensagens_nao_lidas += 1
-                participacao.save()
+    async def atualizar_mensagens_nao_lidas(self, mensagem: Mensagem):
+        """
+        Avançar o cursor de leitura do remetente
+        
+        As não lidas dos outros participantes são derivadas dos cursores deles,
+        então o envio custa um único UPDATE qualquer que seja o tamanho da sala.
+        """
+        await ParticipacaoChat.aavancar_cursor(self.sala.id, self.user.id, mensagem.id)
 
 
 class NotificacaoConsumer(AsyncWebsocketConsumer):
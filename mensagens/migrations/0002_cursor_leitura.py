@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def iniciar_cursores(apps, schema_editor):
+    """Posiciona o cursor na última mensagem anterior a ultima_mensagem_vista"""
+    ParticipacaoChat = apps.get_model('mensagens', 'ParticipacaoChat')
+    Mensagem = apps.get_model('mensagens', 'Mensagem')
+    for participacao in ParticipacaoChat.objects.exclude(ultima_mensagem_vista__isnull=True):
+        ultima = Mensagem.objects.filter(
+            sala_id=participacao.sala_id, timestamp__lte=participacao.ultima_mensagem_vista
+        ).order_by('-id').values_list('id', flat=True).first()
+        if ultima:
+            participacao.cursor_leitura = ultima
+            participacao.save(update_fields=['cursor_leitura'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mensagens', '0001_initial'),
+        ('personagens', '0004_remove_personagem_altura_remove_personagem_aparencia_and_more'),
+        ('rolagem', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participacaochat',
+            name='cursor_leitura',
+            field=models.PositiveBigIntegerField(default=0, help_text='Id da última mensagem vista', verbose_name='Cursor de Leitura'),
+        ),
+        migrations.AddIndex(
+            model_name='mensagem',
+            index=models.Index(fields=['sala', 'id'], name='mensagens_m_sala_id_e97b43_idx'),
+        ),
+        migrations.RunPython(iniciar_cursores, migrations.RunPython.noop),
+    ]
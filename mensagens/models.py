@@ -3,6 +3,8 @@ Modelos para Sistema de Chat/Mensagens de Campanhas
 """
 
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -166,6 +168,13 @@ class ParticipacaoChat(models.Model):
         help_text=_("Timestamp da última mensagem visualizada")
     )
     
+    # Cursor de leitura: as não lidas são as mensagens da sala com id maior
+    cursor_leitura = models.PositiveBigIntegerField(
+        _("Cursor de Leitura"),
+        default=0,
+        help_text=_("Id da última mensagem vista")
+    )
+    
     # Configurações pessoais
     notificacoes_habilitadas = models.BooleanField(
         _("Notificações"),
@@ -196,18 +205,51 @@ class ParticipacaoChat(models.Model):
     
     def atualizar_ultima_mensagem_vista(self):
         """Atualizar timestamp da última mensagem vista"""
+        self.marcar_como_lida()
+    
+    @classmethod
+    def avancar_cursor(cls, sala_id, usuario_id, mensagem_id):
+        """
+        Avança o cursor de leitura do usuário até mensagem_id num único UPDATE
+        (nunca recua); retorna quantas participações foram atualizadas
+        """
+        return cls.objects.filter(sala_id=sala_id, usuario_id=usuario_id).update(
+            cursor_leitura=Greatest(F('cursor_leitura'), Value(mensagem_id)),
+            ultima_mensagem_vista=timezone.now()
+        )
+    
+    @classmethod
+    async def aavancar_cursor(cls, sala_id, usuario_id, mensagem_id):
+        """Versão assíncrona de avancar_cursor"""
+        return await cls.objects.filter(sala_id=sala_id, usuario_id=usuario_id).aupdate(
+            cursor_leitura=Greatest(F('cursor_leitura'), Value(mensagem_id)),
+            ultima_mensagem_vista=timezone.now()
+        )
+    
+    def marcar_como_lida(self):
+        """Marcar todas as mensagens da sala como lidas"""
+        ultima = Mensagem.objects.filter(sala_id=self.sala_id).order_by('-id').values_list('id', flat=True).first()
+        self.cursor_leitura = max(self.cursor_leitura, ultima or 0)
         self.ultima_mensagem_vista = timezone.now()
-        self.save()
+        self.save(update_fields=['cursor_leitura', 'ultima_mensagem_vista'])
+    
+    async def amarcar_como_lida(self):
+        """Versão assíncrona de marcar_como_lida"""
+        ultima = await Mensagem.objects.filter(sala_id=self.sala_id).order_by('-id').values_list('id', flat=True).afirst()
+        self.cursor_leitura = max(self.cursor_leitura, ultima or 0)
+        self.ultima_mensagem_vista = timezone.now()
+        await self.asave(update_fields=['cursor_leitura', 'ultima_mensagem_vista'])
+    
+    def filtro_nao_lidas(self):
+        """Mensagens depois do cursor visíveis ao usuário (exceto as próprias e sussurros alheios)"""
+        return Q(id__gt=self.cursor_leitura) & ~Q(usuario_id=self.usuario_id) & (
+            Q(destinatario__isnull=True) | Q(destinatario_id=self.usuario_id)
+        )
     
     @property
     def mensagens_nao_lidas(self):
-        """Contar mensagens não lidas"""
-        if not self.ultima_mensagem_vista:
-            return self.sala.mensagens.count()
-        
-        return self.sala.mensagens.filter(
-            timestamp__gt=self.ultima_mensagem_vista
-        ).count()
+        """Contar mensagens não lidas (derivado do cursor; enviar mensagem não escreve aqui)"""
+        return Mensagem.objects.filter(self.filtro_nao_lidas(), sala_id=self.sala_id).count()
 
 
 class Mensagem(models.Model):
@@ -306,6 +348,7 @@ class Mensagem(models.Model):
         ordering = ['timestamp']
         indexes = [
             models.Index(fields=['sala', 'timestamp']),
+            models.Index(fields=['sala', 'id']),
             models.Index(fields=['usuario', 'tipo']),
             models.Index(fields=['sala', 'tipo', 'timestamp']),
         ]
@@ -0,0 +1,110 @@
+"""
+Agregação de digitação e presença por sala de chat
+Coalesce as mudanças de estado e publica um 'presence_snapshot' periódico por sala
+"""
+
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_ESTADO = ('online', 'digitando')
+
+
+class AgregadorPresenca:
+    """
+    Estado de presença pendente de uma sala neste processo
+
+    Cada tecla, entrada ou saída só atualiza o estado em memória; a cada
+    CHAT_PRESENCA_INTERVALO segundos as mudanças viram um único evento no grupo
+    da sala, já codificado em JSON. Transições que voltam ao último estado
+    publicado dentro da mesma janela (ex.: digitando → parou → digitando) não
+    geram nada.
+    """
+
+    def __init__(self, sala_id: int):
+        self.sala_id = sala_id
+        self.group_name = f'chat_sala_{sala_id}'
+        self.pendentes: Dict[int, Dict] = {}
+        self.publicados: Dict[int, Dict[str, bool]] = {}
+        self.tarefa: Optional[asyncio.Task] = None
+
+    def registrar(self, usuario_id: int, usuario_nome: str, **estado: bool):
+        """Anotar o estado atual de um usuário (online e/ou digitando)"""
+        pendente = self.pendentes.setdefault(usuario_id, {'usuario_nome': usuario_nome})
+        pendente['usuario_nome'] = usuario_nome
+        pendente.update(estado)
+        self._agendar()
+
+    def _agendar(self):
+        loop = asyncio.get_running_loop()
+        if self.tarefa is None or self.tarefa.done() or self.tarefa.get_loop() is not loop:
+            self.tarefa = loop.create_task(self._publicar_periodicamente())
+
+    async def _publicar_periodicamente(self):
+        intervalo = getattr(settings, 'CHAT_PRESENCA_INTERVALO', 0.5)
+        while self.pendentes:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.publicar()
+            except Exception as e:
+                logger.warning(f"Falha ao publicar presença da sala {self.sala_id}: {e}")
+        # Sala sem ninguém online nem digitando: o agregador não guarda mais nada
+        if not self.publicados and _agregadores.get(self.sala_id) is self:
+            del _agregadores[self.sala_id]
+
+    def montar_snapshot(self) -> Optional[Dict]:
+        """Consumir as mudanças pendentes; None se nenhuma altera o estado publicado"""
+        pendentes, self.pendentes = self.pendentes, {}
+        usuarios = []
+        for usuario_id, pendente in pendentes.items():
+            publicado = self.publicados.setdefault(usuario_id, {'online': False, 'digitando': False})
+            alteracoes = {
+                campo: pendente[campo] for campo in CAMPOS_ESTADO
+                if campo in pendente and pendente[campo] != publicado[campo]
+            }
+            publicado.update(alteracoes)
+            if not publicado['online'] and not publicado['digitando']:
+                del self.publicados[usuario_id]
+            if alteracoes:
+                usuarios.append({'usuario_id': usuario_id, 'usuario_nome': pendente['usuario_nome'], **alteracoes})
+
+        if not usuarios:
+            return None
+        return {
+            'type': 'presence_snapshot',
+            'sala_id': self.sala_id,
+            'usuarios': usuarios,
+            'timestamp': timezone.now().isoformat()
+        }
+
+    async def publicar(self):
+        """Enviar o snapshot pendente ao grupo da sala (uma única codificação)"""
+        snapshot = self.montar_snapshot()
+        channel_layer = get_channel_layer()
+        if snapshot is None or channel_layer is None:
+            return
+        await channel_layer.group_send(
+            self.group_name,
+            {
+                'type': 'presence_snapshot',
+                'texto': json.dumps(snapshot)
+            }
+        )
+
+
+_agregadores: Dict[int, AgregadorPresenca] = {}
+
+
+def obter_agregador(sala_id: int) -> AgregadorPresenca:
+    """Agregador da sala neste processo"""
+    agregador = _agregadores.get(sala_id)
+    if agregador is None:
+        agregador = _agregadores[sala_id] = AgregadorPresenca(sala_id)
+    return agregador
@@ -103,6 +103,64 @@ class MensagemListSerializer(serializers.ModelSerializer):
         return 'Sistema'
 
 
+def _dados_usuario(usuario):
+    if usuario is None:
+        return None
+    return {
+        'id': usuario.id,
+        'username': usuario.username,
+        'nome_completo': usuario.get_full_name()
+    }
+
+
+def _dados_personagem(personagem):
+    if personagem is None:
+        return None
+    return {
+        'id': personagem.id,
+        'nome': personagem.nome
+    }
+
+
+def _dados_rolagem(rolagem):
+    if rolagem is None:
+        return None
+    return {
+        'id': rolagem.id,
+        'expressao': rolagem.expressao,
+        'resultado': rolagem.resultado_final,
+        'resultados_individuais': rolagem.resultados_individuais
+    }
+
+
+_campo_data = serializers.DateTimeField()
+
+
+def dados_mensagem(mensagem: Mensagem) -> dict:
+    """
+    Mesmo formato do MensagemDetailSerializer, montado direto dos atributos
+    
+    Não faz consultas quando os relacionamentos já estão carregados na
+    instância (ex.: mensagem recém-criada com usuario/personagem/destinatario
+    passados como objetos), por isso serve para o broadcast do WebSocket.
+    """
+    return {
+        'id': mensagem.id,
+        'tipo': mensagem.tipo,
+        'conteudo': mensagem.conteudo,
+        'usuario': _dados_usuario(mensagem.usuario),
+        'destinatario': _dados_usuario(mensagem.destinatario),
+        'personagem': _dados_personagem(mensagem.personagem),
+        'rolagem': _dados_rolagem(mensagem.rolagem),
+        'metadados': mensagem.metadados,
+        'editada': mensagem.editada,
+        'timestamp': _campo_data.to_representation(mensagem.timestamp),
+        'timestamp_edicao': (
+            _campo_data.to_representation(mensagem.timestamp_edicao) if mensagem.timestamp_edicao else None
+        ),
+    }
+
+
 class MensagemDetailSerializer(serializers.ModelSerializer):
     """Serializer detalhado para mensagem"""
     
@@ -121,43 +179,19 @@ class MensagemDetailSerializer(serializers.ModelSerializer):
     
     def get_usuario(self, obj):
         """Dados do usuário"""
-        if obj.usuario:
-            return {
-                'id': obj.usuario.id,
-                'username': obj.usuario.username,
-                'nome_completo': obj.usuario.get_full_name()
-            }
-        return None
+        return _dados_usuario(obj.usuario)
     
     def get_destinatario(self, obj):
         """Dados do destinatário (whisper)"""
-        if obj.destinatario:
-            return {
-                'id': obj.destinatario.id,
-                'username': obj.destinatario.username,
-                'nome_completo': obj.destinatario.get_full_name()
-            }
-        return None
+        return _dados_usuario(obj.destinatario)
     
     def get_personagem(self, obj):
         """Dados do personagem"""
-        if obj.personagem:
-            return {
-                'id': obj.personagem.id,
-                'nome': obj.personagem.nome
-            }
-        return None
+        return _dados_personagem(obj.personagem)
     
     def get_rolagem(self, obj):
         """Dados da rolagem"""
-        if obj.rolagem:
-            return {
-                'id': obj.rolagem.id,
-                'expressao': obj.rolagem.expressao,
-                'resultado': obj.rolagem.resultado_final,
-                'resultados_individuais': obj.rolagem.resultados_individuais
-            }
-        return None
+        return _dados_rolagem(obj.rolagem)
 
 
 class EnviarMensagemSerializer(serializers.Serializer):
@@ -1,3 +1,254 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from campanhas.models import Campanha, ParticipacaoCampanha
+from personagens.models import Personagem
+from sistema_unificado.models import SistemaJogo
+from .consumers import ChatConsumer, ContextoConexao, PapelChat, codificar_chat_message
+from .models import Mensagem, ParticipacaoChat, SalaChat
+from .presence import AgregadorPresenca, _agregadores, obter_agregador
+from .serializers import MensagemDetailSerializer, dados_mensagem
+
+
+class CursorLeituraTestCase(TestCase):
+    """Mensagens não lidas derivadas do cursor de leitura de cada participante"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.usuarios = [User.objects.create_user(username=f'usuario{i}') for i in range(4)]
+        sistema = SistemaJogo.objects.create(nome='D&D 5e', codigo='dnd5e', versao='5.1')
+        campanha = Campanha.objects.create(
+            nome='Campanha de Teste', descricao='Teste', organizador=self.usuarios[0], sistema_jogo=sistema
+        )
+        self.sala = SalaChat.objects.create(campanha=campanha, nome='Taverna')
+        self.participacoes = [
+            ParticipacaoChat.objects.create(sala=self.sala, usuario=usuario) for usuario in self.usuarios
+        ]
+
+    def enviar(self, usuario, conteudo, destinatario=None):
+        mensagem = Mensagem.objects.create(
+            sala=self.sala, usuario=usuario, conteudo=conteudo, destinatario=destinatario
+        )
+        ParticipacaoChat.avancar_cursor(self.sala.id, usuario.id, mensagem.id)
+        return mensagem
+
+    def test_envio_nao_escreve_nos_outros_participantes(self):
+        mensagem = Mensagem.objects.create(sala=self.sala, usuario=self.usuarios[0], conteudo='Olá')
+
+        with self.assertNumQueries(1):
+            ParticipacaoChat.avancar_cursor(self.sala.id, self.usuarios[0].id, mensagem.id)
+
+        self.participacoes[0].refresh_from_db()
+        self.assertEqual(self.participacoes[0].cursor_leitura, mensagem.id)
+        self.assertEqual(self.participacoes[0].mensagens_nao_lidas, 0)
+        self.assertEqual([p.mensagens_nao_lidas for p in self.participacoes[1:]], [1, 1, 1])
+
+    def test_nao_lidas_ignoram_proprias_e_sussurros_alheios(self):
+        self.enviar(self.usuarios[0], 'Entrem na taverna')
+        self.enviar(self.usuarios[1], 'Sigo o mestre')
+        self.enviar(self.usuarios[0], 'Psst', destinatario=self.usuarios[2])
+
+        nao_lidas = [ParticipacaoChat.objects.get(pk=p.pk).mensagens_nao_lidas for p in self.participacoes]
+        # Quem envia tem o cursor avançado até a própria mensagem
+        self.assertEqual(nao_lidas, [0, 0, 3, 2])
+
+    def test_marcar_como_lida_e_cursor_nao_recua(self):
+        primeira = self.enviar(self.usuarios[0], 'Primeira')
+        self.enviar(self.usuarios[0], 'Segunda')
+        participacao = self.participacoes[3]
+
+        participacao.marcar_como_lida()
+        ParticipacaoChat.avancar_cursor(self.sala.id, self.usuarios[3].id, primeira.id)
+
+        participacao.refresh_from_db()
+        self.assertEqual(participacao.mensagens_nao_lidas, 0)
+        self.assertEqual(participacao.cursor_leitura, Mensagem.objects.latest('id').id)
+
+
+class PayloadMensagemTestCase(CursorLeituraTestCase):
+    """Payload de broadcast montado sem consultas"""
+
+    def test_payload_igual_ao_serializer_sem_consultas(self):
+        personagem = Personagem.objects.create(
+            nome='Aria', usuario=self.usuarios[1], campanha=self.sala.campanha,
+            sistema_jogo=self.sala.campanha.sistema_jogo
+        )
+        mensagem = Mensagem.objects.create(
+            sala=self.sala, usuario=self.usuarios[1], personagem=personagem,
+            destinatario=self.usuarios[2], conteudo='Psst'
+        )
+
+        with self.assertNumQueries(0):
+            payload = dados_mensagem(mensagem)
+
+        self.assertEqual(payload, MensagemDetailSerializer(Mensagem.objects.get(pk=mensagem.pk)).data)
+        self.assertEqual(payload['personagem'], {'id': personagem.id, 'nome': 'Aria'})
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class QuadroPreCodificadoTestCase(SimpleTestCase):
+    """Mensagem serializada uma vez e repassada como texto a cada socket"""
+
+    def criar_consumer(self, usuario_id):
+        consumer = ChatConsumer()
+        consumer.user = mock.Mock(id=usuario_id)
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def test_consumers_escrevem_o_quadro_sem_reserializar(self):
+        quadro = codificar_chat_message({'id': 1, 'conteudo': 'Olá'})
+        consumers = [self.criar_consumer(i) for i in range(3)]
+
+        async def cenario():
+            layer = get_channel_layer()
+            canais = [await layer.new_channel() for _ in consumers]
+            for canal in canais:
+                await layer.group_add('chat_sala_1', canal)
+            await layer.group_send('chat_sala_1', {'type': 'chat_message', 'texto': quadro})
+            for consumer, canal in zip(consumers, canais):
+                await consumer.chat_message(await layer.receive(canal))
+
+        with mock.patch('mensagens.consumers.json') as json_consumer:
+            asyncio.run(cenario())
+
+        json_consumer.dumps.assert_not_called()
+        for consumer in consumers:
+            consumer.send.assert_awaited_once_with(text_data=quadro)
+        self.assertEqual(json.loads(quadro), {'type': 'chat_message', 'mensagem': {'id': 1, 'conteudo': 'Olá'}})
+
+    def test_whisper_so_para_o_destinatario(self):
+        quadro = codificar_chat_message({'id': 2})
+        destinatario, outro = self.criar_consumer(5), self.criar_consumer(6)
+        evento = {'type': 'whisper_message', 'texto': quadro, 'destinatario_id': 5}
+
+        asyncio.run(destinatario.whisper_message(evento))
+        asyncio.run(outro.whisper_message(evento))
+
+        destinatario.send.assert_awaited_once_with(text_data=quadro)
+        outro.send.assert_not_awaited()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ContextoConexaoTestCase(CursorLeituraTestCase):
+    """Identidade e permissões resolvidas no connect e recarregadas por invalidação"""
+
+    async def conectar(self, usuario):
+        consumer = ChatConsumer()
+        consumer.scope = {'user': usuario, 'url_route': {'kwargs': {'sala_id': self.sala.id}}}
+        consumer.channel_layer = get_channel_layer()
+        consumer.channel_name = await consumer.channel_layer.new_channel()
+        consumer.base_send = mock.AsyncMock()
+        await consumer.connect()
+        return consumer
+
+    @staticmethod
+    def enviados(consumer):
+        return [c.args[0] for c in consumer.base_send.await_args_list]
+
+    def test_silenciamento_vale_apos_invalidacao(self):
+        jogador = self.usuarios[1]
+        ParticipacaoCampanha.objects.create(campanha=self.sala.campanha, usuario=jogador)
+        consumer = async_to_sync(self.conectar)(jogador)
+        self.assertEqual([e['type'] for e in self.enviados(consumer)], ['websocket.accept'])
+
+        with self.assertNumQueries(0):
+            async_to_sync(consumer.receive)(json.dumps({'action': 'typing', 'is_typing': True}))
+
+        ParticipacaoChat.objects.filter(sala=self.sala, usuario=jogador).update(mutado=True)
+        async_to_sync(consumer.contexto_invalidado)({'type': 'contexto_invalidado', 'usuario_id': jogador.id})
+        async_to_sync(consumer.receive)(json.dumps({'action': 'send_message', 'message': 'Olá'}))
+
+        erro = json.loads(self.enviados(consumer)[-1]['text'])
+        self.assertEqual(erro['message'], 'Você foi silenciado nesta sala')
+        self.assertFalse(Mensagem.objects.filter(sala=self.sala).exists())
+
+    async def test_acesso_restrito_a_participantes_da_campanha(self):
+        organizador = await self.conectar(self.usuarios[0])
+        self.assertEqual(organizador.contexto.papel, PapelChat.ORGANIZADOR)
+
+        estranho = await self.conectar(self.usuarios[3])
+        self.assertIsNone(estranho.contexto)
+        self.assertEqual([(e['type'], e['code']) for e in self.enviados(estranho)], [('websocket.close', 4003)])
+
+    def test_papel_do_contexto(self):
+        sala = SalaChat.objects.select_related('campanha').get(pk=self.sala.pk)
+        self.participacoes[2].is_moderador = True
+
+        contextos = [ContextoConexao(p.usuario, sala, p) for p in self.participacoes[:3]]
+
+        self.assertEqual(
+            [c.papel for c in contextos],
+            [PapelChat.ORGANIZADOR, PapelChat.JOGADOR, PapelChat.MODERADOR]
+        )
+        self.assertEqual(contextos[1].usuario_nome, 'usuario1')
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_PRESENCA_INTERVALO=0.01
+)
+class AgregadorPresencaTestCase(SimpleTestCase):
+    """Digitação e presença agrupadas num snapshot periódico por sala"""
+
+    def test_teclas_viram_um_unico_snapshot(self):
+        agregador = AgregadorPresenca(9)
+
+        async def cenario():
+            layer = get_channel_layer()
+            canal = await layer.new_channel()
+            await layer.group_add('chat_sala_9', canal)
+            agregador.registrar(1, 'Aria', online=True)
+            for _ in range(20):
+                agregador.registrar(1, 'Aria', digitando=True)
+            agregador.registrar(2, 'Borin', online=True)
+            evento = await layer.receive(canal)
+            await agregador.tarefa
+            return evento
+
+        evento = asyncio.run(cenario())
+
+        self.assertEqual(evento['type'], 'presence_snapshot')
+        snapshot = json.loads(evento['texto'])
+        self.assertEqual(snapshot['usuarios'], [
+            {'usuario_id': 1, 'usuario_nome': 'Aria', 'online': True, 'digitando': True},
+            {'usuario_id': 2, 'usuario_nome': 'Borin', 'online': True},
+        ])
+
+    def test_transicoes_redundantes_sao_descartadas(self):
+        agregador = AgregadorPresenca(9)
+        agregador.pendentes = {1: {'usuario_nome': 'Aria', 'online': True, 'digitando': True}}
+        agregador.montar_snapshot()
+
+        # Parou e voltou a digitar dentro da mesma janela
+        agregador.pendentes = {1: {'usuario_nome': 'Aria', 'digitando': True}}
+        self.assertIsNone(agregador.montar_snapshot())
+
+        # Entrou e saiu antes de ser anunciado
+        agregador.pendentes = {2: {'usuario_nome': 'Borin', 'online': False, 'digitando': False}}
+        self.assertIsNone(agregador.montar_snapshot())
+
+        agregador.pendentes = {1: {'usuario_nome': 'Aria', 'online': False, 'digitando': False}}
+        self.assertEqual(agregador.montar_snapshot()['usuarios'], [
+            {'usuario_id': 1, 'usuario_nome': 'Aria', 'online': False, 'digitando': False}
+        ])
+        self.assertEqual(agregador.publicados, {})
+
+    def test_agregador_da_sala_vazia_e_descartado(self):
+        async def cenario():
+            agregador = obter_agregador(9)
+            agregador.registrar(1, 'Aria', online=True)
+            await agregador.tarefa
+            self.assertIs(_agregadores.get(9), agregador)
+
+            agregador.registrar(1, 'Aria', online=False)
+            await agregador.tarefa
+
+        asyncio.run(cenario())
+
+        self.assertNotIn(9, _agregadores)
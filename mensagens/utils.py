@@ -2,7 +2,9 @@
 Funções utilitárias para notificações WebSocket
 """
 
-from typing import List, Dict, Any, Optional
+import time
+import uuid
+from typing import List, Dict, Any, Optional, AsyncIterator
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
@@ -143,6 +145,94 @@ def send_system_message_to_chat(sala_id: int, message: str, level: str = 'info')
     )
 
 
+def invalidar_contexto_chat(sala_id: int, usuario_id: Optional[int] = None):
+    """
+    Pedir às conexões da sala que recarreguem seu contexto (nome, papel, silenciamento, configurações)
+    
+    Args:
+        sala_id: ID da sala de chat
+        usuario_id: Apenas as conexões deste usuário; None para toda a sala
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    async_to_sync(channel_layer.group_send)(
+        f'chat_sala_{sala_id}',
+        {
+            'type': 'contexto_invalidado',
+            'usuario_id': usuario_id
+        }
+    )
+
+
+# Intervalo mínimo entre envios de pedaços de narrativa ao grupo (segundos).
+# O primeiro pedaço sai imediatamente; os seguintes são agrupados para não
+# gerar um group_send por token.
+INTERVALO_MINIMO_STREAM = 0.05
+
+
+async def transmitir_narrativa_para_chat(sala_id: int, pedacos: AsyncIterator[str],
+                                         metadata: Optional[Dict] = None) -> str:
+    """
+    Encaminhar narrativa gerada em streaming para uma sala de chat
+    
+    Cada pedaço vira um evento 'narrative_chunk' no grupo da sala; o último
+    evento tem final=True (e 'erro' se a geração falhar no meio).
+    
+    Args:
+        sala_id: ID da sala de chat
+        pedacos: Iterador assíncrono de pedaços de texto (ex.: IAClient.gerar_conteudo_stream)
+        metadata: Dados adicionais enviados com o evento final
+        
+    Returns:
+        Texto completo transmitido
+    """
+    channel_layer = get_channel_layer()
+    group_name = f'chat_sala_{sala_id}'
+    stream_id = uuid.uuid4().hex
+    partes = []
+    pendente = []
+    indice = 0
+    ultimo_envio = None
+    
+    async def enviar(conteudo: str, final: bool, erro: Optional[str] = None):
+        nonlocal indice
+        if channel_layer is None:
+            return
+        evento = {
+            'type': 'narrative_chunk',
+            'stream_id': stream_id,
+            'indice': indice,
+            'conteudo': conteudo,
+            'final': final,
+        }
+        if final:
+            evento['metadata'] = metadata or {}
+        if erro:
+            evento['erro'] = erro
+        await channel_layer.group_send(group_name, evento)
+        indice += 1
+    
+    try:
+        async for pedaco in pedacos:
+            partes.append(pedaco)
+            pendente.append(pedaco)
+            
+            agora = time.monotonic()
+            if ultimo_envio is None or agora - ultimo_envio >= INTERVALO_MINIMO_STREAM:
+                await enviar(''.join(pendente), final=False)
+                pendente = []
+                ultimo_envio = agora
+    
+    except Exception as e:
+        await enviar(''.join(pendente), final=True, erro=str(e))
+        raise
+    
+    await enviar(''.join(pendente), final=True)
+    return ''.join(partes)
+
+
 def notify_user_joined_campaign(campaign_id: int, new_user_id: int, new_user_name: str,
                                 participating_users: List[int]):
     """
@@ -19,6 +19,7 @@ from .serializers import (
     MensagemDetailSerializer, EnviarMensagemSerializer,
     ComandoChatSerializer, EstatisticasChatSerializer
 )
+from .utils import invalidar_contexto_chat
 from campanhas.models import Campanha
 from personagens.models import Personagem
 from usuarios.models import Usuario
@@ -308,34 +309,19 @@ class MensagemViewSet(viewsets.ReadOnlyModelViewSet):
                 mensagem.delete()  # Remover mensagem com erro
                 return resultado_comando
         
-        # Atualizar participação do usuário
-        try:
-            participacao = ParticipacaoChat.objects.get(
-                sala=sala,
-                usuario=usuario
-            )
-            participacao.ultima_mensagem_vista = timezone.now()
-            participacao.save()
-        except ParticipacaoChat.DoesNotExist:
+        # Atualizar o cursor de leitura do remetente; as não lidas dos outros
+        # participantes são derivadas dos cursores deles (nenhuma escrita aqui)
+        if not ParticipacaoChat.avancar_cursor(sala.id, usuario.id, mensagem.id):
             # Criar participação se não existir
             ParticipacaoChat.objects.create(
                 sala=sala,
                 usuario=usuario,
                 primeira_conexao=timezone.now(),
                 online=True,
-                ultima_mensagem_vista=timezone.now()
+                ultima_mensagem_vista=timezone.now(),
+                cursor_leitura=mensagem.id
             )
         
-        # Atualizar contador de mensagens não lidas para outros participantes
-        outros_participantes = ParticipacaoChat.objects.filter(
-            sala=sala
-        ).exclude(usuario=usuario)
-        
-        for participacao in outros_participantes:
-            if participacao.ultima_mensagem_vista < mensagem.timestamp:
-                participacao.mensagens_nao_lidas += 1
-                participacao.save()
-        
         return {'mensagem': mensagem}
     
     @action(detail=False, methods=['post'])
@@ -431,9 +417,7 @@ class MensagemViewSet(viewsets.ReadOnlyModelViewSet):
                 sala=sala,
                 usuario=request.user
             )
-            participacao.mensagens_nao_lidas = 0
-            participacao.ultima_mensagem_vista = timezone.now()
-            participacao.save()
+            participacao.marcar_como_lida()
             
             return Response({'sucesso': 'Mensagens marcadas como lidas'})
         except ParticipacaoChat.DoesNotExist:
@@ -477,6 +461,7 @@ class ParticipacaoChatViewSet(viewsets.ReadOnlyModelViewSet):
                 setattr(participacao, campo, request.data[campo])
         
         participacao.save()
+        invalidar_contexto_chat(participacao.sala_id, participacao.usuario_id)
         
         serializer = self.get_serializer(participacao)
         return Response(serializer.data)
@@ -11,9 +11,18 @@ class GameSessionManager {
         this.faseAtual = 'aguardando';
         this.personagemAtual = null;
         this.statusInterval = null;
+        this.jobTurnoPendente = null;
+        this.turnoPendente = null;
+        this.ultimoTurnoExibido = 0;
+        
+        // Status chega por WebSocket; o polling só roda sem conexão
+        this.socket = null;
+        this.socketConectado = false;
+        this.tentativasReconexao = 0;
         
         this.initializeElements();
         this.attachEventListeners();
+        this.conectarWebSocket();
         this.startStatusPolling();
     }
     
@@ -223,6 +232,7 @@ class GameSessionManager {
             if (response.sucesso) {
                 this.estado = 'encerrada';
                 this.stopStatusPolling();
+                this.fecharWebSocket();
                 this.atualizarBotoesControle();
                 this.adicionarMensagemSistema('🏁 SESSÃO ENCERRADA', 'Obrigado por jogarem!');
                 
@@ -255,12 +265,23 @@ class GameSessionManager {
             this.processarTurnoCompleto(resultado);
         }
         
+        if (resultado.turno_enfileirado) {
+            // Turno resolvido em segundo plano; o resultado chega pelo status
+            this.limparAguardandoJogadores();
+            this.aguardarTurno(resultado.job_id, resultado.numero_turno);
+        }
+        
         if (resultado.mensagem) {
             this.adicionarMensagemMestre(resultado.mensagem);
         }
     }
     
     processarTurnoCompleto(resultado) {
+        // O mesmo turno pode chegar pela resposta HTTP e pelo WebSocket
+        if (resultado.numero_turno <= this.ultimoTurnoExibido) {
+            return;
+        }
+        this.ultimoTurnoExibido = resultado.numero_turno;
         this.turnoAtual = resultado.proximo_turno;
         
         // Mostra as ações processadas
@@ -444,12 +465,114 @@ class GameSessionManager {
             const status = response.status;
             this.atualizarTurno(status.turno_atual || this.turnoAtual);
             this.mostrarAguardandoJogadores(status.aguardando_personagens?.join(', ') || '');
+            
+            const ultimoTurno = status.ultimo_turno;
+            if (this.jobTurnoPendente && ultimoTurno && ultimoTurno.job_id === this.jobTurnoPendente) {
+                this.jobTurnoPendente = null;
+                this.processarTurnoCompleto(ultimoTurno);
+            } else if (this.jobTurnoPendente && status.turno_atual === this.turnoPendente
+                       && status.fase_atual === 'aguardando_acoes') {
+                // O turno voltou a aguardar ações sem resultado: a resolução falhou
+                this.turnoFalhou({
+                    mensagem: '⚠️ **O Mestre não conseguiu resolver o turno.** Declarem suas ações novamente.'
+                });
+            }
         }
     }
     
-    // Polling de status
+    aguardarTurno(jobId, numeroTurno) {
+        this.jobTurnoPendente = jobId;
+        this.turnoPendente = numeroTurno;
+        
+        // Consulta mais frequente enquanto o turno está sendo resolvido
+        const verificar = async () => {
+            if (this.jobTurnoPendente !== jobId) {
+                return;
+            }
+            if (!this.socketConectado) {
+                await this.verificarStatus();
+            }
+            if (this.jobTurnoPendente === jobId) {
+                setTimeout(verificar, 1500);
+            }
+        };
+        setTimeout(verificar, 1500);
+    }
+    
+    turnoFalhou(dados) {
+        if (!this.jobTurnoPendente) {
+            return;
+        }
+        this.jobTurnoPendente = null;
+        this.turnoPendente = null;
+        this.adicionarMensagemSistema('❌ Erro', dados.mensagem);
+    }
+    
+    // WebSocket de status da sessão
+    conectarWebSocket() {
+        if (!window.WebSocket || this.estado === 'encerrada') {
+            return;
+        }
+        
+        const protocolo = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        this.socket = new WebSocket(`${protocolo}://${window.location.host}/ws/sessao/${this.sessaoId}/`);
+        
+        this.socket.onopen = () => {
+            this.socketConectado = true;
+            this.tentativasReconexao = 0;
+        };
+        
+        this.socket.onmessage = (event) => {
+            try {
+                this.processarEventoSessao(JSON.parse(event.data));
+            } catch (error) {
+                console.error('Erro ao processar evento da sessão:', error);
+            }
+        };
+        
+        this.socket.onclose = (event) => {
+            this.socketConectado = false;
+            this.socket = null;
+            // 4001/4003/4004: sem acesso; fica no polling
+            if (this.estado === 'encerrada' || event.code >= 4000) {
+                return;
+            }
+            const espera = Math.min(30000, 1000 * 2 ** this.tentativasReconexao);
+            this.tentativasReconexao += 1;
+            setTimeout(() => this.conectarWebSocket(), espera);
+        };
+    }
+    
+    fecharWebSocket() {
+        if (this.socket) {
+            this.socket.close();
+            this.socket = null;
+        }
+        this.socketConectado = false;
+    }
+    
+    processarEventoSessao(evento) {
+        if (evento.type === 'status_sessao') {
+            const status = evento.dados;
+            if (status.estado_sessao && status.estado_sessao !== this.estado) {
+                this.estado = status.estado_sessao;
+                this.atualizarBotoesControle();
+            }
+            this.atualizarStatus({ status });
+        } else if (evento.type === 'turno_processado') {
+            this.jobTurnoPendente = null;
+            this.processarTurnoCompleto(evento.dados);
+        } else if (evento.type === 'turno_falhou') {
+            this.turnoFalhou(evento.dados);
+        }
+    }
+    
+    // Polling de status (fallback sem WebSocket)
     startStatusPolling() {
         this.statusInterval = setInterval(async () => {
+            if (this.socketConectado) {
+                return;
+            }
             if (this.estado === 'ativa' || this.estado === 'pausada') {
                 await this.verificarStatus();
             }
@@ -1,6 +1,5 @@
 # Isso garantirá que o app do Celery seja sempre importado quando o Django iniciar
 # para que @shared_task use este app.
-# TODO: Instalar celery e descomentar
-# from .celery import app as celery_app
+from .celery import app as celery_app
 
-# __all__ = ('celery_app',)
+__all__ = ('celery_app',)
@@ -19,8 +19,30 @@ try:
 except ImportError:
     websocket_urlpatterns = []
 
+try:
+    from ia_gm.routing import websocket_urlpatterns as ia_gm_websocket_urlpatterns
+    websocket_urlpatterns = websocket_urlpatterns + ia_gm_websocket_urlpatterns
+except ImportError:
+    pass
+
+
+async def lifespan_app(scope, receive, send):
+    """Trata o protocolo lifespan do servidor ASGI (startup/shutdown)"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Fecha os pools HTTP keep-alive dos provedores de IA
+            from ia_gm.ai_client import fechar_conexoes_ia
+            await fechar_conexoes_ia()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": lifespan_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(websocket_urlpatterns)
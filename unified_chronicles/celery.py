@@ -5,6 +5,7 @@ Usado para processamento assíncrono de IA e outras tarefas pesadas
 
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 # Define o módulo de configurações Django para o programa 'celery'
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'unified_chronicles.settings')
@@ -25,6 +26,13 @@ def debug_task(self):
     """Tarefa de debug para testar o Celery"""
     print(f'Request: {self.request!r}')
 
+
+@worker_process_shutdown.connect
+def fechar_conexoes_ia_worker(**kwargs):
+    """Fecha os pools HTTP dos provedores de IA ao encerrar o processo do worker"""
+    from ia_gm.ai_client import fechar_conexoes_ia_sync
+    fechar_conexoes_ia_sync()
+
 # Configurações específicas para IA
 app.conf.update(
     task_serializer='json',
@@ -34,6 +42,8 @@ app.conf.update(
     enable_utc=True,
     task_routes={
         'ia_gm.tasks.processar_mensagem_ia': {'queue': 'ia_gm'},
+        'ia_gm.tasks.processar_turno_ia': {'queue': 'ia_gm'},
+        'ia_gm.tasks.compactar_memoria_sessao': {'queue': 'ia_gm'},
         'ia_gm.tasks.gerar_imagem': {'queue': 'imagens'},
     },
     worker_prefetch_multiplier=1,
@@ -118,6 +118,10 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Presença no chat: digitação e entradas/saídas de cada sala são agrupadas e
+# publicadas num único 'presence_snapshot' a cada CHAT_PRESENCA_INTERVALO segundos
+CHAT_PRESENCA_INTERVALO = config('CHAT_PRESENCA_INTERVALO', default=0.5, cast=float)
+
 # Celery Configuration
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL)
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=REDIS_URL)
@@ -131,7 +135,17 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # Cache de respostas da IA: compartilhado entre workers via Redis quando
+    # IA_GM_CACHE_REDIS=True (padrão fora de DEBUG); local em desenvolvimento
+    'ia_gm': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'uc',
+    } if config('IA_GM_CACHE_REDIS', default=not DEBUG, cast=bool) else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ia-gm-cache',
+    },
 }
 # TODO: Configurar Redis quando instalar django_redis
 # CACHES = {
@@ -237,6 +251,107 @@ IA_GM_MAX_TOKENS = config('IA_GM_MAX_TOKENS', default=2000, cast=int)
 IA_GM_TEMPERATURE = config('IA_GM_TEMPERATURE', default=0.8, cast=float)
 IA_GM_MAX_RETRIES = config('IA_GM_MAX_RETRIES', default=3, cast=int)
 
+# Marca o prefixo de sistema (regras do Mestre + campanha) para o cache de
+# prompt do provedor (cache_control na Anthropic, prompt_cache_key na OpenAI)
+IA_GM_CACHE_PROMPT_PROVEDOR = config('IA_GM_CACHE_PROMPT_PROVEDOR', default=True, cast=bool)
+
+# Histórico de conversa com a IA por sessão (IAClient.conversar): teto de tokens
+# do histórico enviado (turnos antigos saem pelo início) e validade no cache
+IA_GM_CONVERSA_MAX_TOKENS = config('IA_GM_CONVERSA_MAX_TOKENS', default=4000, cast=int)
+IA_GM_CONVERSA_TIMEOUT = config('IA_GM_CONVERSA_TIMEOUT', default=21600, cast=int)  # 6 horas
+
+# Geração em lote (api/gerar-conteudo-lote/): itens por requisição e gerações
+# simultâneas por lote
+IA_GM_LOTE_MAXIMO = config('IA_GM_LOTE_MAXIMO', default=50, cast=int)
+IA_GM_LOTE_CONCORRENCIA = config('IA_GM_LOTE_CONCORRENCIA', default=4, cast=int)
+
+# Requisições "hedged": se o provedor não responder em IA_GM_HEDGE_LIMIAR
+# segundos (~p95 de latência), o próximo é disparado em paralelo
+IA_GM_HEDGE_ATIVO = config('IA_GM_HEDGE_ATIVO', default=False, cast=bool)
+IA_GM_HEDGE_LIMIAR = config('IA_GM_HEDGE_LIMIAR', default=4.0, cast=float)
+
+# Circuit breaker por provedor (estado compartilhado pelo cache 'ia_gm')
+IA_GM_CIRCUITO_LIMIAR_FALHAS = config('IA_GM_CIRCUITO_LIMIAR_FALHAS', default=5, cast=int)
+IA_GM_CIRCUITO_JANELA = config('IA_GM_CIRCUITO_JANELA', default=60, cast=int)
+IA_GM_CIRCUITO_TEMPO_ABERTO = config('IA_GM_CIRCUITO_TEMPO_ABERTO', default=30, cast=int)
+
+# Timeouts adaptativos: 2x o p99 da latência recente, limitado a [MINIMO, MAXIMO];
+# PADRAO vale enquanto não há amostras suficientes
+IA_GM_TIMEOUT_PADRAO = config('IA_GM_TIMEOUT_PADRAO', default=60.0, cast=float)
+IA_GM_TIMEOUT_MINIMO = config('IA_GM_TIMEOUT_MINIMO', default=5.0, cast=float)
+IA_GM_TIMEOUT_MAXIMO = config('IA_GM_TIMEOUT_MAXIMO', default=120.0, cast=float)
+
+# Single-flight de prompts idênticos entre workers (lock no cache 'ia_gm';
+# requer cache compartilhado, ex.: IA_GM_CACHE_REDIS=True)
+IA_GM_SINGLE_FLIGHT_DISTRIBUIDO = config('IA_GM_SINGLE_FLIGHT_DISTRIBUIDO', default=False, cast=bool)
+IA_GM_SINGLE_FLIGHT_INTERVALO = config('IA_GM_SINGLE_FLIGHT_INTERVALO', default=0.1, cast=float)
+
+# Limites de taxa (token bucket) por provedor e por campanha; chamadas perto do
+# limite aguardam na fila e só falham se a espera passar de IA_GM_LIMITE_ESPERA_MAXIMA.
+# Valem para a instalação inteira com IA_GM_CACHE_REDIS=True (senão, por processo)
+IA_GM_LIMITES_TAXA = {
+    'openai': {
+        'requisicoes_por_minuto': config('IA_GM_OPENAI_RPM', default=500, cast=int),
+        'tokens_por_minuto': config('IA_GM_OPENAI_TPM', default=90000, cast=int),
+    },
+    'anthropic': {
+        'requisicoes_por_minuto': config('IA_GM_ANTHROPIC_RPM', default=50, cast=int),
+        'tokens_por_minuto': config('IA_GM_ANTHROPIC_TPM', default=40000, cast=int),
+    },
+}
+IA_GM_LIMITES_TAXA_CAMPANHA = {
+    'requisicoes_por_minuto': config('IA_GM_CAMPANHA_RPM', default=30, cast=int),
+    'tokens_por_minuto': config('IA_GM_CAMPANHA_TPM', default=30000, cast=int),
+}
+IA_GM_LIMITE_ESPERA_MAXIMA = config('IA_GM_LIMITE_ESPERA_MAXIMA', default=30.0, cast=float)
+# Orçamento mensal de IA por campanha em US$ (0 = sem limite)
+IA_GM_ORCAMENTO_MENSAL_CAMPANHA = config('IA_GM_ORCAMENTO_MENSAL_CAMPANHA', default=0.0, cast=float)
+# Segundos até o total mensal em cache ser recalculado a partir do livro-razão
+IA_GM_CUSTO_CACHE_TTL = config('IA_GM_CUSTO_CACHE_TTL', default=60, cast=int)
+
+# Orçamento de tokens dos prompts: a janela do modelo menos a resposta, limitada
+# a este teto; seções de menor prioridade (interações antigas, memórias menos
+# importantes) são cortadas para caber. A contagem usa o tiktoken (requirements.txt;
+# sem ele, uma aproximação em Python puro). Modelos Claude não têm BPE público e
+# são contados com o cl100k_base, uma aproximação com folga de MARGEM_SEGURANCA.
+IA_GM_ORCAMENTO_PROMPT_MAXIMO = config('IA_GM_ORCAMENTO_PROMPT_MAXIMO', default=6000, cast=int)
+# Janela de contexto por prefixo de modelo, somada aos padrões de ia_gm/tokenizer.py
+IA_GM_LIMITES_CONTEXTO = {}
+
+# Pool de conexões HTTP (keep-alive) por provedor de IA
+# Chaves aceitas: limite_conexoes, limite_por_host, keepalive_timeout
+IA_GM_LIMITES_CONEXAO = {
+    'openai': {
+        'limite_conexoes': config('IA_GM_OPENAI_MAX_CONEXOES', default=100, cast=int),
+        'limite_por_host': config('IA_GM_OPENAI_MAX_CONEXOES_HOST', default=20, cast=int),
+    },
+    'anthropic': {
+        'limite_conexoes': config('IA_GM_ANTHROPIC_MAX_CONEXOES', default=100, cast=int),
+        'limite_por_host': config('IA_GM_ANTHROPIC_MAX_CONEXOES_HOST', default=20, cast=int),
+    },
+    'local': {
+        'limite_conexoes': config('IA_GM_LOCAL_MAX_CONEXOES', default=10, cast=int),
+        'limite_por_host': config('IA_GM_LOCAL_MAX_CONEXOES_HOST', default=4, cast=int),
+    },
+}
+
+# Interações do loop de jogo são gravadas em lote (bulk_create) ao fim de cada
+# turno, ou antes disso ao acumular IA_GM_INTERACOES_LOTE
+IA_GM_INTERACOES_LOTE = config('IA_GM_INTERACOES_LOTE', default=50, cast=int)
+
+# Memória narrativa: cada IA_GM_MEMORIA_BLOCO interações antigas viram um resumo
+# (em segundo plano, fila 'ia_gm') e cada IA_GM_MEMORIA_FATOR resumos de um nível
+# viram um do nível acima; as IA_GM_MEMORIA_RECENTES últimas entram sem resumo
+IA_GM_MEMORIA_BLOCO = config('IA_GM_MEMORIA_BLOCO', default=20, cast=int)
+IA_GM_MEMORIA_FATOR = config('IA_GM_MEMORIA_FATOR', default=4, cast=int)
+IA_GM_MEMORIA_RECENTES = config('IA_GM_MEMORIA_RECENTES', default=5, cast=int)
+# Busca de memórias relevantes: BM25 por padrão; um embedding local opcional
+# (caminho pontuado de uma função textos -> vetores) é misturado com peso IA_GM_EMBEDDING_PESO
+IA_GM_EMBEDDING_MEMORIA = config('IA_GM_EMBEDDING_MEMORIA', default='')
+IA_GM_EMBEDDING_PESO = config('IA_GM_EMBEDDING_PESO', default=0.5, cast=float)
+# Quantas campanhas cada processo mantém com índice de memórias carregado
+IA_GM_MEMORIA_INDICES_MAX = config('IA_GM_MEMORIA_INDICES_MAX', default=256, cast=int)
+
 # Upload Settings
 MAX_UPLOAD_SIZE = config('MAX_UPLOAD_SIZE', default=10485760, cast=int)  # 10MB
 ALLOWED_EXTENSIONS = config(